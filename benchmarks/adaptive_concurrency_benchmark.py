@@ -0,0 +1,100 @@
+"""
+Crawls the local mock listing server in its throttling mode (a fixed number of
+requests served at once, 429 beyond it, latency growing with the load) with a
+small fixed worker pool, a large fixed worker pool, and the large pool under
+adaptive concurrency control, and reports time, 429 responses, failed listings
+and the window the controller settled on.
+
+It doubles as the check of AdaptiveConcurrency against a throttling server: it exits
+with status 1 if the adaptive crawl gets more than --max-throttled 429 responses,
+ends with a window above the server's capacity or misses a listing.
+
+Usage: python benchmarks/adaptive_concurrency_benchmark.py [--pages 6] [--capacity 12] [--workers 48] [--max-throttled 20]
+"""
+import os
+import sys
+import io
+import time
+import argparse
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web_scraper import condo_crawler
+from http_transport import HttpTransport
+from mock_listing_server import MockListingServer
+
+
+def throttled_crawl(server, args, max_workers, adaptive = False):
+
+    crawler, field_names = condo_crawler('Toronto', server.main_link(), args.pages, args.per_page)
+    # Short backoff so fixed concurrency is not dominated by waiting out retries
+    crawler.set_transport(HttpTransport(max_retries = 6, backoff_factor = 0.05, max_backoff = 1))
+    if adaptive:
+        crawler.set_adaptive_concurrency(max_workers, initial_window = args.initial_window)
+    else:
+        crawler.set_concurrency(max_workers)
+
+    requests_before, throttled_before = server.request_count, server.throttled_count
+    start_time = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        crawler.crawl()
+    elapsed = time.perf_counter() - start_time
+
+    rows = sum(1 for row in crawler.data if row.get('Address') not in (None, ""))
+    windows = [value['value'] for value in crawler.metrics.snapshot()['values'] if value['name'] == 'concurrency_window']
+    return {'seconds': elapsed, 'requests': server.request_count - requests_before,
+            'throttled': server.throttled_count - throttled_before, 'rows': rows, 'windows': windows}
+
+
+def adaptive_checks(run, args):
+    """
+    Returns the list of (check, value, bound, passed) of the adaptive crawl.
+    """
+    listings = args.pages*args.per_page
+    window = max(run['windows']) if run['windows'] else None
+
+    return [("429 responses", run['throttled'], "<= " + str(args.max_throttled), run['throttled'] <= args.max_throttled),
+            ("final window", window, "<= " + str(args.capacity), window != None and window <= args.capacity),
+            ("listings scraped", run['rows'], "== " + str(listings), run['rows'] == listings)]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type = int, default = 6)
+    parser.add_argument("--per-page", type = int, default = 46)
+    parser.add_argument("--capacity", type = int, default = 12, help = "Requests the server serves at once")
+    parser.add_argument("--latency", type = float, default = 0.05)
+    parser.add_argument("--load-latency", type = float, default = 0.01, help = "Latency added per request in flight")
+    parser.add_argument("--initial-window", type = int, default = 16,
+                        help = "Above the capacity, so the controller has to back off from 429s first")
+    parser.add_argument("--low-workers", type = int, default = 4)
+    parser.add_argument("--workers", type = int, default = 48)
+    parser.add_argument("--max-throttled", type = int, default = 20, help = "429 responses the adaptive crawl may get")
+    args = parser.parse_args()
+
+    with MockListingServer(pages = args.pages, per_page = args.per_page, latency = args.latency,
+                           capacity = args.capacity, load_latency = args.load_latency) as server:
+        runs = [("Fixed " + str(args.low_workers) + " workers", throttled_crawl(server, args, args.low_workers)),
+                ("Fixed " + str(args.workers) + " workers", throttled_crawl(server, args, args.workers)),
+                ("Adaptive, up to " + str(args.workers), throttled_crawl(server, args, args.workers, adaptive = True))]
+
+    print("{:d} listings, server capacity {:d} requests at once".format(args.pages*args.per_page, args.capacity))
+    for name, run in runs:
+        print("{:<20s} {:6.2f}s  {:5d} requests  {:5d} x 429  {:5d} rows  window {}".format(
+              name + ":", run['seconds'], run['requests'], run['throttled'], run['rows'],
+              ", ".join(str(window) for window in run['windows']) or "-"))
+
+    checks = adaptive_checks(runs[-1][1], args)
+    print("")
+    for check, value, bound, passed in checks:
+        print("{:<6s} {:<20s} {:>8} {}".format("ok" if passed else "FAIL", check, str(value), bound))
+
+    if not all(passed for _, _, _, passed in checks):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,88 @@
+"""
+Cold start of a pickled model against the memory-mapped model artifact: file size,
+import + load time and memory of a fresh process that loads the model and predicts once,
+and a check that both predict the same prices.
+
+Usage: python benchmarks/artifact_benchmark.py [--trees 300]
+"""
+import os
+import sys
+import io
+import json
+import argparse
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import condo_model
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a fresh interpreter for every measurement
+COLD_START = """
+import sys, time, json
+
+def rss_mb():
+    with open("/proc/self/status") as file:
+        return [int(line.split()[1]) for line in file if line.startswith("VmRSS")][0]/1024
+
+sys.path.insert(0, {root!r})
+before = rss_mb()
+start_time = time.perf_counter()
+import condo_model
+model = condo_model.load_model({path!r})
+loaded = time.perf_counter()
+model.predict_records([{{'floor_area': 850, 'bathrooms': 1, 'bedrooms': 1.5, 'condo_fees': 550}}])
+print(json.dumps({{'load_ms': 1000*(loaded - start_time), 'first_prediction_ms': 1000*(time.perf_counter() - loaded),
+                  'rss_mb': rss_mb() - before}}))
+"""
+
+
+def size_mb(path):
+
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))/1e6
+    return os.path.getsize(path)/1e6
+
+
+def cold_start(path):
+
+    output = subprocess.run([sys.executable, "-c", COLD_START.format(root = ROOT_DIR, path = path)],
+                            capture_output = True, text = True, check = True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trees", type = int, default = 300)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with redirect_stdout(io.StringIO()):
+            condos = condo_model.load_training_table(os.path.join(ROOT_DIR, "TorontoCondos-August2020.csv"),
+                                                     os.path.join(temp_dir, "geocode.sqlite"),
+                                                     seed = os.path.join(ROOT_DIR, "condo_coordinates.txt"))
+        model = condo_model.train(condos, params = {'n_estimators': args.trees}, random_state = 0)
+
+        paths = {'pickle': os.path.join(temp_dir, "model.pkl"), 'artifact': os.path.join(temp_dir, "model.model")}
+        for path in paths.values():
+            condo_model.save_model(model, path)
+
+        X = condo_model.training_table(condos)[model.input_cols].to_numpy()
+        difference = np.abs(condo_model.load_model(paths['artifact']).predict(X) - model.predict(X)).max()
+
+        print("Forest of {} trees, max prediction difference {:.2e}\n".format(args.trees, difference))
+        for name, path in paths.items():
+            result = cold_start(path)
+            print("{:<9s} {:7.2f} MB  load {:8.1f} ms  first prediction {:7.1f} ms  memory +{:6.1f} MB".format(
+                name, size_mb(path), result['load_ms'], result['first_prediction_ms'], result['rss_mb']))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,145 @@
+"""
+Times the cleaning cells of CondoPrices.ipynb against condo_pipeline.clean_condos
+(batch and chunked) on a replicated copy of the condo listings, and checks that
+all of them produce the same table.
+
+Usage: python benchmarks/cleaning_benchmark.py [--replicate 100] [--chunksize 20000] [--csv TorontoCondos-August2020.csv]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+import condo_pipeline
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def condo_fees_converter(condo_fees):
+    condo_fees = condo_fees.str.strip()
+    condo_fees = condo_fees.where((condo_fees.str[-8:-1] + condo_fees.str[-1]).str.strip() =="Monthly",
+                     other = "na")
+    condo_fees = condo_fees.where(condo_fees == "na",
+                     other =  condo_fees.str.replace("$", "").str.replace("Monthly", "").str.replace(",", "").str.strip())
+    return condo_fees
+
+
+def bedroom_converter(bedrooms):
+    pluses = bedrooms[bedrooms.str.len() != 1]
+    singles = bedrooms[bedrooms.str.len() == 1]
+
+    pluses = pluses.str[0].astype(int) + 0.5*pluses.str[2].astype(int)
+    singles = singles.astype(int)
+
+    bedrooms = pd.concat([pluses,singles],axis = 0)
+
+    return bedrooms
+
+
+def notebook_cells(condos):
+    """
+    The cleaning cells of CondoPrices.ipynb as they are, without the plots and the
+    positional join of the coordinates (which only fits the original CSV).
+    """
+    condos = condos.drop(columns = 'Unnamed: 0')
+    condos = condos.dropna(axis = 0, subset = ['Floor Area (m^2)', 'Price', 'Condo Fees', 'Bedrooms', 'Bathrooms'])
+
+    condos['Floor Area (m^2)'] = condos['Floor Area (m^2)'].apply(lambda x: round(x*10.75))
+    condos = condos.rename({'Floor Area (m^2)': 'Floor Area (sqft)'}, axis = 1)
+
+    condos = condos[condos['Floor Area (sqft)'] < 2500]
+
+    condos['Price'] = condos['Price'].str.replace('$', '')
+    condos['Price'] = condos['Price'].str.replace(',', '').astype(int)
+    condos = condos.rename({'Price': 'Price ($)'}, axis = 1)
+    condos = condos.reset_index(drop = True)
+
+    condos['Condo Fees'] = condo_fees_converter(condos['Condo Fees'])
+    condos = condos[condos['Condo Fees'] != 'na']
+    condos['Condo Fees'] = condos['Condo Fees'].astype(int)
+    condos = condos.rename({'Condo Fees': 'Condo Fees ($ Monthly)'}, axis=1)
+
+    condos['Postal Code'] = condos['Address'].str[-7:-1] + condos['Address'].str[-1]
+    condos = condos[condos['Condo Fees ($ Monthly)'] < 3000]
+
+    condos['Bedrooms'] = bedroom_converter(condos['Bedrooms'])
+    condos[['Bathrooms','Storeys']] = condos[['Bathrooms', 'Storeys']].astype(int)
+    condos = condos[condos['Storeys'] == 1]
+
+    return condos.reset_index(drop = True)
+
+
+def same_table(expected, result):
+    """
+    Same columns and values; dtypes may differ (int32 and categorical columns of the pipeline).
+    """
+    if list(expected.columns) != list(result.columns) or len(expected) != len(result):
+        return False
+
+    for column in expected.columns:
+        values = result[column].astype(object) if isinstance(result[column].dtype, pd.CategoricalDtype) else result[column]
+        if not expected[column].reset_index(drop = True).astype(object).equals(values.astype(object)):
+            if not (pd.api.types.is_numeric_dtype(values) and (expected[column].to_numpy() == values.to_numpy()).all()):
+                return False
+
+    return True
+
+
+def timed(function, *args):
+
+    start_time = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start_time, result
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replicate", type = int, default = 100)
+    parser.add_argument("--chunksize", type = int, default = 20000)
+    parser.add_argument("--csv", default = os.path.join(ROOT_DIR, "TorontoCondos-August2020.csv"))
+    args = parser.parse_args()
+
+    original = pd.read_csv(args.csv)
+    # Storeys is cast to int by the notebook, which only works on listings that have it
+    original = original[original['Storeys'].notna()]
+    replicated = pd.concat([original]*args.replicate, ignore_index = True)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        csv_file = os.path.join(temp_dir, "replicated.csv")
+        replicated.to_csv(csv_file, index = False)
+
+        print("{:,} listings ({} x {:,})\n".format(len(replicated), args.replicate, len(original)))
+
+        notebook_seconds, expected = timed(lambda: notebook_cells(pd.read_csv(csv_file, low_memory = False)))
+        batch_seconds, batch = timed(lambda: condo_pipeline.read_condos(csv_file))
+        chunked_seconds, chunked = timed(lambda: condo_pipeline.concat_chunks(
+            condo_pipeline.read_condos(csv_file, chunksize = args.chunksize)))
+
+        # Cleaning alone, from a DataFrame already in memory
+        raw = pd.read_csv(csv_file, low_memory = False)
+        notebook_clean_seconds, _ = timed(notebook_cells, raw)
+        batch_clean_seconds, _ = timed(condo_pipeline.clean_condos, raw)
+
+    results = [("Notebook cells (read + clean)", notebook_seconds, expected),
+               ("clean_condos (read + clean)", batch_seconds, batch),
+               ("clean_condos chunks of {:,}".format(args.chunksize), chunked_seconds, chunked)]
+
+    for name, seconds, table in results:
+        print("{:<34s} {:8.3f} s  {:5.1f}x  rows: {:,}  same table: {}".format(
+            name, seconds, notebook_seconds/seconds, len(table), same_table(expected, table)))
+
+    print("\nCleaning only: notebook {:.3f} s, clean_condos {:.3f} s ({:.1f}x)".format(
+        notebook_clean_seconds, batch_clean_seconds, notebook_clean_seconds/batch_clean_seconds))
+
+    print("Memory of the cleaned table: notebook {:.1f} MB, clean_condos {:.1f} MB".format(
+        expected.memory_usage(deep = True).sum()/1e6, batch.memory_usage(deep = True).sum()/1e6))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,68 @@
+"""
+Times a serial crawl against a concurrent crawl of the local mock listing server
+and checks that both write identical CSV files.
+
+Usage: python benchmarks/crawl_concurrency.py [--pages 2] [--workers 46] [--latency 0.3] [--parse-workers 0]
+"""
+import os
+import sys
+import io
+import time
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web_scraper import condo_crawler
+from mock_listing_server import MockListingServer
+
+
+def timed_crawl(server, pages, per_page, max_workers, file_name, parse_workers = 0):
+
+    crawler, field_names = condo_crawler('Toronto', server.main_link(), pages, per_page)
+    crawler.set_concurrency(max_workers)
+    crawler.set_pipeline(parse_workers)
+
+    start_time = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        crawler.crawl()
+        crawler.write(file_name, field_names)
+    elapsed = time.perf_counter() - start_time
+
+    with open(file_name) as file:
+        return elapsed, len(crawler.data), file.read()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type = int, default = 2)
+    parser.add_argument("--per-page", type = int, default = 46)
+    parser.add_argument("--workers", type = int, default = 46)
+    parser.add_argument("--latency", type = float, default = 0.3)
+    parser.add_argument("--parse-workers", type = int, default = 0,
+                        help = "Parse in this many processes in the concurrent crawl (0 = In the fetcher threads)")
+    args = parser.parse_args()
+
+    with MockListingServer(pages = args.pages, per_page = args.per_page, latency = args.latency) as server, \
+         tempfile.TemporaryDirectory() as tmp_dir:
+
+        serial_time, serial_rows, serial_csv = timed_crawl(server, args.pages, args.per_page, 1,
+                                                           os.path.join(tmp_dir, "serial.csv"))
+        concurrent_time, concurrent_rows, concurrent_csv = timed_crawl(server, args.pages, args.per_page, args.workers,
+                                                                       os.path.join(tmp_dir, "concurrent.csv"),
+                                                                       args.parse_workers)
+
+    print("Serial:     {:d} rows in {:.2f}s".format(serial_rows, serial_time))
+    print("Concurrent: {:d} rows in {:.2f}s ({:d} workers)".format(concurrent_rows, concurrent_time, args.workers))
+    print("Speedup:    {:.1f}x".format(serial_time/concurrent_time))
+    print("Identical CSV output: " + str(serial_csv == concurrent_csv))
+
+    if serial_csv != concurrent_csv:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,65 @@
+"""
+Counts the requests of a crawl of the local mock listing server with and without
+a crawl frontier, on index pages that repeat featured listings: a plain crawl,
+a first crawl through the frontier, and a second crawl reusing its seen-set.
+
+Usage: python benchmarks/crawl_frontier_benchmark.py [--pages 10] [--per-page 46] [--featured 4] [--workers 16]
+"""
+import os
+import sys
+import io
+import time
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web_scraper import condo_crawler
+from mock_listing_server import MockListingServer
+
+
+def counted_crawl(server, pages, per_page, max_workers, frontier_file = None):
+
+    crawler, field_names = condo_crawler('Toronto', server.main_link(), pages, per_page + server.featured)
+    crawler.set_concurrency(max_workers)
+    if frontier_file != None:
+        crawler.set_frontier(frontier_file)
+
+    requests_before = server.request_count
+    start_time = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        crawler.crawl()
+    elapsed = time.perf_counter() - start_time
+
+    return server.request_count - requests_before, len(crawler.data), elapsed
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type = int, default = 10)
+    parser.add_argument("--per-page", type = int, default = 46)
+    parser.add_argument("--featured", type = int, default = 4, help = "Listings repeated on every index page")
+    parser.add_argument("--workers", type = int, default = 16)
+    parser.add_argument("--latency", type = float, default = 0.02)
+    args = parser.parse_args()
+
+    # A fixed port keeps the listing links, and so the seen-set, the same across crawls
+    with MockListingServer(pages = args.pages, per_page = args.per_page, latency = args.latency, featured = args.featured,
+                           port = 8097) as server, tempfile.TemporaryDirectory() as tmp_dir:
+
+        frontier_file = os.path.join(tmp_dir, "frontier.sqlite")
+        runs = [("No frontier", counted_crawl(server, args.pages, args.per_page, args.workers)),
+                ("Frontier, first run", counted_crawl(server, args.pages, args.per_page, args.workers, frontier_file)),
+                ("Frontier, second run", counted_crawl(server, args.pages, args.per_page, args.workers, frontier_file))]
+
+    unique = args.pages*args.per_page + args.featured
+    print("{:d} unique listings on {:d} index pages".format(unique, args.pages))
+    for name, (requests, rows, elapsed) in runs:
+        print("{:<21s} {:5d} requests, {:5d} rows in {:.2f}s".format(name + ":", requests, rows, elapsed))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,81 @@
+"""
+Rows per second of the NumPy forest engine (inference_engine.py) against
+RandomForestRegressor.predict at several batch sizes, and a check that both give
+the same predictions, also on rows with missing (NaN) inputs.
+
+Usage: python benchmarks/inference_benchmark.py [--trees 100] [--batch-sizes 1,16,256,4096,65536] [--workers 1]
+"""
+import os
+import sys
+import io
+import time
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import condo_model
+from model_artifact import FlatForest
+from inference_engine import ForestEngine
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rows_per_second(predict, X, min_seconds = 0.5):
+
+    calls = 0
+    start_time = time.perf_counter()
+    while calls == 0 or time.perf_counter() - start_time < min_seconds:
+        predict(X)
+        calls = calls + 1
+
+    return calls*len(X)/(time.perf_counter() - start_time)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trees", type = int, default = 100)
+    parser.add_argument("--batch-sizes", default = "1,16,256,4096,65536")
+    parser.add_argument("--workers", type = int, default = 1, help = "Engine worker threads")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir, redirect_stdout(io.StringIO()):
+        condos = condo_model.load_training_table(os.path.join(ROOT_DIR, "TorontoCondos-August2020.csv"),
+                                                 os.path.join(temp_dir, "geocode.sqlite"),
+                                                 seed = os.path.join(ROOT_DIR, "condo_coordinates.txt"))
+    model = condo_model.train(condos, params = {'n_estimators': args.trees}, random_state = 0)
+    forest = model.forest
+
+    # What-if rows: listings resampled with their inputs perturbed by a few percent
+    X = condo_model.training_table(condos)[model.input_cols].to_numpy()
+    random = np.random.default_rng(0)
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+    rows = X[random.integers(0, len(X), max(batch_sizes))]*random.normal(1, 0.03, (max(batch_sizes), X.shape[1]))
+
+    engine = ForestEngine(FlatForest.from_estimators(forest.estimators_), workers = args.workers)
+    difference = np.abs(engine.predict(rows) - forest.predict(rows)).max()
+    missing = rows[0:4096].copy()
+    missing[random.random(missing.shape) < 0.1] = np.nan
+    missing_difference = np.abs(engine.predict(missing) - forest.predict(missing)).max()
+
+    print("Forest of {} trees (depth {}), {} engine worker(s), max prediction difference {:.2e} ({:.2e} with NaN inputs)\n".format(
+        args.trees, engine.depth, args.workers, difference, missing_difference))
+    print("{:>10s} {:>16s} {:>16s} {:>8s}".format("batch", "scikit-learn", "engine", "speedup"))
+
+    for batch_size in batch_sizes:
+        batch = rows[0:batch_size]
+        sklearn_rate = rows_per_second(forest.predict, batch)
+        engine_rate = rows_per_second(engine.predict, batch)
+        print("{:>10,d} {:>12,.0f} r/s {:>12,.0f} r/s {:>7.1f}x".format(batch_size, sklearn_rate, engine_rate,
+                                                                      engine_rate/sklearn_rate))
+
+    engine.close()
+
+
+if __name__ == '__main__':
+
+    main()
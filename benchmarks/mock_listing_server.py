@@ -0,0 +1,219 @@
+import os
+import re
+import json
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+INDEX_PATH = re.compile(r"^/en/on/([^/]+)/condos/properties/(\d+)/$")
+LISTING_PATH = re.compile(r"^/en/on/([^/]+)/listing/([\w-]+)/$")
+
+LISTING_CARD = ('      <li class="card"><a class="link link--with-icon link--icon-right" '
+                'href="{base}/en/on/{city}/listing/{listing_id}/">View Details</a></li>')
+
+
+class ListingHTTPServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class MockListingServer:
+
+    def __init__(self, pages = 22, per_page = 46, latency = 0.05, host = "127.0.0.1", port = 0,
+                 latency_jitter = 0, error_rate = 0, corpus = None, seed = 0, featured = 0,
+                 capacity = None, load_latency = 0):
+        """
+        A local stand-in for the listing site that serves the saved fixture pages
+        under the same URL layout used in web_scraper.main(), so crawls can be timed
+        and compared without touching the live site.
+
+        PARAMETERS:
+        pages: (Int) Number of index pages served. Later pages respond with 404.
+        per_page: (Int) Number of listing links on every index page (ignored with a corpus).
+        latency: (Float) Seconds slept before answering each request, standing in for network round-trip time.
+        port: (Int) 0 = Pick a free port.
+        latency_jitter: (Float) Up to this many seconds are added at random to every latency.
+        error_rate: (Float) Fraction of requests answered with a 503, to exercise retries.
+        corpus: (String or None) Directory written by record_corpus.py. Its recorded index and
+                listing pages are served instead of the fixture templates.
+        seed: (Int) Seeds the jitter and the injected errors, so runs are repeatable.
+        featured: (Int) Listings repeated at the top of every index page, like the site's featured listings.
+        capacity: (Int or None) Requests served at once. Requests beyond it are answered at once with a 429,
+                  like a throttling site. None = No limit.
+        load_latency: (Float) Seconds added to the latency for every other request in flight, so the
+                      latency grows with the load as on a busy site.
+        """
+        self.pages = pages
+        self.per_page = per_page
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.featured = featured
+        self.capacity = capacity
+        self.load_latency = load_latency
+        self.random = random.Random(seed)
+        self.corpus = None
+
+        if corpus == None:
+            with open(os.path.join(FIXTURE_DIR, "index_page.html")) as file:
+                self.index_template = file.read()
+            with open(os.path.join(FIXTURE_DIR, "listing_page.html")) as file:
+                self.listing_template = file.read()
+        else:
+            self.load_corpus(corpus)
+
+        self.request_count = 0
+        self.error_count = 0
+        self.throttled_count = 0
+        self.in_flight = 0
+        self.count_lock = threading.Lock()
+
+        self.httpd = ListingHTTPServer((host, port), self.handler_class())
+        self.base = "http://" + host + ":" + str(self.httpd.server_address[1])
+        self.thread = None
+
+    def main_link(self):
+        """
+        Returns the main_link list expected by RealEstateCrawler.
+        """
+        return [self.base + "/en/on/", "/condos/properties/", "/"]
+
+    def load_corpus(self, corpus):
+
+        with open(os.path.join(corpus, "manifest.json")) as file:
+            manifest = json.load(file)
+
+        self.corpus = {'index': [], 'listings': {}}
+        for file_name in manifest['index']:
+            with open(os.path.join(corpus, file_name)) as file:
+                self.corpus['index'].append(file.read())
+        for listing_id, file_name in manifest['listings'].items():
+            with open(os.path.join(corpus, file_name)) as file:
+                self.corpus['listings'][listing_id] = file.read()
+
+        self.corpus['listing_ids'] = sorted(self.corpus['listings'])
+
+    def index_page(self, city, page):
+
+        if self.corpus != None:
+            html = self.corpus['index'][(page - 1) % len(self.corpus['index'])]
+            return html.replace("{{BASE}}", self.base).replace("{{CITY}}", city.lower())
+
+        listing_ids = ["featured-" + str(n) for n in range(self.featured)] + [str(page) + "-" + str(n) for n in range(self.per_page)]
+        cards = [LISTING_CARD.format(base = self.base, city = city.lower(), listing_id = listing_id) for listing_id in listing_ids]
+
+        html = self.index_template.replace("{{LISTINGS}}", "\n".join(cards))
+        html = html.replace("{{BASE}}", self.base).replace("{{PAGE}}", str(page))
+        return html
+
+    def listing_page(self, listing_id):
+
+        if self.corpus != None:
+            listings = self.corpus['listings']
+            if listing_id not in listings:
+                # Index pages served past the recorded ones link to ids that were never recorded
+                listing_id = self.corpus['listing_ids'][sum(map(ord, listing_id)) % len(listings)]
+            return listings[listing_id]
+
+        return self.listing_template.replace("{{LISTING_ID}}", listing_id)
+
+    def delay(self):
+        """
+        Seconds to sleep before answering, and the error status to answer with (None = No error).
+        Counts the request as in flight until finished() is called.
+        """
+        with self.count_lock:
+            self.request_count = self.request_count + 1
+            self.in_flight = self.in_flight + 1
+
+            if self.capacity != None and self.in_flight > self.capacity:
+                self.throttled_count = self.throttled_count + 1
+                return 0, 429
+
+            jitter = self.random.uniform(0, self.latency_jitter) if self.latency_jitter > 0 else 0
+            error = self.error_rate > 0 and self.random.random() < self.error_rate
+            if error:
+                self.error_count = self.error_count + 1
+
+            return self.latency + jitter + self.load_latency*(self.in_flight - 1), 503 if error else None
+
+    def finished(self):
+
+        with self.count_lock:
+            self.in_flight = self.in_flight - 1
+
+    def respond(self, path):
+        """
+        Returns (status code, body) for a request path.
+        """
+        index_match = INDEX_PATH.match(path)
+        if index_match:
+            page = int(index_match.group(2))
+            if 1 <= page <= self.pages:
+                return 200, self.index_page(index_match.group(1), page)
+            else:
+                return 404, "Not Found"
+
+        listing_match = LISTING_PATH.match(path)
+        if listing_match:
+            return 200, self.listing_page(listing_match.group(2))
+
+        return 404, "Not Found"
+
+    def handler_class(self):
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+
+                latency, error = server.delay()
+                try:
+                    if latency > 0:
+                        time.sleep(latency)
+
+                    if error != None:
+                        status, body = error, "Too Many Requests" if error == 429 else "Service Unavailable"
+                    else:
+                        status, body = server.respond(self.path)
+                finally:
+                    server.finished()
+                payload = body.encode("utf-8")
+
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+
+        self.thread = threading.Thread(target = self.httpd.serve_forever, daemon = True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+
+        return self.start()
+
+    def __exit__(self, *exc_info):
+
+        self.stop()
@@ -0,0 +1,77 @@
+"""
+Micro-benchmark of per-page listing parse time on the saved listing fixture:
+the original BeautifulSoup/html.parser scraper, the same scraper on BeautifulSoup's
+lxml parser, and the compiled XPath spec (the crawler's default "lxml" backend).
+
+Usage: python benchmarks/parse_benchmark.py [--repeat 300] [--listing benchmarks/fixtures/listing_page.html]
+"""
+import os
+import sys
+import io
+import math
+import time
+import argparse
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+from web_scraper import condo_crawler
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+LINK = "https://www.royallepage.ca/en/on/toronto/listing/fixture/"
+
+
+def same_row(row_a, row_b):
+
+    if row_a.keys() != row_b.keys():
+        return False
+
+    for key in row_a:
+        value_a, value_b = row_a[key], row_b[key]
+        both_nan = isinstance(value_a, float) and isinstance(value_b, float) and math.isnan(value_a) and math.isnan(value_b)
+        if value_a != value_b and not both_nan:
+            return False
+
+    return True
+
+
+def time_per_page(parse, html, repeat):
+
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        row = parse(html)
+    return (time.perf_counter() - start_time)/repeat, row
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type = int, default = 300)
+    parser.add_argument("--listing", default = os.path.join(FIXTURE_DIR, "listing_page.html"))
+    args = parser.parse_args()
+
+    with open(args.listing) as file:
+        html = file.read().replace("{{LISTING_ID}}", "1203")
+
+    crawler, field_names = condo_crawler('Toronto', ["http://localhost/en/on/", "/condos/properties/", "/"], 1, 46)
+    page_spec = crawler.compile_page_spec()
+
+    backends = [("BeautifulSoup html.parser + scraper", lambda page: crawler.scraper(BeautifulSoup(page, "html.parser"), LINK)),
+                ("BeautifulSoup lxml + scraper",        lambda page: crawler.scraper(BeautifulSoup(page, "lxml"), LINK)),
+                ("Compiled XPath (lxml backend)",       lambda page: page_spec.parse(page, LINK))]
+
+    results = []
+    with redirect_stdout(io.StringIO()):
+        for name, parse in backends:
+            results.append((name,) + time_per_page(parse, html, args.repeat))
+
+    baseline = results[0][1]
+    for name, seconds, row in results:
+        print("{:<38s} {:8.3f} ms/page  {:5.1f}x  same row: {}".format(name, 1000*seconds, baseline/seconds,
+                                                                       same_row(row, results[0][2])))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,92 @@
+"""
+Load test of prediction_service.py: concurrent clients send single-listing JSON
+requests to a local service, once without batching (max batch 1) and once with
+micro-batching, and the client-side p50 / p99 latency and throughput are compared.
+
+Usage: python benchmarks/prediction_benchmark.py [--clients 32] [--requests 100] [--max-batch 64] [--max-wait-ms 2]
+"""
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import tempfile
+import threading
+import http.client
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import condo_model
+from prediction_service import PredictionService
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def client(port, records, latencies):
+
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    for record in records:
+        start_time = time.perf_counter()
+        connection.request("POST", "/predict", body = json.dumps(record), headers = {'Content-Type': "application/json"})
+        json.loads(connection.getresponse().read())
+        latencies.append(time.perf_counter() - start_time)
+    connection.close()
+
+
+def load_test(model, records, clients, max_batch_size, max_wait):
+
+    service = PredictionService(model, max_batch_size, max_wait)
+    httpd = service.make_server(port = 0)
+    threading.Thread(target = httpd.serve_forever, daemon = True).start()
+
+    latencies = []
+    threads = [threading.Thread(target = client, args = (httpd.server_address[1], records, latencies)) for _ in range(clients)]
+
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start_time
+
+    httpd.shutdown()
+    httpd.server_close()
+
+    return elapsed, np.array(latencies), service.stats.summary()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type = int, default = 32)
+    parser.add_argument("--requests", type = int, default = 100, help = "Requests per client")
+    parser.add_argument("--max-batch", type = int, default = 64)
+    parser.add_argument("--max-wait-ms", type = float, default = 2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir, redirect_stdout(io.StringIO()):
+        condos = condo_model.load_training_table(os.path.join(ROOT_DIR, "TorontoCondos-August2020.csv"),
+                                                 os.path.join(temp_dir, "geocode.sqlite"),
+                                                 seed = os.path.join(ROOT_DIR, "condo_coordinates.txt"))
+    model = condo_model.train(condos, random_state = 0)
+
+    table = condo_model.training_table(condos)
+    records = [{'floor_area': row[0], 'bedrooms': row[1], 'bathrooms': row[2], 'condo_fees': row[3],
+                'lat': row[4], 'long': row[5]} for row in table[condo_model.INPUT_COLS].to_numpy()[0:args.requests]]
+
+    print("{} clients x {} requests, forest of {} trees\n".format(args.clients, len(records), len(model.forest.estimators_)))
+
+    for name, max_batch_size in [("No batching", 1), ("Micro-batching (max {})".format(args.max_batch), args.max_batch)]:
+        elapsed, latencies, stats = load_test(model, records, args.clients, max_batch_size, args.max_wait_ms/1000)
+        print("{:<26s} {:8.0f} req/s  p50 {:7.2f} ms  p99 {:7.2f} ms  mean batch {:5.1f}".format(
+            name, len(latencies)/elapsed, 1000*np.percentile(latencies, 50), 1000*np.percentile(latencies, 99),
+            stats.get('mean_batch_size', 1)))
+
+
+if __name__ == '__main__':
+
+    main()
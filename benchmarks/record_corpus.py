@@ -0,0 +1,129 @@
+"""
+Records a corpus of index and listing pages for the benchmarks: crawls a few
+pages with the container definitions of web_scraper.main() and saves every page
+fetched, so that MockListingServer(corpus = ...) can serve real pages offline.
+
+Listing links on the recorded index pages are rewritten to point at the mock
+server ({{BASE}}/en/on/{{CITY}}/listing/<id>/).
+
+Usage: python benchmarks/record_corpus.py corpus_dir [--pages 2] [--per-page 46]
+                                          [--cache royallepage_cache.sqlite]   # Replay from the response cache, no network
+                                          [--mock]                             # Record the local mock server (fixture pages)
+"""
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import threading
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web_scraper import condo_crawler
+from response_cache import ResponseCache
+from mock_listing_server import MockListingServer
+
+LIVE_LINK = ["https://www.royallepage.ca/en/on/", "/condos/properties/", "/"]
+
+
+class RecordingTransport:
+
+    def __init__(self, transport):
+        """
+        Wraps a crawler's HttpTransport and keeps the HTML of every successful response.
+        """
+        self.transport = transport
+        self.pages = {}
+        self.lock = threading.Lock()
+
+    def get(self, link, headers = None, timeout = 5):
+
+        response, reason = self.transport.get(link, headers = headers, timeout = timeout)
+        if reason == None:
+            with self.lock:
+                self.pages[link] = response.text
+
+        return response, reason
+
+
+def write_corpus(crawler, recorder, pages, corpus_dir):
+    """
+    Writes the recorded pages and their manifest. Returns the manifest.
+    """
+    os.makedirs(os.path.join(corpus_dir, "index"), exist_ok = True)
+    os.makedirs(os.path.join(corpus_dir, "listings"), exist_ok = True)
+    page_spec = crawler.compile_page_spec()
+
+    manifest = {'source': crawler.main_http, 'recorded': time.strftime("%Y-%m-%d %H:%M:%S"), 'index': [], 'listings': {}}
+    listing_ids = {}
+
+    for page in range(crawler.first_page, crawler.first_page + pages):
+        html = recorder.pages.get(crawler.set_page_link(crawler.main_http, page))
+        if html == None:
+            continue
+
+        for href in page_spec.crawl_links(html):
+            listing_id = listing_ids.setdefault(href, "r" + str(len(listing_ids)))
+            mock_link = "{{BASE}}/en/on/{{CITY}}/listing/" + listing_id + "/"
+            html = html.replace('"' + href + '"', '"' + mock_link + '"').replace('"' + href.replace("&", "&amp;") + '"',
+                                                                                 '"' + mock_link + '"')
+
+        file_name = os.path.join("index", "page-" + str(page) + ".html")
+        with open(os.path.join(corpus_dir, file_name), 'w') as file:
+            file.write(html)
+        manifest['index'].append(file_name)
+
+    for href, listing_id in listing_ids.items():
+        if href in recorder.pages:
+            file_name = os.path.join("listings", listing_id + ".html")
+            with open(os.path.join(corpus_dir, file_name), 'w') as file:
+                file.write(recorder.pages[href])
+            manifest['listings'][listing_id] = file_name
+
+    with open(os.path.join(corpus_dir, "manifest.json"), 'w') as file:
+        json.dump(manifest, file, indent = 2)
+
+    return manifest
+
+
+def record(main_link, corpus_dir, pages, per_page, cache = None, rate_limit = 2):
+
+    crawler, field_names = condo_crawler('Toronto', main_link, pages, per_page)
+    crawler.set_concurrency(4, rate_limit = rate_limit)
+    if cache != None:
+        crawler.transport.set_cache(ResponseCache(cache, offline = True))
+
+    recorder = RecordingTransport(crawler.transport)
+    crawler.set_transport(recorder)
+
+    with redirect_stdout(io.StringIO()):
+        crawler.crawl()
+
+    return write_corpus(crawler, recorder, pages, corpus_dir)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus_dir")
+    parser.add_argument("--pages", type = int, default = 2)
+    parser.add_argument("--per-page", type = int, default = 46)
+    parser.add_argument("--cache", help = "Replay from this response cache instead of the live site")
+    parser.add_argument("--mock", action = "store_true", help = "Record the local mock server's fixture pages")
+    args = parser.parse_args()
+
+    if args.mock:
+        with MockListingServer(pages = args.pages, per_page = args.per_page, latency = 0) as server:
+            manifest = record(server.main_link(), args.corpus_dir, args.pages, args.per_page, rate_limit = None)
+    else:
+        manifest = record(LIVE_LINK, args.corpus_dir, args.pages, args.per_page, cache = args.cache)
+
+    print("Recorded " + str(len(manifest['index'])) + " index pages and " + str(len(manifest['listings']))
+          + " listing pages to " + args.corpus_dir)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,64 @@
+"""
+Time spent on Storeys and Floor Area: computed room by room while parsing every
+listing (the crawler's default), against keeping the raw rooms while parsing and
+computing both for all the listings at once (RealEstateCrawler.set_rooms_output).
+
+Usage: python benchmarks/room_table_benchmark.py [--pages 2000] [--listing benchmarks/fixtures/listing_page.html]
+"""
+import os
+import sys
+import io
+import time
+import argparse
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+import room_table
+from web_scraper import condo_crawler
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type = int, default = 2000)
+    parser.add_argument("--listing", default = os.path.join(FIXTURE_DIR, "listing_page.html"))
+    args = parser.parse_args()
+
+    with open(args.listing) as file:
+        pages = [(file_html, "https://www.royallepage.ca/en/on/toronto/listing/" + str(n) + "/")
+                 for n, file_html in enumerate([file.read()]*args.pages)]
+
+    crawler, field_names = condo_crawler('Toronto', ["http://localhost/en/on/", "/condos/properties/", "/"], 1, 46)
+    per_room_spec = crawler.compile_page_spec()
+    crawler.set_rooms_output()
+    rooms_spec = crawler.compile_page_spec()
+
+    with redirect_stdout(io.StringIO()):
+        start_time = time.perf_counter()
+        per_room_rows = [per_room_spec.parse(html, link) for html, link in pages]
+        per_room_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        rows = [rooms_spec.parse(html, link) for html, link in pages]
+        parse_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        rooms = pd.DataFrame([room for row in rows for room in row['Rooms']], columns = room_table.ROOM_FIELDS)
+        space = room_table.levels_and_space(rooms, keys = [link for _, link in pages], dedup = False)
+        groupby_seconds = time.perf_counter() - start_time
+
+    same = all(row['Floor Area (m^2)'] == area for row, area in zip(per_room_rows, space['Floor Area']))
+    print("{:d} listings, {:d} rooms".format(len(pages), len(rooms)))
+    print("Per room while parsing: {:7.1f} ms parse".format(1000*per_room_seconds))
+    print("Raw rooms + groupby:    {:7.1f} ms parse + {:.1f} ms groupby".format(1000*parse_seconds, 1000*groupby_seconds))
+    print("Same Floor Area: " + str(same))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,89 @@
+"""
+Memory held by scraped rows kept as a list of dictionaries (the crawler's former
+self.data) and kept in a RowStore, for copies of the condo listings. Every row
+gets its own string objects, as rows parsed from separate pages do.
+
+Usage: python benchmarks/row_store_benchmark.py [--rows 200000]
+"""
+import os
+import sys
+import csv
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crawl_output import RowStore
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def fresh(value):
+    """
+    A copy of a string that is a different object, like the same text parsed from another page.
+    """
+    return value[0:1] + value[1:] if len(value) > 1 else value
+
+
+def scraped_rows(count):
+
+    with open(os.path.join(ROOT_DIR, "TorontoCondos-August2020.csv")) as file:
+        reader = csv.DictReader(file)
+        field_names = reader.fieldnames
+        listings = list(reader)
+
+    for index in range(count):
+        yield field_names, {field_name: fresh(value) for field_name, value in listings[index % len(listings)].items()}
+
+
+def measured(build, count):
+    """
+    Returns (bytes held, seconds) of the container built from count rows.
+    """
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    rows = build(count)
+    seconds = time.perf_counter() - start_time
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del rows
+    return held, seconds
+
+
+def build_list(count):
+
+    data = []
+    for _, row in scraped_rows(count):
+        data.append(row)
+    return data
+
+
+def build_store(count):
+
+    data = None
+    for field_names, row in scraped_rows(count):
+        if data == None:
+            data = RowStore(field_names)
+        data.append(row)
+    return data
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type = int, default = 200000)
+    args = parser.parse_args()
+
+    list_bytes, list_seconds = measured(build_list, args.rows)
+    store_bytes, store_seconds = measured(build_store, args.rows)
+
+    print("{:d} rows".format(args.rows))
+    print("List of dicts: {:7.1f} MB ({:5.0f} bytes/row) built in {:.2f}s".format(list_bytes/1e6, list_bytes/args.rows, list_seconds))
+    print("RowStore:      {:7.1f} MB ({:5.0f} bytes/row) built in {:.2f}s".format(store_bytes/1e6, store_bytes/args.rows, store_seconds))
+    print("Reduction:     {:.1f}x".format(list_bytes/store_bytes))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,297 @@
+"""
+End-to-end benchmark suite: times every stage from crawl to prediction offline
+and writes the results as JSON, checked against regression thresholds.
+
+Stages:
+    crawl     listings/s of a concurrent crawl of the mock server (latency, jitter and injected 503s)
+    parse     ms per listing page of the BeautifulSoup scraper and of the compiled lxml spec
+    cleaning  rows/s of condo_pipeline.clean_condos
+    training  seconds to fit the notebook's RandomForest
+    predict   rows/s of scikit-learn and of the artifact engine, batched and single rows, and the engine's
+              speedup over scikit-learn on batches of 256 rows (a service's micro-batches)
+
+Usage: python benchmarks/run_benchmarks.py [--corpus corpus_dir] [--stages crawl,parse,...] [--output results.json]
+                                           [--check benchmarks/benchmark_thresholds.json] [--write-thresholds FILE]
+"""
+import os
+import sys
+import io
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from web_scraper import condo_crawler
+from page_parser import CompiledPageSpec
+from mock_listing_server import MockListingServer, FIXTURE_DIR
+from record_corpus import LIVE_LINK
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ['crawl', 'parse', 'cleaning', 'training', 'predict']
+THRESHOLDS_FILE = os.path.join(ROOT_DIR, "benchmarks", "benchmark_thresholds.json")
+
+# Whether larger is better for every metric a threshold can be set on
+HIGHER_IS_BETTER = {'crawl.listings_per_second': True,
+                    'parse.bs4_ms_per_page': False,
+                    'parse.lxml_ms_per_page': False,
+                    'cleaning.rows_per_second': True,
+                    'training.seconds': False,
+                    'predict.sklearn_rows_per_second': True,
+                    'predict.engine_rows_per_second': True,
+                    'predict.engine_single_rows_per_second': True,
+                    'predict.engine_small_batch_speedup': True}
+
+
+def best_time(function, repeat = 3):
+
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+    return min(times)
+
+
+def corpus_listings(corpus):
+    """
+    HTML of the listing pages to parse: the corpus's, or the fixture page.
+    """
+    if corpus == None:
+        with open(os.path.join(FIXTURE_DIR, "listing_page.html")) as file:
+            return [file.read().replace("{{LISTING_ID}}", "fixture")]
+
+    with open(os.path.join(corpus, "manifest.json")) as file:
+        manifest = json.load(file)
+
+    pages = []
+    for file_name in manifest['listings'].values():
+        with open(os.path.join(corpus, file_name)) as file:
+            pages.append(file.read())
+    return pages
+
+
+def bench_crawl(args):
+
+    with MockListingServer(pages = args.pages, per_page = 46, latency = args.latency, latency_jitter = args.jitter,
+                           error_rate = args.error_rate, corpus = args.corpus) as server:
+        crawler, field_names = condo_crawler('Toronto', server.main_link(), args.pages, 46)
+        crawler.set_concurrency(args.workers)
+        crawler.transport.backoff_factor = 0.05    # Injected errors are retried quickly
+
+        start_time = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            crawler.crawl()
+        seconds = time.perf_counter() - start_time
+
+        return {'listings': len(crawler.data), 'seconds': round(seconds, 3),
+                'listings_per_second': round(len(crawler.data)/seconds, 1),
+                'requests': server.request_count, 'injected_errors': server.error_count,
+                'errors': crawler.metrics.by_label('errors', 'function')}
+
+
+def bench_parse(args):
+
+    from bs4 import BeautifulSoup
+
+    pages = corpus_listings(args.corpus)
+    link = "https://www.royallepage.ca/en/on/toronto/listing/benchmark/"
+    crawler, _ = condo_crawler('Toronto', LIVE_LINK, 1, 1)
+    crawler.set_parser_backend("html.parser")
+    page_spec = CompiledPageSpec(crawler.crawler_type, crawler.crawler_attr, crawler.scrap_particulars, crawler.scrap_containers)
+
+    repeat = max(1, args.parse_pages//len(pages))
+    with redirect_stdout(io.StringIO()):
+        bs4_seconds = best_time(lambda: [crawler.scraper(BeautifulSoup(page, "html.parser"), link)
+                                         for page in pages*repeat])
+        lxml_seconds = best_time(lambda: [page_spec.parse(page, link) for page in pages*repeat])
+
+    count = len(pages)*repeat
+    return {'pages': count, 'bs4_ms_per_page': round(1000*bs4_seconds/count, 3),
+            'lxml_ms_per_page': round(1000*lxml_seconds/count, 3)}
+
+
+def bench_cleaning(args):
+
+    import pandas as pd
+    import condo_pipeline
+
+    listings = pd.read_csv(os.path.join(ROOT_DIR, "TorontoCondos-August2020.csv"), dtype = condo_pipeline.CSV_DTYPES)
+    listings = pd.concat([listings]*args.copies, ignore_index = True)
+
+    seconds = best_time(lambda: condo_pipeline.clean_condos(listings))
+    return {'rows': len(listings), 'seconds': round(seconds, 3), 'rows_per_second': round(len(listings)/seconds)}
+
+
+def training_data(state):
+
+    if 'condos' not in state:
+        import condo_model
+        with tempfile.TemporaryDirectory() as temp_dir, redirect_stdout(io.StringIO()):
+            state['condos'] = condo_model.load_training_table(os.path.join(ROOT_DIR, "TorontoCondos-August2020.csv"),
+                                                              os.path.join(temp_dir, "geocode.sqlite"),
+                                                              seed = os.path.join(ROOT_DIR, "condo_coordinates.txt"))
+    return state['condos']
+
+
+def bench_training(args, state):
+
+    import condo_model
+
+    condos = training_data(state)
+    start_time = time.perf_counter()
+    state['model'] = condo_model.train(condos, random_state = 0, n_jobs = 1)
+    seconds = time.perf_counter() - start_time
+
+    return {'rows': len(condo_model.training_table(condos)), 'trees': condo_model.FOREST_PARAMS['n_estimators'],
+            'seconds': round(seconds, 3)}
+
+
+def bench_predict(args, state):
+
+    import condo_model
+    from model_artifact import FlatForest
+
+    condos = training_data(state)
+    model = state.get('model') or condo_model.train(condos, random_state = 0, n_jobs = 1)
+
+    X = condo_model.training_table(condos)[model.input_cols].to_numpy()
+    rows = X[np.random.default_rng(0).integers(0, len(X), args.predict_rows)]
+    flat = FlatForest.from_estimators(model.forest.estimators_)
+    flat.predict(rows[0:1])
+
+    sklearn_seconds = best_time(lambda: model.forest.predict(rows))
+    engine_seconds = best_time(lambda: flat.predict(rows))
+    single_seconds = best_time(lambda: [flat.predict(rows[i:i + 1]) for i in range(200)])
+    small_batches = [rows[start:start + 256] for start in range(0, 256*8, 256)]
+    sklearn_small_seconds = best_time(lambda: [model.forest.predict(batch) for batch in small_batches])
+    engine_small_seconds = best_time(lambda: [flat.predict(batch) for batch in small_batches])
+
+    return {'rows': len(rows), 'sklearn_rows_per_second': round(len(rows)/sklearn_seconds),
+            'engine_rows_per_second': round(len(rows)/engine_seconds),
+            'engine_single_rows_per_second': round(200/single_seconds),
+            'engine_small_batch_speedup': round(sklearn_small_seconds/engine_small_seconds, 3)}
+
+
+def git_commit():
+
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd = ROOT_DIR, capture_output = True,
+                              text = True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def flatten(results):
+
+    return {stage + "." + name: value for stage, metrics in results.items() for name, value in metrics.items()
+            if isinstance(value, (int, float))}
+
+
+def check_thresholds(results, thresholds):
+    """
+    Compares results with thresholds {'stage.metric': {'min': x} or {'max': x}}.
+    Returns the list of (metric, value, threshold, passed).
+    """
+    values = flatten(results)
+    checks = []
+
+    for metric, bound in thresholds.items():
+        if metric not in values:
+            continue
+        value = values[metric]
+        if 'min' in bound:
+            checks.append((metric, value, ">= " + str(bound['min']), value >= bound['min']))
+        if 'max' in bound:
+            checks.append((metric, value, "<= " + str(bound['max']), value <= bound['max']))
+
+    return checks
+
+
+def thresholds_from(results, tolerance):
+    """
+    Thresholds that allow every tracked metric to get worse by tolerance (a fraction).
+    """
+    thresholds = {}
+    for metric, value in flatten(results).items():
+        if metric in HIGHER_IS_BETTER:
+            if HIGHER_IS_BETTER[metric]:
+                thresholds[metric] = {'min': round(value*(1 - tolerance), 3)}
+            else:
+                thresholds[metric] = {'max': round(value*(1 + tolerance), 3)}
+    return thresholds
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stages", default = ",".join(STAGES))
+    parser.add_argument("--corpus", help = "Directory written by record_corpus.py (default: the fixture pages)")
+    parser.add_argument("--output", default = os.path.join(ROOT_DIR, "benchmarks", "results", "latest.json"))
+    parser.add_argument("--check", nargs = "?", const = THRESHOLDS_FILE, help = "Fail if a threshold is not met")
+    parser.add_argument("--write-thresholds", nargs = "?", const = THRESHOLDS_FILE,
+                        help = "Write thresholds from this run, allowing --tolerance of slack")
+    parser.add_argument("--tolerance", type = float, default = 0.3)
+    parser.add_argument("--pages", type = int, default = 2, help = "Crawl: index pages of 46 listings")
+    parser.add_argument("--workers", type = int, default = 16)
+    parser.add_argument("--latency", type = float, default = 0.05)
+    parser.add_argument("--jitter", type = float, default = 0.02)
+    parser.add_argument("--error-rate", type = float, default = 0.02)
+    parser.add_argument("--parse-pages", type = int, default = 200)
+    parser.add_argument("--copies", type = int, default = 20, help = "Cleaning: copies of the condo listings")
+    parser.add_argument("--predict-rows", type = int, default = 20000)
+    args = parser.parse_args()
+
+    stages = [stage for stage in args.stages.split(",") if stage]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        print("ERROR (run_benchmarks): Unknown stages " + str(unknown) + ", choose from " + str(STAGES))
+        sys.exit(2)
+
+    state = {}
+    runners = {'crawl': lambda: bench_crawl(args),
+               'parse': lambda: bench_parse(args),
+               'cleaning': lambda: bench_cleaning(args),
+               'training': lambda: bench_training(args, state),
+               'predict': lambda: bench_predict(args, state)}
+
+    results = {}
+    for stage in stages:
+        start_time = time.perf_counter()
+        results[stage] = runners[stage]()
+        print("{:<10s} {:6.1f}s  {}".format(stage, time.perf_counter() - start_time, json.dumps(results[stage])))
+
+    report = {'commit': git_commit(), 'created': time.strftime("%Y-%m-%d %H:%M:%S"),
+              'python': platform.python_version(), 'machine': platform.machine(), 'cpu_count': os.cpu_count(),
+              'corpus': args.corpus, 'results': results}
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok = True)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent = 2)
+    print("Results written to " + args.output)
+
+    if args.write_thresholds:
+        with open(args.write_thresholds, 'w') as file:
+            json.dump(thresholds_from(results, args.tolerance), file, indent = 2)
+        print("Thresholds written to " + args.write_thresholds)
+
+    if args.check:
+        with open(args.check) as file:
+            checks = check_thresholds(results, json.load(file))
+
+        for metric, value, bound, passed in checks:
+            print("{:<6s} {:<40s} {:>12} {}".format("ok" if passed else "FAIL", metric, value, bound))
+
+        if not all(passed for _, _, _, passed in checks):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,176 @@
+"""
+Training and persistence of the condo price RandomForest of CondoPrices.ipynb.
+
+Usage: python condo_model.py TorontoCondos-August2020.csv condo_model.model [--geocode-cache geocode_cache.sqlite]
+                             [--seed condo_coordinates.txt]
+"""
+import os
+import time
+import pickle
+import argparse
+
+import numpy as np
+from model_artifact import export_artifact, load_artifact
+
+INPUT_COLS = ['Floor Area (sqft)', 'Bedrooms', 'Bathrooms', 'Condo Fees ($ Monthly)', 'Latitude', 'Longitude']
+TARGET_COL = 'Price ($)'
+
+# Hyperparameters picked in the notebook
+FOREST_PARAMS = {'bootstrap': True,
+                 'max_depth': 20,
+                 'max_features': 4,
+                 'min_samples_leaf': 2,
+                 'min_samples_split': 4,
+                 'n_estimators': 30}
+
+# Field names accepted in prediction requests (the arguments of the notebook's make_prediction)
+REQUEST_FIELDS = {'floor_area': 'Floor Area (sqft)',
+                  'bedrooms': 'Bedrooms',
+                  'bathrooms': 'Bathrooms',
+                  'condo_fees': 'Condo Fees ($ Monthly)',
+                  'lat': 'Latitude',
+                  'long': 'Longitude'}
+
+
+class CondoModel:
+
+    def __init__(self, forest, input_cols = INPUT_COLS, defaults = None, cleaning_params = None, version = None):
+        """
+        A trained forest together with what is needed to use it outside the notebook.
+
+        PARAMETERS:
+        forest: (RandomForestRegressor) Fitted on input_cols, in that order
+        input_cols: (List[String]) Feature columns
+        defaults: (Dictionary) Value used for an input missing from a request (training medians),
+                  e.g. the coordinates when a request gives none
+        cleaning_params: (Dictionary) condo_pipeline.CLEANING_PARAMS the training table was cleaned with
+        version: (String) Identifies the model in logs and responses
+        """
+        self.forest = forest
+        self.input_cols = list(input_cols)
+        self.defaults = defaults or {}
+        self.cleaning_params = cleaning_params or {}
+        self.version = version or time.strftime("%Y%m%d-%H%M%S")
+
+    def predict(self, X):
+        """
+        PARAMETERS:
+        X: (Array) Rows of input_cols
+        """
+        return self.forest.predict(np.asarray(X, dtype = 'float64'))
+
+    def feature_rows(self, records):
+        """
+        Turns request records into a feature array. A record may use the column names
+        of input_cols or the make_prediction names of REQUEST_FIELDS; missing inputs
+        are filled with defaults.
+        """
+        X = np.empty((len(records), len(self.input_cols)))
+
+        for i, record in enumerate(records):
+            values = {REQUEST_FIELDS.get(name, name): value for name, value in record.items()}
+            for j, column in enumerate(self.input_cols):
+                value = values.get(column)
+                X[i, j] = self.defaults[column] if value == None or value == "" else float(value)
+
+        return X
+
+    def predict_records(self, records):
+
+        return self.predict(self.feature_rows(records))
+
+
+def training_table(condos, input_cols = INPUT_COLS):
+    """
+    Rows of a cleaned, geocoded table that have every input and the target.
+    """
+    return condos.dropna(subset = list(input_cols) + [TARGET_COL])
+
+
+def train(condos, params = None, input_cols = INPUT_COLS, random_state = None, n_jobs = None):
+    """
+    Fits the notebook's RandomForest on a cleaned, geocoded table (condo_pipeline
+    + geocoder). Returns a CondoModel.
+
+    PARAMETERS:
+    params: (Dictionary or None) Overrides of FOREST_PARAMS
+    """
+    # Imported here so that loading a model artifact for prediction does not pay for scikit-learn
+    from sklearn.ensemble import RandomForestRegressor
+    from condo_pipeline import CLEANING_PARAMS
+
+    params = dict(FOREST_PARAMS, **(params or {}))
+    table = training_table(condos, input_cols)
+
+    forest = RandomForestRegressor(random_state = random_state, n_jobs = n_jobs, **params)
+    forest.fit(table[input_cols].to_numpy(dtype = 'float64'), table[TARGET_COL].to_numpy(dtype = 'float64'))
+
+    defaults = {column: float(table[column].median()) for column in input_cols}
+
+    return CondoModel(forest, input_cols, defaults, dict(CLEANING_PARAMS))
+
+
+def save_model(model, path):
+    """
+    Paths ending in .pkl get a pickle of the model's fields (not the CondoModel
+    itself, so the file loads whether or not condo_model was run as __main__).
+    Anything else is written as a memory-mappable model artifact directory (model_artifact.py).
+    """
+    if not path.endswith(".pkl"):
+        return export_artifact(model, path)
+
+    state = {'forest': model.forest, 'input_cols': model.input_cols, 'defaults': model.defaults,
+             'cleaning_params': model.cleaning_params, 'version': model.version}
+
+    with open(path, 'wb') as file:
+        pickle.dump(state, file, protocol = pickle.HIGHEST_PROTOCOL)
+
+
+def load_model(path):
+    """
+    Loads a model artifact directory or a .pkl file written by save_model.
+    """
+    if os.path.isdir(path):
+        return load_artifact(path)
+
+    with open(path, 'rb') as file:
+        return CondoModel(**pickle.load(file))
+
+
+def load_training_table(listings_file, geocode_cache, seed = None):
+    """
+    Cleans a crawler output file and adds coordinates from the geocode cache.
+    """
+    import condo_pipeline
+    from geocoder import GeocodeCache, Geocoder
+
+    cache = GeocodeCache(geocode_cache)
+    if seed:
+        cache.seed_from_coordinates_file(seed)
+
+    condos = Geocoder(cache).add_coordinates(condo_pipeline.read_condos(listings_file))
+    cache.close()
+
+    return condos
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("listings", help = "Crawler output (CSV file or Parquet directory)")
+    parser.add_argument("model", help = "Model artifact directory to write (or a .pkl file)")
+    parser.add_argument("--geocode-cache", default = "geocode_cache.sqlite")
+    parser.add_argument("--seed", help = "Coordinates file to load into the geocode cache first")
+    parser.add_argument("--random-state", type = int)
+    args = parser.parse_args()
+
+    condos = load_training_table(args.listings, args.geocode_cache, args.seed)
+    model = train(condos, random_state = args.random_state)
+    save_model(model, args.model)
+
+    print("Trained on " + str(len(training_table(condos))) + " listings. Model " + model.version + " written to " + args.model)
+
+
+if __name__ == '__main__':
+
+    main()
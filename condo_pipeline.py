@@ -0,0 +1,179 @@
+"""
+Cleaning of scraped condo listings, as first done cell by cell in CondoPrices.ipynb,
+in one vectorized pass that works on a whole table or on streamed chunks.
+
+    import condo_pipeline
+    condos = condo_pipeline.clean_condos(pd.read_csv("TorontoCondos-August2020.csv"))
+
+    for chunk in condo_pipeline.read_condos("TorontoCondos-August2020.csv", chunksize = 10000):
+        ...
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+# Cleaning parameters of the notebook. Passing a dictionary with any of these keys overrides them.
+CLEANING_PARAMS = {'sqft_per_m2': 10.75,   # Floor Area (m^2) -> Floor Area (sqft)
+                   'max_sqft': 2500,       # Larger areas come from rooms listed under several names
+                   'max_condo_fees': 3000,
+                   'storeys': 1}
+
+# Listings missing any of these are dropped
+REQUIRED_COLUMNS = ['Floor Area (m^2)', 'Price', 'Condo Fees', 'Bedrooms', 'Bathrooms']
+
+CATEGORICAL_COLUMNS = ['Style', 'Building Type', 'Basement Development', 'Exterior Finish', 'Fireplace',
+                       'OwnershipType', 'Property Type', 'Parking Type']
+
+RENAMED_COLUMNS = {'Floor Area (m^2)': 'Floor Area (sqft)',
+                   'Price': 'Price ($)',
+                   'Condo Fees': 'Condo Fees ($ Monthly)'}
+
+PRICE_PATTERN = r'^\s*\$?\s*([\d,]+(?:\.\d+)?)\s*$'             # "$1,234,000"
+CONDO_FEES_PATTERN = r'^\s*\$?\s*([\d,]+(?:\.\d+)?)\s+Monthly\s*$' # "$512 Monthly"; other periods are dropped
+BEDROOMS_PATTERN = r'^\s*(\d+)(?:\s*\+\s*(\d+))?\s*$'           # "2" or "2+1"
+
+# Text columns that pandas would otherwise guess per CSV chunk
+CSV_DTYPES = {'Price': 'str', 'Condo Fees': 'str', 'Bedrooms': 'str', 'Lot Size': 'str'}
+
+
+def extract_numbers(values, pattern):
+    """
+    Parses the numbers captured by the groups of pattern out of a text column,
+    e.g. "$1,234" -> 1234.0. Values that do not match become NaN.
+
+    str.extract and the number conversion run once per distinct value and the
+    results are mapped back onto the rows: prices, fees and bedroom counts repeat
+    a lot, so this is much cheaper than parsing every row.
+    Returns a float array of shape (rows, capture groups).
+    """
+    codes, uniques = pd.factorize(values)
+    groups = pd.Series(uniques, dtype = 'string').str.extract(pattern, expand = True)
+    numbers = np.column_stack([pd.to_numeric(groups[group].str.replace(",", "", regex = False), errors = 'coerce')
+                               .to_numpy(dtype = 'float64', na_value = np.nan) for group in groups.columns])
+
+    # Missing values have code -1: map them onto an extra row of NaN
+    numbers = np.vstack([numbers, np.full((1, numbers.shape[1]), np.nan)])
+    return numbers[codes]
+
+
+def extract_number(values, pattern):
+    """
+    The number captured by the single group of pattern, as a float Series. Columns
+    that are already numeric (e.g. read from the crawler's Parquet output) are
+    returned as floats.
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype('float64')
+
+    return pd.Series(extract_numbers(values, pattern)[:, 0], index = values.index)
+
+
+def parse_bedrooms(bedrooms):
+    """
+    "2" -> 2.0 and "2+1" -> 2.5 (a den counts as half a bedroom).
+    """
+    if pd.api.types.is_numeric_dtype(bedrooms):
+        return bedrooms.astype('float64')
+
+    rooms = extract_numbers(bedrooms, BEDROOMS_PATTERN)
+    return pd.Series(rooms[:, 0] + 0.5*np.nan_to_num(rooms[:, 1]), index = bedrooms.index)
+
+
+def clean_condos(listings, params = None):
+    """
+    Turns scraped condo listings into the model-ready table of the notebook:
+
+    - Drops listings missing a floor area, price, condo fees, bedrooms or bathrooms
+    - Floor Area (m^2) -> Floor Area (sqft), keeping areas below max_sqft
+    - Price -> Price ($) as an integer
+    - Condo Fees -> Condo Fees ($ Monthly), keeping monthly fees below max_condo_fees
+    - Bedrooms "2+1" -> 2.5, Bathrooms and Storeys as integers, keeping single storey units
+    - Adds the Postal Code taken from the end of the Address
+
+    Every conversion is computed once on the full column and the listings are
+    filtered with a single mask, so only the kept rows are copied.
+
+    PARAMETERS:
+    listings: (DataFrame) Rows as written by the crawler (CSV or Parquet)
+    params: (Dictionary or None) Overrides of CLEANING_PARAMS
+    """
+    params = dict(CLEANING_PARAMS, **(params or {}))
+
+    listings = listings.drop(columns = [column for column in listings.columns if column.startswith('Unnamed')])
+
+    sqft = (listings['Floor Area (m^2)']*params['sqft_per_m2']).round()
+    price = extract_number(listings['Price'], PRICE_PATTERN)
+    condo_fees = extract_number(listings['Condo Fees'], CONDO_FEES_PATTERN)
+    bedrooms = parse_bedrooms(listings['Bedrooms'])
+    storeys = pd.to_numeric(listings['Storeys'], errors = 'coerce')
+
+    keep = (listings[REQUIRED_COLUMNS].notna().all(axis = 1)
+            & (sqft < params['max_sqft'])
+            & price.notna()
+            & (condo_fees < params['max_condo_fees'])
+            & bedrooms.notna()
+            & (storeys == params['storeys']))
+
+    condos = listings.loc[keep].copy()
+
+    condos['Floor Area (m^2)'] = sqft[keep].astype('int32')
+    condos['Price'] = price[keep].astype('int64')
+    condos['Condo Fees'] = condo_fees[keep].astype('int32')
+    condos['Bedrooms'] = bedrooms[keep]
+    condos['Bathrooms'] = condos['Bathrooms'].astype('int32')
+    condos['Storeys'] = storeys[keep].astype('int32')
+
+    for column in CATEGORICAL_COLUMNS:
+        if column in condos.columns:
+            condos[column] = condos[column].astype('category')
+
+    condos['Postal Code'] = condos['Address'].str[-7:]
+
+    return condos.rename(columns = RENAMED_COLUMNS).reset_index(drop = True)
+
+
+def clean_condo_chunks(chunks, params = None):
+    """
+    Streaming form of clean_condos: cleans each DataFrame of an iterable of
+    chunks as it arrives. Categorical columns only hold the categories seen in
+    their own chunk, so use concat_chunks to put chunks back together.
+    """
+    for chunk in chunks:
+        yield clean_condos(chunk, params)
+
+
+def concat_chunks(chunks):
+    """
+    Concatenates cleaned chunks, merging the categories of categorical columns.
+    """
+    chunks = list(chunks)
+    if not chunks:
+        return pd.DataFrame()
+
+    for column in chunks[0].columns:
+        if isinstance(chunks[0][column].dtype, pd.CategoricalDtype):
+            categories = pd.api.types.union_categoricals([chunk[column] for chunk in chunks]).categories
+            for chunk in chunks:
+                chunk[column] = chunk[column].cat.set_categories(categories)
+
+    return pd.concat(chunks, ignore_index = True)
+
+
+def read_condos(path, chunksize = None, params = None):
+    """
+    Reads and cleans the crawler's output. A directory is read as the crawler's
+    Parquet dataset, anything else as CSV.
+
+    PARAMETERS:
+    path: (String) CSV file or Parquet directory
+    chunksize: (Int or None) CSV only: return an iterator of cleaned chunks of this many raw rows
+    params: (Dictionary or None) Overrides of CLEANING_PARAMS
+    """
+    if os.path.isdir(path) or path.endswith(".parquet"):
+        return clean_condos(pd.read_parquet(path), params)
+
+    if chunksize == None:
+        return clean_condos(pd.read_csv(path, dtype = CSV_DTYPES), params)
+    else:
+        return clean_condo_chunks(pd.read_csv(path, dtype = CSV_DTYPES, chunksize = chunksize), params)
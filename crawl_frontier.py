@@ -0,0 +1,197 @@
+import time
+import heapq
+import sqlite3
+import threading
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Query parameters that only track where a click came from
+TRACKING_PARAMS = ('utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content', 'gclid', 'fbclid', 'ref')
+
+# Priority classes of the "new-first" policy: lower is fetched first
+NEVER_SEEN, NEVER_FETCHED, REFETCH = 0, 1, 2
+
+
+def normalize_href(href, base = None):
+    """
+    Canonical form of a listing link, so that the same listing found through
+    different links is only fetched once: made absolute against base, scheme and
+    host lowercased, default port, fragment and tracking parameters dropped, and
+    the remaining query parameters sorted.
+    """
+    if base != None:
+        href = urljoin(base, href)
+
+    parts = urlsplit(href.strip())
+    scheme = parts.scheme.lower()
+    host = parts.netloc.lower()
+    if (scheme == "http" and host.endswith(":80")) or (scheme == "https" and host.endswith(":443")):
+        host = host.rsplit(":", 1)[0]
+
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values = True)
+                   if name.lower() not in TRACKING_PARAMS)
+
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+
+class CrawlFrontier:
+
+    def __init__(self, file_name = None, policy = "new-first", refetch_after = None, stale_pages = 1):
+        """
+        The listings waiting to be fetched, across all index pages of a crawl.
+
+        Every href is normalized (normalize_href) and checked against a seen-set:
+        a listing repeated on several index pages (featured listings) is fetched
+        once per crawl, and with a file_name the set is kept between runs, so a
+        listing fetched in an earlier run is not fetched again until refetch_after.
+        Listings beyond a page's limit are not dropped: they stay in the frontier
+        and are fetched with the next page, or kept in the file as never fetched.
+
+        PARAMETERS:
+        file_name: (String or None) SQLite file keeping the frontier between runs. None = This run only.
+        policy: (String) "new-first" = Listings never seen before, then ones seen but never
+                fetched, then refetches (least recently fetched first), each in index page order.
+                "page-order" = Index page order only.
+        refetch_after: (Float or None) Seconds after which a fetched listing is fetched again. None = Never.
+        stale_pages: (Int or None) Stop paging after this many index pages in a row with
+                     nothing new to fetch. None = Never stop early.
+        """
+        if policy not in ("new-first", "page-order"):
+            raise ValueError("(CrawlFrontier) Unknown policy '" + str(policy) + "', use 'new-first' or 'page-order'")
+
+        self.file_name = file_name
+        self.policy = policy
+        self.refetch_after = refetch_after
+        self.stale_pages = stale_pages
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(file_name or ":memory:", check_same_thread = False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS frontier (
+                href TEXT PRIMARY KEY,
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL,
+                last_fetched REAL
+            )""")
+        self.connection.commit()
+
+        self.run_time = None
+        self.known = {}
+        self.run_seen = set()
+        self.pending = []
+        self.sequence = 0
+        self.stale_count = 0
+        self.stats = {}
+
+    def start(self):
+        """
+        Loads the seen-set at the start of a crawl.
+        """
+        with self.lock:
+            self.run_time = time.time()
+            self.known = dict(self.connection.execute("SELECT href, last_fetched FROM frontier").fetchall())
+            self.run_seen = set()
+            self.pending = []
+            self.sequence = 0
+            self.stale_count = 0
+            self.stats = {'found': 0, 'duplicates': 0, 'already_fetched': 0, 'queued': 0, 'fetched': 0}
+
+    def priority(self, href):
+
+        if self.policy == "page-order":
+            return (0, 0)
+        if href not in self.known:
+            return (NEVER_SEEN, 0)
+        if self.known[href] == None:
+            return (NEVER_FETCHED, 0)
+        return (REFETCH, self.known[href])
+
+    def due(self, href):
+        """
+        Whether a listing should be fetched in this run.
+        """
+        last_fetched = self.known.get(href)
+        if last_fetched == None:
+            return True
+        return self.refetch_after != None and self.run_time - last_fetched >= self.refetch_after
+
+    def add_page(self, hrefs, base = None, selected = None):
+        """
+        Adds the links of an index page. Returns the number of hrefs queued for fetching.
+
+        PARAMETERS:
+        selected: (Collection or None) The hrefs to queue, fetched before or not, e.g. the new listings
+                  and refresh sample of an incremental crawl. The others are only recorded as seen.
+                  None = The ones that are due.
+        """
+        seen = []
+        queued = []
+        with self.lock:
+            for href in hrefs:
+                href = normalize_href(href, base)
+                self.stats['found'] = self.stats['found'] + 1
+
+                if href in self.run_seen:
+                    self.stats['duplicates'] = self.stats['duplicates'] + 1
+                    continue
+                self.run_seen.add(href)
+                seen.append(href)
+
+                if not (self.due(href) if selected == None else href in selected):
+                    self.stats['already_fetched'] = self.stats['already_fetched'] + 1
+                    continue
+
+                heapq.heappush(self.pending, self.priority(href) + (self.sequence, href))
+                self.sequence = self.sequence + 1
+                queued.append(href)
+
+            self.connection.executemany(
+                "INSERT INTO frontier (href, first_seen, last_seen) VALUES (?, ?, ?) "
+                "ON CONFLICT(href) DO UPDATE SET last_seen = excluded.last_seen",
+                [(href, self.run_time, self.run_time) for href in seen])
+            self.connection.commit()
+
+            # A refresh sample is queued on every page, so only listings never fetched count as new
+            new = queued if selected == None else [href for href in queued if self.known.get(href) == None]
+
+            for href in queued:
+                self.known.setdefault(href, None)
+
+            self.stats['queued'] = self.stats['queued'] + len(queued)
+            self.stale_count = 0 if new else self.stale_count + 1
+
+        return len(queued)
+
+    def next_batch(self, limit = None):
+        """
+        Takes up to limit hrefs from the frontier, highest priority first. None = All of them.
+        """
+        with self.lock:
+            count = len(self.pending) if limit == None else min(limit, len(self.pending))
+            return [heapq.heappop(self.pending)[-1] for _ in range(count)]
+
+    def mark_fetched(self, href):
+
+        with self.lock:
+            self.known[href] = self.run_time
+            self.stats['fetched'] = self.stats['fetched'] + 1
+            self.connection.execute("UPDATE frontier SET last_fetched = ? WHERE href = ?", (self.run_time, href))
+            self.connection.commit()
+
+    def exhausted(self):
+        """
+        True when the last stale_pages index pages had nothing new to fetch, so later pages are not worth requesting.
+        """
+        return self.stale_pages != None and self.stale_count >= self.stale_pages
+
+    def finish(self):
+        """
+        Listings still pending stay in the file with no fetch time, so a later run fetches them when it finds them.
+        """
+        print("(CrawlFrontier) " + str(self.stats['queued']) + " listings queued, " + str(self.stats['fetched'])
+              + " fetched, " + str(self.stats['duplicates']) + " duplicates and " + str(self.stats['already_fetched'])
+              + " already fetched skipped, " + str(len(self.pending)) + " left for the next run.")
+
+    def close(self):
+
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,392 @@
+"""
+Crawl instrumentation: counters, gauges and histograms of what a crawl spends its
+time on, exported as Prometheus text (e.g. for the node_exporter textfile
+collector) or appended as JSON lines, plus a sampling profiler for listing pages.
+
+    crawler.set_metrics(jsonl_file = "crawl.metrics.jsonl", prometheus_file = "crawl.prom", profile_every = 100)
+"""
+import io
+import os
+import json
+import time
+import pstats
+import threading
+import cProfile
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PARSE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+# name: (type, help, buckets). Every metric is exported with the "crawl_" prefix.
+METRICS = {'fetch_seconds': ('histogram', "Time to fetch a page, by host and outcome (ok, cache, error)", LATENCY_BUCKETS),
+           'fetch_bytes': ('counter', "Bytes of page bodies received, by host", None),
+           'fetches': ('counter', "Pages fetched, by host and outcome", None),
+           'parse_page_seconds': ('histogram', "Time to parse a listing page into a row", PARSE_BUCKETS),
+           'parse_container_seconds': ('histogram', "Time to parse one data container of a listing page", PARSE_BUCKETS),
+           'errors': ('counter', "Errors, by the function reporting them", None),
+           'items': ('counter', "Listings stored, by result (ok, failed)", None),
+           'queue_depth': ('gauge', "Items waiting in a crawl queue, by queue", None),
+           'items_per_second': ('gauge', "Listings stored per second over the recent window", None),
+           'eta_seconds': ('gauge', "Estimated seconds until the crawl's listing total is reached", None),
+           'concurrency_window': ('gauge', "Requests allowed in flight by the adaptive concurrency control, by host", None),
+           'throttled': ('counter', "Throttling signals (429, 503, timeout) seen by the adaptive concurrency control, by host", None)}
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        """
+        Counts of observations at or below every bucket bound (cumulative, as in Prometheus).
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0]*len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+
+        self.count = self.count + 1
+        self.sum = self.sum + value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] = self.counts[i] + 1
+
+    def to_dict(self):
+
+        return {'buckets': dict(zip([str(bound) for bound in self.buckets], self.counts)), 'count': self.count, 'sum': self.sum}
+
+
+class CrawlMetrics:
+
+    def __init__(self, window = 50):
+        """
+        Thread-safe store of a crawl's metrics (see METRICS). Labels are keyword
+        arguments, e.g. metrics.inc('errors', function = "soupify_request").
+
+        PARAMETERS:
+        window: (Int) Number of recent listings the rate and ETA are computed over
+        """
+        self.lock = threading.Lock()
+        self.values = {}
+        self.histograms = {}
+        self.start_time = time.time()
+        self.recent_items = deque(maxlen = window)
+
+    def key(self, name, labels):
+
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name, amount = 1, **labels):
+
+        key = self.key(name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+
+        with self.lock:
+            self.values[self.key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+
+        key = self.key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram == None:
+                histogram = self.histograms[key] = Histogram(METRICS[name][2])
+            histogram.observe(value)
+
+    def get(self, name, **labels):
+
+        with self.lock:
+            return self.values.get(self.key(name, labels), 0)
+
+    def total(self, name):
+        """
+        Sum of a counter over all of its labels.
+        """
+        with self.lock:
+            return sum(value for (metric, _), value in self.values.items() if metric == name)
+
+    def by_label(self, name, label):
+        """
+        A counter's values by one of its labels, e.g. by_label('errors', 'function').
+        """
+        with self.lock:
+            return {dict(labels).get(label): value for (metric, labels), value in self.values.items() if metric == name}
+
+    @contextmanager
+    def timer(self, name, **labels):
+
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time, **labels)
+
+    def record_fetch(self, link, seconds, response, outcome):
+        """
+        PARAMETERS:
+        outcome: (String) "ok", "cache" or "error"
+        """
+        host = urlparse(link).netloc
+        self.observe('fetch_seconds', seconds, host = host, outcome = outcome)
+        self.inc('fetches', host = host, outcome = outcome)
+        if response != None:
+            self.inc('fetch_bytes', len(response.content or b""), host = host)
+
+    def record_error(self, function):
+
+        self.inc('errors', function = function)
+
+    def record_parse(self, stats):
+        """
+        Records the timings and errors a CompiledPageSpec.parse collected in its stats dictionary.
+        """
+        if 'seconds' in stats:
+            self.observe('parse_page_seconds', stats['seconds'])
+        for container, seconds in stats.get('containers', {}).items():
+            self.observe('parse_container_seconds', seconds, container = container)
+        for function, count in stats.get('errors', {}).items():
+            self.inc('errors', count, function = function)
+
+    def item_done(self, success, total = None):
+        """
+        Counts a stored listing and updates the rate and ETA gauges.
+
+        PARAMETERS:
+        total: (Int or None) Listings the crawl is expected to store in all
+        """
+        self.inc('items', result = "ok" if success else "failed")
+
+        with self.lock:
+            self.recent_items.append(time.time())
+            recent = list(self.recent_items)
+
+        rate = (len(recent) - 1)/(recent[-1] - recent[0]) if len(recent) > 1 and recent[-1] > recent[0] else 0.0
+        self.set('items_per_second', rate)
+        if total != None and rate > 0:
+            self.set('eta_seconds', max(total - self.total('items'), 0)/rate)
+
+    def progress(self, total = None):
+        """
+        One-line status of the crawl.
+        """
+        done = self.total('items')
+        line = "Data Collected: " + str(done) + ("/" + str(total) if total != None else "")
+        line = line + " (" + str(self.get('items', result = "failed")) + " failed, " \
+               + str(round(self.get('items_per_second'), 1)) + " listings/s, " + str(self.total('errors')) + " errors)"
+
+        eta = self.get('eta_seconds')
+        if total != None and eta:
+            line = line + " APPROX. TIME LEFT: " + str(int(eta//60)) + " MINS, " + str(round(eta) % 60) + "s."
+
+        return line
+
+    def snapshot(self):
+        """
+        All metrics as a JSON-serializable dictionary.
+        """
+        with self.lock:
+            values = [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in self.values.items()]
+            histograms = [dict({'name': name, 'labels': dict(labels)}, **histogram.to_dict())
+                          for (name, labels), histogram in self.histograms.items()]
+
+        return {'time': round(time.time(), 3), 'elapsed': round(time.time() - self.start_time, 3),
+                'values': values, 'histograms': histograms}
+
+    def prometheus_text(self):
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        with self.lock:
+            values = dict(self.values)
+            histograms = {key: (histogram.buckets, list(histogram.counts), histogram.count, histogram.sum)
+                          for key, histogram in self.histograms.items()}
+
+        lines = []
+        for name, (metric_type, help_text, _) in METRICS.items():
+            series = [(labels, value) for (metric, labels), value in values.items() if metric == name]
+            hist_series = [(labels, value) for (metric, labels), value in histograms.items() if metric == name]
+            if not series and not hist_series:
+                continue
+
+            full_name = "crawl_" + name + ("_total" if metric_type == 'counter' else "")
+            lines.append("# HELP " + full_name + " " + help_text)
+            lines.append("# TYPE " + full_name + " " + metric_type)
+
+            for labels, value in sorted(series):
+                lines.append(full_name + label_text(labels) + " " + repr(float(value)))
+
+            for labels, (buckets, counts, count, total) in sorted(hist_series):
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(full_name + "_bucket" + label_text(labels + (('le', str(bound)),)) + " " + str(bucket_count))
+                lines.append(full_name + "_bucket" + label_text(labels + (('le', "+Inf"),)) + " " + str(count))
+                lines.append(full_name + "_sum" + label_text(labels) + " " + repr(total))
+                lines.append(full_name + "_count" + label_text(labels) + " " + str(count))
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, file_name):
+        """
+        Replaces file_name atomically, so a collector never reads half a file.
+        """
+        temp_name = file_name + ".tmp"
+        with open(temp_name, 'w') as file:
+            file.write(self.prometheus_text())
+        os.replace(temp_name, file_name)
+
+    def write_jsonl(self, file_name):
+
+        with open(file_name, 'a') as file:
+            file.write(json.dumps(self.snapshot()) + "\n")
+
+
+def label_text(labels):
+
+    if not labels:
+        return ""
+
+    escaped = [(name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for name, value in labels]
+    return "{" + ",".join(name + "=\"" + value + "\"" for name, value in escaped) + "}"
+
+
+class MetricsExporter:
+
+    def __init__(self, metrics, jsonl_file = None, prometheus_file = None, interval = 10):
+        """
+        Writes the metrics every interval seconds from a background thread, and once more on stop().
+
+        PARAMETERS:
+        jsonl_file: (String or None) A snapshot is appended as one JSON line
+        prometheus_file: (String or None) Rewritten with the current values in Prometheus text format
+        interval: (Float) Seconds between exports
+        """
+        self.metrics = metrics
+        self.jsonl_file = jsonl_file
+        self.prometheus_file = prometheus_file
+        self.interval = interval
+
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def export(self):
+
+        if self.jsonl_file != None:
+            self.metrics.write_jsonl(self.jsonl_file)
+        if self.prometheus_file != None:
+            self.metrics.write_prometheus(self.prometheus_file)
+
+    def run(self):
+
+        while not self.stopped.wait(self.interval):
+            self.export()
+
+    def start(self):
+
+        self.stopped.clear()
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def stop(self):
+
+        self.stopped.set()
+        if self.thread != None:
+            self.thread.join()
+            self.thread = None
+        self.export()
+
+
+class PageProfiler:
+
+    def __init__(self, sample_every = 100, backend = "cprofile", output = None):
+        """
+        Profiles one listing out of every sample_every, from fetch to row. Only one
+        page is profiled at a time; a sample falling on a busy profiler is skipped.
+
+        PARAMETERS:
+        backend: (String) "cprofile" (the samples are added up into one pstats file)
+                 or "pyinstrument" (a text report per sample, appended to output)
+        output: (String or None) Where dump() writes the profile. None = Print the top functions.
+        """
+        if backend == "pyinstrument":
+            import pyinstrument    # Fail early when the optional profiler is missing
+
+        self.sample_every = sample_every
+        self.backend = backend
+        self.output = output
+
+        self.calls = 0
+        self.samples = 0
+        self.stats = None
+        self.reports = []
+        self.lock = threading.Lock()
+        self.busy = threading.Lock()
+
+    def run(self, function, *args):
+
+        with self.lock:
+            self.calls = self.calls + 1
+            sample = self.calls % self.sample_every == 1 or self.sample_every == 1
+
+        if not sample or not self.busy.acquire(blocking = False):
+            return function(*args)
+
+        try:
+            if self.backend == "pyinstrument":
+                return self.run_pyinstrument(function, args)
+            else:
+                return self.run_cprofile(function, args)
+        finally:
+            self.busy.release()
+
+    def run_cprofile(self, function, args):
+
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function, *args)
+        finally:
+            with self.lock:
+                self.samples = self.samples + 1
+                if self.stats == None:
+                    self.stats = pstats.Stats(profile, stream = io.StringIO())
+                else:
+                    self.stats.add(profile)
+
+    def run_pyinstrument(self, function, args):
+
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            return function(*args)
+        finally:
+            profiler.stop()
+            with self.lock:
+                self.samples = self.samples + 1
+                self.reports.append(profiler.output_text())
+
+    def dump(self, top = 20):
+
+        if self.samples == 0:
+            return
+
+        if self.backend == "pyinstrument":
+            text = "\n".join(self.reports)
+            if self.output == None:
+                print(text)
+            else:
+                with open(self.output, 'a') as file:
+                    file.write(text)
+        elif self.output != None:
+            self.stats.dump_stats(self.output)
+        else:
+            stream = io.StringIO()
+            self.stats.stream = stream
+            self.stats.sort_stats("cumulative").print_stats(top)
+            print(stream.getvalue())
+
+        print("(PageProfiler) " + str(self.samples) + " sampled pages" + ("" if self.output == None else " written to " + self.output))
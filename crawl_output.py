@@ -0,0 +1,563 @@
+import os
+import csv
+import json
+from array import array
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class StreamingCSVWriter:
+
+    def __init__(self, file_name, field_names):
+        """
+        Writes scraped rows to a CSV file as soon as they are produced, instead of
+        holding the whole crawl in memory until RealEstateCrawler.write(). The file
+        has the same layout as the one written by RealEstateCrawler.write(): fields
+        not listed in field_names (e.g. unconfigured container labels) are left out.
+
+        PARAMETERS:
+        file_name: (String) Output CSV file
+        field_names: (List[String]) Column order of the CSV file
+        """
+        self.file_name = file_name
+        self.field_names = field_names
+
+        self.file = None
+        self.writer = None
+
+    def open(self, append = False):
+        """
+        PARAMETERS:
+        append: (Boolean) Continue an existing file (resumed crawl). The header is
+                only written if the file is new or empty.
+        """
+        has_rows = append and os.path.exists(self.file_name) and os.path.getsize(self.file_name) > 0
+
+        self.file = open(self.file_name, 'a' if append else 'w')
+        self.writer = csv.DictWriter(self.file, delimiter = ",", fieldnames = self.field_names, extrasaction = 'ignore')
+
+        if not has_rows:
+            self.writer.writeheader()
+            self.file.flush()
+
+    def write_row(self, row):
+
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def write_rows(self, rows):
+
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def sync(self):
+        """
+        Rows are on disk as soon as they are written.
+        """
+        self.file.flush()
+
+    def close(self):
+
+        if self.file != None:
+            self.file.close()
+            self.file = None
+            print("\nWrote Data to " + self.file_name)
+
+
+class CrawlCheckpoint:
+
+    def __init__(self, file_name):
+        """
+        Records the progress of a crawl in an append-only JSON lines file: one line
+        per scraped listing href and one per fully completed index page. A crawl
+        started with resume = True reads it back and skips that work.
+
+        A listing is recorded only after its row has been flushed to the output,
+        so a crash can at worst repeat the single listing in progress.
+
+        PARAMETERS:
+        file_name: (String) Checkpoint file
+        """
+        self.file_name = file_name
+
+        self.pages = set()
+        self.hrefs = set()
+        self.file = None
+
+    def open(self, resume = False):
+        """
+        PARAMETERS:
+        resume: (Boolean) Load the recorded progress. Otherwise the checkpoint is started over.
+        """
+        self.pages = set()
+        self.hrefs = set()
+        partial_line = False
+
+        if resume and os.path.exists(self.file_name):
+            with open(self.file_name) as file:
+                for line in file:
+                    partial_line = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash
+                        continue
+
+                    if 'page' in entry:
+                        self.pages.add(entry['page'])
+                    elif 'href' in entry:
+                        self.hrefs.add(entry['href'])
+
+            print("(CrawlCheckpoint) Resuming with " + str(len(self.pages)) + " pages and " + str(len(self.hrefs)) + " listings done.")
+
+        self.file = open(self.file_name, 'a' if resume else 'w')
+        if partial_line:
+            self.file.write("\n")
+
+    def exists(self):
+        """
+        Whether there is recorded progress to resume from.
+        """
+        return os.path.exists(self.file_name)
+
+    def page_done(self, page):
+
+        return page in self.pages
+
+    def item_done(self, href):
+
+        return href in self.hrefs
+
+    def mark_page(self, page):
+
+        self.pages.add(page)
+        self.record({'page': page})
+
+    def mark_item(self, href):
+
+        self.hrefs.add(href)
+        self.record({'href': href})
+
+    def record(self, entry):
+
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+
+    def close(self):
+
+        if self.file != None:
+            self.file.close()
+            self.file = None
+
+
+def missing(value):
+
+    return value == None or (isinstance(value, float) and value != value) or value == "nan" or value == ""
+
+
+def parse_price(value):
+    """
+    "$1,234,000" -> 1234000
+    """
+    digits = str(value).replace("$", "").replace(",", "").strip()
+    return int(float(digits))
+
+
+def parse_monthly_fee(value):
+    """
+    "$512 Monthly" -> 512. Fees quoted for any other period are left missing.
+    """
+    value = str(value).strip()
+    if not value.endswith("Monthly"):
+        return None
+    return parse_price(value[0:-len("Monthly")])
+
+
+def parse_bedrooms(value):
+    """
+    "2" -> 2.0 and "2+1" -> 2.5 (a den counts as half a bedroom)
+    """
+    rooms = str(value).strip().split("+")
+    bedrooms = float(rooms[0])
+    if len(rooms) > 1:
+        bedrooms = bedrooms + 0.5*float(rooms[1])
+    return bedrooms
+
+
+def parse_int(value):
+
+    return int(float(value))
+
+
+# (pyarrow type name, converter) of the fields whose text has a natural type.
+# Any other field is stored as text; the ones listed in CATEGORICAL_FIELDS are dictionary encoded.
+TYPED_FIELDS = {"Price":                 ("int64",   parse_price),
+                "Condo Fees":            ("int64",   parse_monthly_fee),
+                "Bedrooms":              ("float64", parse_bedrooms),
+                "Bathrooms":             ("int32",   parse_int),
+                "No. of Parking Spaces": ("int32",   parse_int),
+                "Storeys":               ("int32",   parse_int),
+                "Floor Area (m^2)":      ("float64", float)}
+
+CATEGORICAL_FIELDS = ["Style", "Building Type", "Basement Development", "Exterior Finish", "Fireplace",
+                      "OwnershipType", "Property Type", "Parking Type"]
+
+# Default chunk of a crawl that writes Parquet: every chunk is closed as its own part file
+PARQUET_FLUSH_ROWS = 256
+
+
+class ParquetRowWriter:
+
+    def __init__(self, path, field_names, row_group_size = 1024):
+        """
+        Columnar counterpart of StreamingCSVWriter. Rows are buffered and written
+        as Parquet row groups of row_group_size rows, with a typed schema derived
+        from field_names (see TYPED_FIELDS and CATEGORICAL_FIELDS): prices, fees
+        and room counts are numbers and repeated labels are dictionary encoded,
+        so a load can pick columns and skip the text clean up.
+
+        path is a directory of Parquet part files. A Parquet file can only be
+        read once it is closed (its footer is written last), so sync() closes the
+        current part and later rows go to a new one: everything written before a
+        sync() survives a crash, and a resumed crawl adds parts instead of
+        rewriting the previous ones. A part is written under a hidden name and
+        renamed when closed, so readers never see a partial file.
+        Read it back with pandas.read_parquet(path, columns = [...]).
+
+        PARAMETERS:
+        path: (String) Output directory
+        field_names: (List[String]) Columns of the Parquet schema
+        row_group_size: (Int) Rows buffered before a row group is written
+        """
+        if pyarrow == None:
+            raise ImportError("ParquetRowWriter requires pyarrow (pip install pyarrow)")
+
+        self.path = path
+        self.field_names = field_names
+        self.row_group_size = row_group_size
+
+        self.schema = pyarrow.schema([pyarrow.field(field_name, self.field_type(field_name)) for field_name in field_names])
+
+        self.rows = []
+        self.writer = None
+        self.file_name = None
+        self.part_count = 0
+        self.row_count = 0
+
+    def field_type(self, field_name):
+
+        if field_name in TYPED_FIELDS:
+            return pyarrow.type_for_alias(TYPED_FIELDS[field_name][0])
+        elif field_name in CATEGORICAL_FIELDS:
+            return pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        else:
+            return pyarrow.string()
+
+    def convert(self, field_name, value):
+
+        if missing(value):
+            return None
+
+        if field_name in TYPED_FIELDS:
+            try:
+                return TYPED_FIELDS[field_name][1](value)
+            except (TypeError, ValueError):
+                print("ERROR (ParquetRowWriter): Could not convert " + field_name + " value '" + str(value) + "'")
+                return None
+        else:
+            return str(value)
+
+    def open(self, append = False):
+        """
+        PARAMETERS:
+        append: (Boolean) Keep the files of earlier crawl sessions (resumed crawl).
+        """
+        os.makedirs(self.path, exist_ok = True)
+
+        for name in os.listdir(self.path):
+            # Parts left unfinished by a crash
+            if name.startswith(".part-"):
+                os.remove(os.path.join(self.path, name))
+
+        parts = sorted(name for name in os.listdir(self.path) if name.startswith("part-") and name.endswith(".parquet"))
+        if not append:
+            for name in parts:
+                os.remove(os.path.join(self.path, name))
+            parts = []
+
+        self.part_count = len(parts)
+        self.file_name = None
+        self.writer = None
+        self.rows = []
+        self.row_count = 0
+
+    def write_row(self, row):
+
+        self.rows.append(row)
+
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def write_rows(self, rows):
+
+        for row in rows:
+            self.write_row(row)
+
+    def flush(self):
+        """
+        Write the buffered rows as one row group.
+        """
+        if not self.rows:
+            return
+
+        columns = []
+        for field in self.schema:
+            values = [self.convert(field.name, row.get(field.name)) for row in self.rows]
+
+            if pyarrow.types.is_dictionary(field.type):
+                columns.append(pyarrow.array(values, type = pyarrow.string()).dictionary_encode())
+            else:
+                columns.append(pyarrow.array(values, type = field.type))
+
+        if self.writer == None:
+            self.file_name = os.path.join(self.path, "part-" + str(self.part_count).zfill(5) + ".parquet")
+            self.part_count = self.part_count + 1
+            self.writer = pyarrow.parquet.ParquetWriter(self.partial_name(), self.schema)
+
+        self.writer.write_table(pyarrow.Table.from_arrays(columns, schema = self.schema))
+        self.row_count = self.row_count + len(self.rows)
+        self.rows = []
+
+    def partial_name(self):
+
+        return os.path.join(self.path, "." + os.path.basename(self.file_name))
+
+    def sync(self):
+        """
+        Write the buffered rows and close the current part file, so every row written so far can be read back after a crash.
+        """
+        self.flush()
+
+        if self.writer != None:
+            self.writer.close()
+            self.writer = None
+            os.replace(self.partial_name(), self.file_name)
+
+    def close(self):
+
+        self.sync()
+        if self.file_name != None:
+            print("\nWrote " + str(self.row_count) + " rows to " + self.path)
+
+
+class WriterGroup:
+
+    def __init__(self, writers):
+        """
+        Sends every row to several writers, e.g. a StreamingCSVWriter and a ParquetRowWriter.
+        """
+        self.writers = writers
+
+    def open(self, append = False):
+
+        for writer in self.writers:
+            writer.open(append = append)
+
+    def write_row(self, row):
+
+        for writer in self.writers:
+            writer.write_row(row)
+
+    def write_rows(self, rows):
+
+        rows = list(rows)
+        for writer in self.writers:
+            writer.write_rows(rows)
+
+    def sync(self):
+
+        for writer in self.writers:
+            writer.sync()
+
+    def close(self):
+
+        for writer in self.writers:
+            writer.close()
+
+
+# Fields RowStore keeps as codes: the categorical ones plus the counts and lists of
+# features whose text repeats from listing to listing
+LOW_CARDINALITY_FIELDS = CATEGORICAL_FIELDS + ["Bedrooms", "Bathrooms", "No. of Parking Spaces", "Storeys",
+                                               "Amenities Nearby", "Lot Size", "Features", "Community Features"]
+
+# Stands for a field a row does not have, so it is left out again when the row is read back
+NO_VALUE = object()
+NAN = float("nan")
+
+
+class RowStore:
+
+    def __init__(self, field_names, categorical_fields = LOW_CARDINALITY_FIELDS):
+        """
+        Column-wise store of scraped rows bound to field_names, used in place of a
+        list of row dictionaries (RealEstateCrawler.data). Every field is one column:
+        the fields of categorical_fields hold int codes into their distinct values,
+        so a label such as "Apartment" is kept once however many rows have it, and
+        the others (address, price, area) a list of the values. Rows are rebuilt as dictionaries when read
+        (iteration, indexing), so the store can be passed to csv.DictWriter.writerows
+        and to the writers' write_rows. Fields not in field_names are not kept.
+
+        PARAMETERS:
+        field_names: (List[String]) Fields kept, in output order
+        categorical_fields: (List[String]) Fields with few distinct values, stored as codes
+        """
+        self.field_names = list(field_names)
+        self.categorical = [field_name in categorical_fields for field_name in self.field_names]
+
+        self.categories = [[] if categorical else None for categorical in self.categorical]
+        self.codes = [{} if categorical else None for categorical in self.categorical]
+        self.columns = []
+        self.row_count = 0
+
+        self.rooms = False
+        self.dedup = True
+        self.clear()
+
+    def track_rooms(self, dedup = True):
+        """
+        Keep the rooms of every row (its 'Rooms' list of (link, name, level, dimensions)
+        [See RealEstateCrawler.set_rooms_output]) in a side table, and fill the rows'
+        Storeys and Floor Area (m^2) from it when they are read, for all the stored rows
+        at once [See room_table.levels_and_space].
+
+        PARAMETERS:
+        dedup: (Boolean) Count a room listed twice in a listing once
+        """
+        self.rooms = True
+        self.dedup = dedup
+        self.clear()
+
+    def clear(self):
+        """
+        Drop the stored rows. The categories are kept, so codes stay the same from one chunk to the next.
+        """
+        self.columns = [array('i') if categorical else [] for categorical in self.categorical]
+        self.row_count = 0
+
+        self.room_columns = {'Row': array('i'), 'Listing': [], 'Room': [], 'Level': [], 'Dimensions': []}
+        self.room_keys = []
+        # Rooms and rows with rooms before these positions already have their Storeys and Floor Area
+        self.spaced_rooms = 0
+        self.spaced_keys = 0
+
+    def encode(self, column, value):
+
+        if not self.categorical[column]:
+            return value
+        if value is NO_VALUE:
+            return -1
+
+        if isinstance(value, float) and value != value:
+            value = NAN    # Every NaN is a different key
+        code = self.codes[column].get(value)
+        if code == None:
+            code = len(self.categories[column])
+            self.codes[column][value] = code
+            self.categories[column].append(value)
+        return code
+
+    def append(self, row):
+
+        for column, field_name in enumerate(self.field_names):
+            self.columns[column].append(self.encode(column, row.get(field_name, NO_VALUE)))
+
+        if self.rooms and 'Rooms' in row:
+            self.room_keys.append(self.row_count)
+            for link, name, level, dimensions in row['Rooms']:
+                self.room_columns['Row'].append(self.row_count)
+                self.room_columns['Listing'].append(link)
+                self.room_columns['Room'].append(name)
+                self.room_columns['Level'].append(level)
+                self.room_columns['Dimensions'].append(dimensions)
+
+        self.row_count = self.row_count + 1
+
+    def set_value(self, field_name, index, value):
+
+        if field_name in self.field_names:
+            column = self.field_names.index(field_name)
+            self.columns[column][index] = self.encode(column, value)
+
+    def compute_space(self):
+        """
+        Storeys and Floor Area (m^2) of the rows with rooms appended since the last time.
+        """
+        if self.spaced_keys == len(self.room_keys):
+            return
+
+        import pandas as pd
+        import room_table
+
+        rooms = pd.DataFrame({name: list(values[self.spaced_rooms:]) for name, values in self.room_columns.items()})
+        space = room_table.levels_and_space(rooms, keys = self.room_keys[self.spaced_keys:], key = "Row", dedup = self.dedup)
+
+        for index, storeys, area in zip(space.index, space['Storeys'], space['Floor Area']):
+            self.set_value('Storeys', index, int(storeys))
+            self.set_value('Floor Area (m^2)', index, 0 if area == 0 else float(area))
+
+        self.spaced_rooms = len(self.room_columns['Row'])
+        self.spaced_keys = len(self.room_keys)
+
+    def room_rows(self):
+        """
+        The rooms of the stored rows as dictionaries with the fields of room_table.ROOM_FIELDS.
+        """
+        columns = self.room_columns
+        for index in range(len(columns['Row'])):
+            yield {'Listing': columns['Listing'][index], 'Room': columns['Room'][index],
+                   'Level': columns['Level'][index], 'Dimensions': columns['Dimensions'][index]}
+
+    def row(self, index):
+
+        row = {}
+        for column, field_name in enumerate(self.field_names):
+            value = self.columns[column][index]
+            if self.categorical[column]:
+                if value >= 0:
+                    row[field_name] = self.categories[column][value]
+            elif value is not NO_VALUE:
+                row[field_name] = value
+        return row
+
+    def __len__(self):
+
+        return self.row_count
+
+    def __getitem__(self, index):
+
+        if index < 0:
+            index = index + self.row_count
+        if not 0 <= index < self.row_count:
+            raise IndexError("RowStore index out of range")
+        self.compute_space()
+        return self.row(index)
+
+    def __iter__(self):
+
+        self.compute_space()
+        for index in range(self.row_count):
+            yield self.row(index)
+
+    def flush(self, writer):
+        """
+        Write the stored rows with writer.write_rows and drop them. Returns the number of rows written.
+        """
+        count = self.row_count
+        if count > 0:
+            writer.write_rows(self)
+            self.clear()
+        return count
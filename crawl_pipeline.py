@@ -0,0 +1,182 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# The CompiledPageSpec of the crawl, set once in every parser process
+worker_page_spec = None
+
+
+def init_parser_worker(page_spec):
+
+    global worker_page_spec
+    worker_page_spec = page_spec
+
+
+def parse_listing(page_html, link):
+    """
+    Runs in a parser process: turns the raw HTML of a listing into a row dictionary.
+    Returns (row, stats), stats being the parse timings and errors for the crawl's metrics.
+    """
+    stats = {}
+    row = worker_page_spec.parse(page_html, link, stats)
+
+    return row, stats
+
+
+class CrawlPipeline:
+
+    def __init__(self, crawler, parse_workers = None, queue_size = 64):
+        """
+        Splits the scraping of listings into three stages so that HTML parsing is
+        not held back by the GIL:
+
+        1. Fetchers: crawler.max_workers threads download listings and push the
+           raw HTML onto a bounded queue.
+        2. Parsers: a ProcessPoolExecutor of parse_workers processes turns HTML
+           into row dictionaries with the crawler's CompiledPageSpec.
+        3. Writer: the calling thread stores the rows (crawler.store_item) in the
+           order the listings appear on the index page.
+
+        The HTML queue holds at most queue_size pages and at most 2*parse_workers
+        pages are handed to the parsers at once, so memory stays flat however large the crawl.
+
+        PARAMETERS:
+        crawler: (RealEstateCrawler)
+        parse_workers: (Int or None) Parser processes. None = One per CPU core.
+        queue_size: (Int) Maximum number of fetched pages waiting to be parsed.
+        """
+        self.crawler = crawler
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+
+        self.fetch_pool = None
+        self.parse_pool = None
+        self.html_queue = None
+
+    def start(self, page_spec):
+        """
+        Start the worker pools for a crawl.
+
+        PARAMETERS:
+        page_spec: (CompiledPageSpec) Sent once to every parser process.
+        """
+        self.parse_pool = ProcessPoolExecutor(max_workers = self.parse_workers,
+                                              initializer = init_parser_worker, initargs = (page_spec,))
+        self.fetch_pool = ThreadPoolExecutor(max_workers = self.crawler.max_workers)
+
+    def stop(self):
+
+        if self.fetch_pool != None:
+            self.fetch_pool.shutdown()
+            self.fetch_pool = None
+        if self.parse_pool != None:
+            self.parse_pool.shutdown()
+            self.parse_pool = None
+
+    def run(self, hrefs, headers = None, timeout = 5):
+        """
+        Fetch, parse and store every listing in hrefs. Returns once all of their
+        rows have been stored.
+        """
+        self.html_queue = queue.Queue(maxsize = self.queue_size)
+        row_queue = queue.Queue()
+
+        for position, href in enumerate(hrefs):
+            self.fetch_pool.submit(self.fetch, position, href, headers, timeout)
+
+        dispatcher = threading.Thread(target = self.dispatch, args = (len(hrefs), row_queue), daemon = True)
+        dispatcher.start()
+
+        self.write(len(hrefs), row_queue)
+        dispatcher.join()
+
+    def fetch(self, position, href, headers, timeout):
+        """
+        Fetcher stage. Blocks while the HTML queue is full.
+        """
+        try:
+            if self.crawler.verbose:
+                print(href)
+            if self.crawler.profiler != None:
+                page_html = self.crawler.profiler.run(self.crawler.fetch_page, href, headers, timeout)
+            else:
+                page_html = self.crawler.fetch_page(href, headers, timeout)
+        except Exception as error:
+            self.crawler.error("CrawlPipeline.fetch", href + " raised " + repr(error))
+            page_html = 0
+
+        self.html_queue.put((position, href, page_html))
+        self.crawler.metrics.set('queue_depth', self.html_queue.qsize(), queue = "html")
+
+    def dispatch(self, total, row_queue):
+        """
+        Moves fetched pages from the HTML queue to the parser processes.
+        """
+        parse_slots = threading.BoundedSemaphore(2*self.parse_workers)
+        metrics = self.crawler.metrics
+        broken = False
+
+        for _ in range(total):
+            position, href, page_html = self.html_queue.get()
+            metrics.set('queue_depth', self.html_queue.qsize(), queue = "html")
+
+            if page_html == 0:
+                self.crawler.error("item_scrape", "Listing '" + href + "' could not be scraped")
+                row_queue.put((position, href, 0))
+                continue
+
+            # Once the parser pool is broken (e.g. a worker was killed) the remaining listings are
+            # stored as failed, so that the writer still gets every position and returns
+            if not broken:
+                parse_slots.acquire()
+                metrics.inc('queue_depth', 1, queue = "parsing")
+                try:
+                    future = self.parse_pool.submit(parse_listing, page_html, href)
+                except Exception as error:
+                    parse_slots.release()
+                    metrics.inc('queue_depth', -1, queue = "parsing")
+                    self.crawler.error("CrawlPipeline.dispatch", "Parsing " + href + " raised " + repr(error)
+                                       + ", the remaining listings of the batch are not parsed")
+                    broken = True
+                else:
+                    future.add_done_callback(lambda done, position = position, href = href:
+                                             self.parsed(done, position, href, row_queue, parse_slots))
+                    continue
+
+            row_queue.put((position, href, 0))
+
+    def parsed(self, future, position, href, row_queue, parse_slots):
+
+        parse_slots.release()
+        self.crawler.metrics.inc('queue_depth', -1, queue = "parsing")
+
+        try:
+            row, stats = future.result()
+        except Exception as error:
+            self.crawler.error("CrawlPipeline.parse", href + " raised " + repr(error))
+            row = 0
+        else:
+            self.crawler.metrics.record_parse(stats)
+
+        row_queue.put((position, href, row))
+
+    def write(self, total, row_queue):
+        """
+        Writer stage. Rows that finish early wait in a small reorder buffer so
+        that they are stored in index page order.
+        """
+        pending = {}
+        next_position = 0
+
+        while next_position < total:
+            position, href, row = row_queue.get()
+            pending[position] = (href, row)
+
+            while next_position in pending:
+                href, row = pending.pop(next_position)
+                self.crawler.store_item(href, row)
+                next_position = next_position + 1
+
+            self.crawler.metrics.set('queue_depth', len(pending), queue = "reorder")
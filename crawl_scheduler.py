@@ -0,0 +1,236 @@
+"""
+Runs a list of crawl jobs (cities x property types) described in a YAML or JSON
+file, concurrently and over one shared HTTP transport.
+
+Usage: python crawl_scheduler.py crawl_jobs.yaml [--resume] [--offline]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from web_scraper import DataContainer, RealEstateCrawler
+from http_transport import HttpTransport, AdaptiveConcurrency
+from response_cache import ResponseCache
+
+
+def load_config(file_name):
+    """
+    Reads a job file. Files ending in .json are read as JSON, anything else as YAML.
+    """
+    with open(file_name) as file:
+        if file_name.endswith(".json"):
+            return json.load(file)
+
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("Reading " + file_name + " requires PyYAML (pip install pyyaml), or use a .json job file")
+
+        return yaml.safe_load(file)
+
+
+def container_from_config(spec):
+    """
+    Builds a DataContainer from its declarative form, e.g.
+    {'name': "Rooms:", 'html_object': [...], 'name_access': [...], 'list_type': 'ul',
+     'element_type': 'li', 'labels': False, 'elements': [...]}
+    """
+    container = DataContainer(name = spec['name'], html_object = spec['html_object'],
+                              name_access = spec['name_access'], list_type = spec['list_type'],
+                              element_type = spec['element_type'], labels = spec.get('labels', True))
+    container.set_elements(spec['elements'])
+
+    return container
+
+
+class CrawlJob:
+
+    def __init__(self, spec, template, output_dir = "."):
+        """
+        One city / property type to crawl.
+
+        PARAMETERS:
+        spec: (Dictionary) The job entry merged with the defaults of the job file.
+        template: (Dictionary) The site template named by spec['template'].
+        output_dir: (String) Directory the job's CSV and checkpoint files are written to.
+        """
+        self.spec = spec
+        self.template = template
+
+        self.city = spec['city']
+        self.property_type = spec.get('property_type', 'condos')
+        self.name = self.city + "/" + self.property_type
+
+        output = spec.get('output', "{city}-{property_type}.csv").format(city = self.city, property_type = self.property_type)
+        self.output = os.path.join(output_dir, output)
+        self.checkpoint = os.path.splitext(self.output)[0] + ".checkpoint"
+
+    def main_link(self):
+
+        property_path = self.template.get('property_types', {}).get(self.property_type, self.property_type)
+        return [part.format(property_type = property_path) for part in self.spec.get('main_link', self.template['main_link'])]
+
+    def build_crawler(self, transport):
+
+        crawler = RealEstateCrawler(self.city, self.main_link(),
+                                    total_pages = self.spec['total_pages'], limit_per_page = self.spec['limit_per_page'])
+
+        crawler_property = self.template['crawler_property']
+        crawler.set_crawler_property(html_type = crawler_property['type'], html_attr = crawler_property['attr'])
+        crawler.set_scraper_particulars(self.template['particulars'])
+        crawler.set_scraper_containers([container_from_config(spec) for spec in self.template['containers']])
+
+        crawler.set_parser_backend(self.spec.get('parser_backend', 'lxml'))
+        crawler.set_concurrency(self.spec.get('max_workers', 1))
+        if self.spec.get('parse_workers'):
+            crawler.set_pipeline(self.spec['parse_workers'])
+
+        # Set last: the shared transport carries the global rate limit, and is already sized for the
+        # jobs that run at once (see CrawlScheduler.build_transport). The crawler's own transport is closed.
+        crawler.transport.close()
+        crawler.set_transport(transport)
+        parquet_path = os.path.splitext(self.output)[0] + ".parquet" if self.spec.get('parquet') else None
+        field_names = self.template['field_names'] + (["Listing"] if self.spec.get('rooms') else [])
+        crawler.set_output(self.output, field_names, checkpoint_file = self.checkpoint,
+                           parquet_path = parquet_path, flush_rows = self.spec.get('flush_rows'))
+        if self.spec.get('rooms'):
+            crawler.set_rooms_output(os.path.splitext(self.output)[0] + "-rooms.csv")
+
+        if self.spec.get('incremental'):
+            base_name = os.path.splitext(self.output)[0]
+            crawler.set_incremental(base_name + ".index.sqlite", base_name + "-delta.csv", self.template['field_names'],
+                                    refresh_fraction = self.spec.get('refresh_fraction', 0.05))
+
+        if self.spec.get('frontier'):
+            base_name = os.path.splitext(self.output)[0]
+            crawler.set_frontier(base_name + ".frontier.sqlite", policy = self.spec.get('frontier_policy', "new-first"),
+                                 refetch_after = self.spec.get('refetch_after'), stale_pages = self.spec.get('stale_pages', 1))
+
+        if self.spec.get('metrics'):
+            base_name = os.path.splitext(self.output)[0]
+            crawler.set_metrics(jsonl_file = base_name + ".metrics.jsonl", prometheus_file = base_name + ".prom",
+                                interval = self.spec.get('metrics_interval', 10))
+
+        return crawler
+
+    def run(self, transport, resume = False):
+        """
+        Crawl the job and return its entry for the run summary.
+        """
+        start_time = time.time()
+        summary = {'job': self.name, 'city': self.city, 'property_type': self.property_type,
+                   'output': self.output, 'status': 'ok'}
+
+        try:
+            crawler = self.build_crawler(transport)
+            crawler.crawl(resume = resume)
+        except Exception as error:
+            print("ERROR (CrawlJob): Job " + self.name + " failed with " + repr(error))
+            summary['status'] = 'failed'
+            summary['error'] = repr(error)
+        else:
+            summary['listings'] = crawler.counter - crawler.failures
+            summary['failed_listings'] = crawler.failures
+            summary['errors'] = crawler.metrics.by_label('errors', 'function')
+            if crawler.counter == 0 and not resume and crawler.incremental == None:
+                summary['status'] = 'empty'
+
+        summary['seconds'] = round(time.time() - start_time, 1)
+        return summary
+
+
+class CrawlScheduler:
+
+    def __init__(self, config):
+        """
+        Runs every job of a job file concurrently. The jobs share one HttpTransport,
+        so they share its connection pool, response cache and rate limit.
+
+        PARAMETERS:
+        config: (Dictionary) Parsed job file with 'settings', 'defaults', 'templates' and 'jobs' [See crawl_jobs.yaml].
+        """
+        self.settings = config.get('settings', {})
+        self.output_dir = self.settings.get('output_dir', ".")
+
+        defaults = config.get('defaults', {})
+        templates = config['templates']
+
+        self.jobs = []
+        for job in config['jobs']:
+            spec = dict(defaults)
+            spec.update(job)
+            self.jobs.append(CrawlJob(spec, templates[spec['template']], self.output_dir))
+
+        self.transport = None
+
+    def build_transport(self, offline = False):
+        """
+        The transport shared by every job. Up to max_concurrent_jobs jobs crawl the same
+        host through it at once, so its connection pool holds at least as many connections
+        per host as the max_workers of the max_concurrent_jobs largest jobs together.
+        """
+        settings = self.settings
+        workers = sorted((job.spec.get('max_workers', 1) for job in self.jobs), reverse = True)
+        concurrent_workers = sum(workers[0:settings.get('max_concurrent_jobs', 1)])
+        pool_size = max(settings.get('pool_size', 10), concurrent_workers)
+
+        transport = HttpTransport(pool_size = pool_size)
+        transport.set_rate_limit(settings.get('rate_limit'), per_host = settings.get('rate_limit_per_host', True))
+        if settings.get('adaptive_concurrency'):
+            transport.set_concurrency_control(AdaptiveConcurrency(initial_window = settings.get('initial_window', 4),
+                                                                  max_window = settings.get('max_window', pool_size)))
+
+        if settings.get('cache'):
+            transport.set_cache(ResponseCache(settings['cache'], ttl = settings.get('cache_ttl', 24*3600), offline = offline))
+        elif offline:
+            print("ERROR (CrawlScheduler): offline replay needs a 'cache' in the job file settings")
+
+        return transport
+
+    def run(self, resume = False, offline = False):
+        """
+        Run all jobs and write the run summary. Returns the summary.
+        """
+        os.makedirs(self.output_dir, exist_ok = True)
+        self.transport = self.build_transport(offline)
+
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers = self.settings.get('max_concurrent_jobs', 1)) as executor:
+            job_summaries = list(executor.map(lambda job: job.run(self.transport, resume), self.jobs))
+
+        summary = {'started': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start_time)),
+                   'seconds': round(time.time() - start_time, 1),
+                   'listings': sum(job.get('listings', 0) for job in job_summaries),
+                   'failed_jobs': sum(1 for job in job_summaries if job['status'] != 'ok'),
+                   'jobs': job_summaries}
+
+        summary_file = self.settings.get('summary', os.path.join(self.output_dir, "run_summary.json"))
+        with open(summary_file, 'w') as file:
+            json.dump(summary, file, indent = 2)
+
+        print("\nCrawled " + str(summary['listings']) + " listings in " + str(len(self.jobs)) + " jobs. Summary: " + summary_file)
+        self.transport.close()
+
+        return summary
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("config", help = "YAML or JSON job file")
+    parser.add_argument("--resume", action = "store_true", help = "Continue the jobs from their checkpoints")
+    parser.add_argument("--offline", action = "store_true", help = "Replay from the response cache only")
+    args = parser.parse_args()
+
+    summary = CrawlScheduler(load_config(args.config)).run(resume = args.resume, offline = args.offline)
+
+    if summary['failed_jobs'] > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,292 @@
+"""
+Geocoding of listing addresses with a persistent cache.
+
+Addresses are normalized to a building key (unit numbers removed, upper case,
+single spaces), looked up in a SQLite cache and only the misses are sent to a
+provider, in batches and concurrently. Coordinates are joined back onto the
+listings by that key, never by row position.
+
+Usage: python geocoder.py listings.csv output.csv [--cache geocode_cache.sqlite] [--seed condo_coordinates.txt]
+                          [--mapquest-key KEY]
+"""
+import re
+import time
+import sqlite3
+import argparse
+import threading
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from http_transport import HttpTransport
+
+UNIT_PREFIX = re.compile(r'^\s*#\s*[^-]*-\s*')             # "#2506 -183 WELLINGTON ST W" -> "183 WELLINGTON ST W"
+UNIT_NUMBER = re.compile(r'^\s*[A-Z]?\d+[A-Z]?\s*-\s*(?=\d)')  # "811-75 THE DONWAY W" -> "75 THE DONWAY W"
+PROVINCES = {'ONTARIO': 'ON'}
+
+# Lines of condo_coordinates.txt: lat,lng,"row,"address"","matched address",,provider,quality
+COORDINATES_LINE = re.compile(r'^(-?[\d.]+),(-?[\d.]+),"\d+,"(.*)"","[^"]*",[^,]*,([^,]*),([^,]*)$')
+
+
+def normalize_address(address):
+    """
+    Building key of a listing address, e.g.
+    "#2506 -183 WELLINGTON ST W, Toronto, Ontario, M5V 0A1" -> "183 WELLINGTON ST W, TORONTO, ON, M5V 0A1"
+    Every unit of a building gets the same key. Returns None for missing addresses.
+    """
+    if not isinstance(address, str) or address.strip() == "":
+        return None
+
+    address = address.upper().replace(".", "")
+    address = UNIT_NUMBER.sub("", UNIT_PREFIX.sub("", address))
+
+    parts = [" ".join(part.split()) for part in address.split(",")]
+    parts = [PROVINCES.get(part, part) for part in parts if part != ""]
+
+    return ", ".join(parts)
+
+
+def normalize_addresses(addresses):
+    """
+    normalize_address over a Series, computed once per distinct address.
+    """
+    codes, uniques = pd.factorize(addresses)
+    keys = pd.Series([normalize_address(address) for address in uniques] + [None], dtype = object)
+
+    return pd.Series(keys.to_numpy()[codes], index = addresses.index)
+
+
+class GeocodeCache:
+
+    def __init__(self, path):
+        """
+        Persistent cache (SQLite) of geocoded building keys. Addresses the provider
+        could not place are stored too (with empty coordinates), so they are not
+        looked up again on every run.
+
+        PARAMETERS:
+        path: (String) SQLite file holding the cache. Created if missing.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS geocodes (
+                address_key TEXT PRIMARY KEY,
+                latitude REAL,
+                longitude REAL,
+                provider TEXT,
+                quality TEXT,
+                geocoded_at REAL NOT NULL
+            )""")
+        self.connection.commit()
+
+    def lookup(self, keys):
+        """
+        Returns {key: (latitude, longitude)} for the keys of keys that are cached.
+        Keys the provider could not place map to (None, None).
+        """
+        keys = list(keys)
+        found = {}
+
+        with self.lock:
+            # SQLite limits the number of parameters of a statement
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self.connection.execute(
+                    "SELECT address_key, latitude, longitude FROM geocodes WHERE address_key IN ("
+                    + ",".join("?"*len(batch)) + ")", batch).fetchall()
+                found.update({key: (latitude, longitude) for key, latitude, longitude in rows})
+
+        return found
+
+    def store(self, results, provider, quality = None):
+        """
+        PARAMETERS:
+        results: (Dictionary) {key: (latitude, longitude) or None}
+        provider: (String) Name of the provider that produced the results
+        """
+        now = time.time()
+        rows = []
+        for key, coordinates in results.items():
+            latitude, longitude = coordinates if coordinates != None else (None, None)
+            rows.append((key, latitude, longitude, provider, quality, now))
+
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.connection.commit()
+
+    def seed_from_coordinates_file(self, file_name):
+        """
+        Loads coordinates geocoded outside the crawler (the MapQuest export in
+        condo_coordinates.txt) into the cache. Returns the number of building keys stored.
+        """
+        results = {}
+        with open(file_name) as file:
+            for line in file:
+                match = COORDINATES_LINE.match(line.strip())
+                if match == None:
+                    continue
+                latitude, longitude, address, provider, quality = match.groups()
+                key = normalize_address(address)
+                if key != None:
+                    results[key] = (float(latitude), float(longitude))
+
+        self.store(results, provider = "seed:" + file_name)
+        return len(results)
+
+    def close(self):
+
+        with self.lock:
+            self.connection.close()
+
+
+class StaticProvider:
+
+    name = "static"
+
+    def __init__(self, coordinates = None, batch_size = 100):
+        """
+        Local provider answering from a dictionary {address: (latitude, longitude)}.
+        Addresses are matched by their normalized key. Used for tests, benchmarks and
+        offline runs; unknown addresses come back as None.
+        """
+        self.coordinates = {normalize_address(address): value for address, value in (coordinates or {}).items()}
+        self.batch_size = batch_size
+        self.calls = 0
+
+    def geocode_batch(self, keys):
+        """
+        Returns {key: (latitude, longitude) or None} for a batch of normalized addresses.
+        """
+        self.calls = self.calls + 1
+        return {key: self.coordinates.get(key) for key in keys}
+
+
+class MapQuestProvider:
+
+    name = "mapquest"
+    batch_link = "https://www.mapquestapi.com/geocoding/v1/batch"
+
+    def __init__(self, api_key, transport = None, batch_size = 100, timeout = 10):
+        """
+        MapQuest batch geocoding (up to 100 locations per request).
+
+        PARAMETERS:
+        api_key: (String) MapQuest key
+        transport: (HttpTransport or None) Shared transport for retries and rate limiting
+        """
+        self.api_key = api_key
+        self.transport = transport or HttpTransport()
+        self.batch_size = min(batch_size, 100)
+        self.timeout = timeout
+        self.calls = 0
+
+    def geocode_batch(self, keys):
+
+        self.calls = self.calls + 1
+        query = [('key', self.api_key), ('maxResults', 1), ('thumbMaps', 'false')] + [('location', key) for key in keys]
+        response, reason = self.transport.get(self.batch_link + "?" + urlencode(query), timeout = self.timeout)
+
+        if reason != None:
+            print("ERROR (MapQuestProvider.geocode_batch): " + reason)
+            return {}
+
+        results = {}
+        for key, result in zip(keys, response.json().get('results', [])):
+            locations = result.get('locations', [])
+            if locations:
+                lat_lng = locations[0]['latLng']
+                results[key] = (lat_lng['lat'], lat_lng['lng'])
+            else:
+                results[key] = None
+
+        return results
+
+
+class Geocoder:
+
+    def __init__(self, cache, provider = None, max_workers = 4):
+        """
+        PARAMETERS:
+        cache: (GeocodeCache)
+        provider: (Provider or None) Anything with geocode_batch(keys) -> {key: (lat, lng) or None}
+                  and a batch_size. None = Cache only.
+        max_workers: (Int) Provider batches run concurrently
+        """
+        self.cache = cache
+        self.provider = provider
+        self.max_workers = max_workers
+
+    def geocode(self, keys):
+        """
+        Returns {key: (latitude, longitude) or (None, None)} for the distinct keys of keys.
+        Only the keys missing from the cache go to the provider.
+        """
+        keys = [key for key in dict.fromkeys(keys) if key != None]
+        found = self.cache.lookup(keys)
+
+        misses = [key for key in keys if key not in found]
+        if misses and self.provider != None:
+            batches = [misses[start:start + self.provider.batch_size]
+                       for start in range(0, len(misses), self.provider.batch_size)]
+
+            with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+                for results in executor.map(self.provider.geocode_batch, batches):
+                    # Only answered keys are cached, so failed requests are retried next run
+                    self.cache.store(results, provider = self.provider.name)
+                    found.update({key: coordinates or (None, None) for key, coordinates in results.items()})
+
+            print("(Geocoder) " + str(len(misses)) + " of " + str(len(keys)) + " buildings sent to " + self.provider.name)
+
+        return found
+
+    def add_coordinates(self, listings, address_column = 'Address'):
+        """
+        Returns a copy of listings with 'Address Key', 'Latitude' and 'Longitude'
+        columns. Listings that could not be geocoded get NaN coordinates.
+        """
+        listings = listings.copy()
+        listings['Address Key'] = normalize_addresses(listings[address_column])
+
+        found = self.geocode(listings['Address Key'])
+        coordinates = pd.DataFrame([(key, latitude, longitude) for key, (latitude, longitude) in found.items()],
+                                   columns = ['Address Key', 'Latitude', 'Longitude'], dtype = object)
+        coordinates[['Latitude', 'Longitude']] = coordinates[['Latitude', 'Longitude']].astype('float64')
+
+        # merge keeps the order of the listings; the index is put back afterwards
+        joined = listings.merge(coordinates, on = 'Address Key', how = 'left')
+        joined.index = listings.index
+
+        return joined
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("listings", help = "CSV file with an Address column")
+    parser.add_argument("output", help = "CSV file written with Latitude / Longitude columns")
+    parser.add_argument("--cache", default = "geocode_cache.sqlite")
+    parser.add_argument("--seed", help = "Coordinates file to load into the cache first (e.g. condo_coordinates.txt)")
+    parser.add_argument("--mapquest-key", help = "Geocode cache misses with MapQuest. Without it only the cache is used.")
+    parser.add_argument("--workers", type = int, default = 4)
+    args = parser.parse_args()
+
+    cache = GeocodeCache(args.cache)
+    if args.seed:
+        print("Seeded " + str(cache.seed_from_coordinates_file(args.seed)) + " buildings from " + args.seed)
+
+    provider = MapQuestProvider(args.mapquest_key) if args.mapquest_key else None
+    listings = Geocoder(cache, provider, max_workers = args.workers).add_coordinates(pd.read_csv(args.listings))
+    listings.to_csv(args.output, index = False)
+
+    print("Geocoded " + str(listings['Latitude'].notna().sum()) + " of " + str(len(listings)) + " listings")
+    cache.close()
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,339 @@
+import time
+import random
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HostRateLimiter:
+
+    def __init__(self, requests_per_second, per_host = True):
+        """
+        Spaces out the requests sent to each host so that, no matter how many workers
+        are crawling at once, a single site never receives more than requests_per_second.
+
+        PARAMETERS:
+        requests_per_second: (Float) Maximum number of requests started per second for one host.
+        per_host: (Boolean) False = The limit applies to all requests together, whatever their host.
+        """
+        self.interval = 1.0/requests_per_second
+        self.per_host = per_host
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def wait(self, link):
+        """
+        Block the calling worker until the host of 'link' has a free request slot.
+        """
+        host = urlparse(link).netloc if self.per_host else "*"
+
+        with self.lock:
+            time_now = time.monotonic()
+            slot = max(time_now, self.next_slot.get(host, time_now))
+            self.next_slot[host] = slot + self.interval
+
+        delay = slot - time_now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class AdaptiveConcurrency:
+
+    THROTTLE_STATUSES = (429, 503)
+
+    def __init__(self, initial_window = 4, min_window = 1, max_window = 64, decrease = 0.5, latency_tolerance = 0.25,
+                 min_samples = 8, per_host = True):
+        """
+        Tunes the number of requests in flight to each host with AIMD (additive
+        increase, multiplicative decrease), as TCP does with its congestion window.
+        Every window's worth of successful requests (about one round trip of the
+        whole window), the p95 latency of those requests is compared with the lowest
+        p95 of the recent rounds: while it stays within latency_tolerance of it the
+        site is keeping up and the window grows by one, otherwise requests are
+        queueing at the site and the window holds. The window only grows after a
+        round in which it was full, so a crawl that cannot fill it (too few workers,
+        parsing-bound) does not grow it past what the site was tested with. A 429 or 503 response or a
+        timeout cuts the window by decrease, at most once per round trip so that a
+        burst of refusals from one window counts as a single signal.
+
+        PARAMETERS:
+        initial_window: (Int) Requests in flight per host at the start
+        min_window, max_window: (Int) Bounds of the window. max_window should not exceed the crawl workers.
+        decrease: (Float) Factor the window is multiplied by on throttling
+        latency_tolerance: (Float) Relative p95 latency increase still counted as flat
+        min_samples: (Int) Fewest successful requests a round's p95 is computed on
+        per_host: (Boolean) False = One window for all requests together, whatever their host
+        """
+        self.initial_window = initial_window
+        self.min_window = min_window
+        self.max_window = max_window
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.min_samples = min_samples
+        self.per_host = per_host
+
+        self.condition = threading.Condition()
+        self.hosts = {}
+        self.metrics = None
+
+    def state(self, link):
+
+        host = urlparse(link).netloc if self.per_host else "*"
+        state = self.hosts.get(host)
+        if state == None:
+            state = self.hosts[host] = {'host': host, 'window': float(self.initial_window), 'in_flight': 0,
+                                        'samples': [], 'round_p95s': deque(maxlen = 20), 'p95': None, 'last_cut': 0.0,
+                                        'full': False}
+            self.report(state)
+        return state
+
+    def acquire(self, link):
+        """
+        Block the calling worker until the host of link has room in its window.
+        """
+        with self.condition:
+            state = self.state(link)
+            while state['in_flight'] >= int(state['window']):
+                self.condition.wait()
+            state['in_flight'] = state['in_flight'] + 1
+            if state['in_flight'] >= int(state['window']):
+                state['full'] = True
+
+    def release(self, link, seconds, response = None, timed_out = False):
+        """
+        Frees the request's slot and adjusts the window from its outcome.
+
+        PARAMETERS:
+        seconds: (Float) How long the request took
+        response: (requests.Response or None) None if no response was received
+        timed_out: (Boolean) The request timed out
+        """
+        status = None if response == None else response.status_code
+
+        with self.condition:
+            state = self.state(link)
+            state['in_flight'] = state['in_flight'] - 1
+
+            if timed_out or status in self.THROTTLE_STATUSES:
+                self.throttled(state, seconds, "timeout" if timed_out else str(status))
+            elif status == 200:
+                self.succeeded(state, seconds)
+
+            self.condition.notify_all()
+
+    def throttled(self, state, seconds, signal):
+
+        time_now = time.monotonic()
+        round_trip = max(seconds, state['p95'] or 0)
+
+        if time_now - state['last_cut'] >= round_trip:
+            state['window'] = max(float(self.min_window), state['window']*self.decrease)
+            state['last_cut'] = time_now
+            state['samples'] = []
+            self.report(state)
+
+        if self.metrics != None:
+            self.metrics.inc('throttled', host = state['host'], signal = signal)
+
+    def succeeded(self, state, seconds):
+
+        state['samples'].append(seconds)
+        if len(state['samples']) < max(self.min_samples, int(state['window'])):
+            return
+
+        samples = sorted(state['samples'])
+        p95 = samples[min(len(samples) - 1, int(0.95*len(samples)))]
+        state['samples'] = []
+        state['p95'] = p95
+        state['round_p95s'].append(p95)
+        full, state['full'] = state['full'], False
+
+        if full and p95 <= min(state['round_p95s'])*(1 + self.latency_tolerance) and state['window'] < self.max_window:
+            state['window'] = min(float(self.max_window), state['window'] + 1)
+            self.report(state)
+
+    def window(self, link):
+
+        with self.condition:
+            return int(self.state(link)['window'])
+
+    def report(self, state):
+
+        if self.metrics != None:
+            self.metrics.set('concurrency_window', int(state['window']), host = state['host'])
+
+
+class HttpTransport:
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, pool_size = 10, max_retries = 4, backoff_factor = 0.5, max_backoff = 60, headers = None, cache = None):
+        """
+        A pooled HTTP transport shared by every request a crawler makes. A single
+        requests.Session keeps connections to each host alive, so only the first
+        request to a site pays for the TCP/TLS handshake. Throttled (429) and
+        server error (5xx) responses, connection errors and timeouts are retried
+        with exponential backoff and jitter, honoring any Retry-After header.
+
+        PARAMETERS:
+        pool_size: (Int) Connections kept open per host. Should be at least the number of crawl workers.
+        max_retries: (Int) Retries after the first attempt before a request is given up on.
+        backoff_factor: (Float) Base delay in seconds. Attempt n waits up to backoff_factor*2^n.
+        max_backoff: (Float) Upper bound in seconds on any single wait, including Retry-After.
+        headers: (Dictionary or None) Headers sent with every request (e.g. User-Agent).
+        cache: (ResponseCache or None) On-disk response cache consulted before the network.
+        """
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.rate_limiter = None
+        self.concurrency = None
+        self.cache = cache
+
+        self.session = requests.Session()
+        if headers != None:
+            self.session.headers.update(headers)
+
+        self.set_pool_size(pool_size)
+
+    def set_pool_size(self, pool_size):
+
+        self.pool_size = pool_size
+        adapter = HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size, max_retries = 0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def set_rate_limit(self, rate_limit, per_host = True):
+        """
+        PARAMETERS:
+        rate_limit: (Float or None) Maximum requests per second sent to a single host. None = No limit.
+        per_host: (Boolean) False = rate_limit applies to all requests together [See HostRateLimiter].
+        """
+        if rate_limit == None:
+            self.rate_limiter = None
+        else:
+            self.rate_limiter = HostRateLimiter(rate_limit, per_host = per_host)
+
+    def set_concurrency_control(self, concurrency):
+        """
+        PARAMETERS:
+        concurrency: (AdaptiveConcurrency or None) Limits and tunes the requests in flight per host. None = No limit.
+        """
+        self.concurrency = concurrency
+
+    def set_cache(self, cache):
+        """
+        PARAMETERS:
+        cache: (ResponseCache or None) None = Always go to the network.
+        """
+        self.cache = cache
+
+    def get(self, link, headers = None, timeout = 5):
+        """
+        Fetches a page, from the response cache when possible, otherwise with a
+        GET request that retries transient failures.
+
+        Returns (response, reason). response is the final requests.Response (or
+        CachedResponse), or None if no response was ever received. reason is None
+        for a 200 response and otherwise a short description of why the request failed.
+        """
+        if self.cache == None:
+            return self.request(link, headers, timeout)
+
+        cached = self.cache.lookup(link)
+
+        if cached != None and (self.cache.offline or self.cache.is_fresh(cached)):
+            return cached, None
+        elif self.cache.offline:
+            return None, "not in response cache (offline replay mode)"
+
+        response, reason = self.request(link, self.cache.conditional_headers(cached, headers), timeout)
+
+        if response != None and response.status_code == 304 and cached != None:
+            self.cache.revalidated(link)
+            return cached, None
+        elif reason == None:
+            self.cache.store(link, response)
+
+        return response, reason
+
+    def request(self, link, headers = None, timeout = 5):
+        """
+        Sends a GET request over the pooled session, retrying transient failures.
+        Returns (response, reason) as described in get().
+        """
+        attempt = 0
+
+        while True:
+            if self.rate_limiter != None:
+                self.rate_limiter.wait(link)
+
+            if self.concurrency != None:
+                self.concurrency.acquire(link)
+
+            response = None
+            timed_out = False
+            start_time = time.monotonic()
+            try:
+                response = self.session.get(link, headers = headers, timeout = timeout)
+            except requests.exceptions.RequestException as error:
+                reason = type(error).__name__ + ": " + str(error)
+                retry = isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+                timed_out = isinstance(error, requests.exceptions.Timeout)
+            else:
+                if response.status_code == requests.codes.ok:
+                    return response, None
+                reason = "status code " + str(response.status_code)
+                retry = response.status_code in self.RETRY_STATUSES
+            finally:
+                if self.concurrency != None:
+                    self.concurrency.release(link, time.monotonic() - start_time, response, timed_out)
+
+            if not retry or attempt >= self.max_retries:
+                if attempt > 0:
+                    reason = reason + " (after " + str(attempt + 1) + " attempts)"
+                return response, reason
+
+            time.sleep(self.backoff_delay(attempt, response))
+            attempt = attempt + 1
+
+    def backoff_delay(self, attempt, response = None):
+        """
+        Seconds to wait before retry number attempt + 1. A Retry-After header on
+        the response takes precedence over the exponential schedule.
+        """
+        if response != None:
+            retry_after = self.retry_after(response)
+            if retry_after != None:
+                return min(retry_after, self.max_backoff)
+
+        ceiling = min(self.max_backoff, self.backoff_factor*(2**attempt))
+        return random.uniform(ceiling/2, ceiling)
+
+    def retry_after(self, response):
+        """
+        Parses a Retry-After header given either in seconds or as an HTTP date.
+        Returns the delay in seconds, or None if the header is absent or malformed.
+        """
+        value = response.headers.get("Retry-After")
+        if value == None:
+            return None
+
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+
+        try:
+            retry_date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+
+        return max(0.0, retry_date.timestamp() - time.time())
+
+    def close(self):
+
+        self.session.close()
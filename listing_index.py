@@ -0,0 +1,239 @@
+import json
+import math
+import time
+import sqlite3
+import hashlib
+import threading
+
+from crawl_output import StreamingCSVWriter
+
+
+def row_hash(row):
+    """
+    Content hash of a scraped row, independent of the order of its fields.
+    """
+    payload = json.dumps(row, sort_keys = True, default = str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class ListingIndex:
+
+    def __init__(self, file_name):
+        """
+        Persistent record (SQLite) of every listing a crawler has come across,
+        keyed by href: its last scraped price, a hash of its last scraped row and
+        when it was first seen, last seen on an index page and last scraped.
+
+        PARAMETERS:
+        file_name: (String) SQLite file holding the index. Created if missing.
+        """
+        self.file_name = file_name
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(file_name, check_same_thread = False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS listings (
+                href TEXT PRIMARY KEY,
+                price TEXT,
+                content_hash TEXT,
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL,
+                last_scraped REAL,
+                delisted_at REAL
+            )""")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS crawl_run (run_time REAL NOT NULL)")
+        self.connection.commit()
+
+    def begin_run(self, resume = False):
+        """
+        Returns the start time of a crawl run, kept in the index until end_run.
+        A resumed run continues the unfinished run with its start time, so the
+        listings that run already saw count as seen.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT run_time FROM crawl_run").fetchone()
+            if resume and row != None:
+                return row[0]
+
+            run_time = time.time()
+            self.connection.execute("DELETE FROM crawl_run")
+            self.connection.execute("INSERT INTO crawl_run (run_time) VALUES (?)", (run_time,))
+            self.connection.commit()
+
+        return run_time
+
+    def end_run(self):
+
+        with self.lock:
+            self.connection.execute("DELETE FROM crawl_run")
+            self.connection.commit()
+
+    def known(self, hrefs):
+        """
+        Returns {href: last_scraped} for the hrefs of hrefs that are in the index
+        and have been scraped before.
+        """
+        if not hrefs:
+            return {}
+
+        with self.lock:
+            placeholders = ",".join("?"*len(hrefs))
+            rows = self.connection.execute(
+                "SELECT href, last_scraped FROM listings WHERE last_scraped IS NOT NULL AND href IN (" + placeholders + ")",
+                list(hrefs)).fetchall()
+
+        return dict(rows)
+
+    def mark_seen(self, hrefs, run_time):
+        """
+        Records that hrefs were listed on an index page during the run started at run_time.
+        """
+        with self.lock:
+            self.connection.executemany(
+                "INSERT INTO listings (href, first_seen, last_seen) VALUES (?, ?, ?) "
+                "ON CONFLICT(href) DO UPDATE SET last_seen = excluded.last_seen, delisted_at = NULL",
+                [(href, run_time, run_time) for href in hrefs])
+            self.connection.commit()
+
+    def lookup(self, href):
+        """
+        Returns (price, content_hash) of the last scrape of href, or None if it was never scraped.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT price, content_hash, last_scraped FROM listings WHERE href = ?",
+                                          (href,)).fetchone()
+
+        if row == None or row[2] == None:
+            return None
+        return row[0], row[1]
+
+    def update(self, href, price, content_hash, run_time):
+
+        with self.lock:
+            self.connection.execute("UPDATE listings SET price = ?, content_hash = ?, last_scraped = ? WHERE href = ?",
+                                    (price, content_hash, run_time, href))
+            self.connection.commit()
+
+    def delist(self, run_time):
+        """
+        Marks every listing that was not seen during the run started at run_time
+        as delisted. Returns the newly delisted [(href, last price)].
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT href, price FROM listings WHERE last_seen < ? AND delisted_at IS NULL", (run_time,)).fetchall()
+            self.connection.execute("UPDATE listings SET delisted_at = ? WHERE last_seen < ? AND delisted_at IS NULL",
+                                    (run_time, run_time))
+            self.connection.commit()
+
+        return rows
+
+    def close(self):
+
+        with self.lock:
+            self.connection.close()
+
+
+class IncrementalCrawl:
+
+    DELTA_FIELDS = ["Change", "Href", "Previous Price"]
+
+    def __init__(self, index_file, delta_file, field_names, refresh_fraction = 0.05, price_field = "Price"):
+        """
+        Turns a crawl into a re-crawl: of the listings found on the index pages,
+        only the ones not in the ListingIndex are fetched, plus a refresh sample
+        of the known ones (the refresh_fraction that were scraped longest ago).
+        Every change is written to a delta CSV file with a Change column:
+
+        new:           Listing not scraped before
+        price-changed: Price differs from the last scrape
+        changed:       Same price, but some other field differs
+        delisted:      Listing in the index that no index page showed this run
+
+        Delistings are only computed when the crawl runs to completion, and they
+        assume the crawl covers every index page of the search. A resumed crawl
+        continues the interrupted run: its start time is kept in the index, and
+        the delta file is appended to.
+
+        PARAMETERS:
+        index_file: (String) ListingIndex file, kept between runs
+        delta_file: (String) Delta CSV file written by this run
+        field_names: (List[String]) Row fields written to the delta file after the Change, Href and Previous Price columns
+        refresh_fraction: (Float) Fraction of the known listings of each index page re-scraped every run
+        price_field: (String) Row field holding the price
+        """
+        self.index = ListingIndex(index_file)
+        self.delta = StreamingCSVWriter(delta_file, self.DELTA_FIELDS + list(field_names))
+        self.refresh_fraction = refresh_fraction
+        self.price_field = price_field
+
+        self.run_time = None
+        self.changes = {'new': 0, 'price-changed': 0, 'changed': 0, 'delisted': 0}
+
+    def start(self, resume = False):
+
+        self.run_time = self.index.begin_run(resume)
+        self.changes = {change: 0 for change in self.changes}
+        self.delta.open(append = resume)
+
+    def seen(self, hrefs):
+        """
+        Records hrefs as listed on an index page in this run, whether or not they are fetched.
+        """
+        self.index.mark_seen(hrefs, self.run_time)
+
+    def select(self, hrefs):
+        """
+        Returns the hrefs that should be fetched, in their original order. They must have been passed to seen() first.
+        """
+        known = self.index.known(hrefs)
+
+        refresh_count = math.ceil(self.refresh_fraction*len(known))
+        refresh = set(sorted(known, key = lambda href: known[href])[0:refresh_count])
+
+        selected = [href for href in hrefs if href not in known or href in refresh]
+        print("(IncrementalCrawl) Fetching " + str(len(selected)) + " of " + str(len(hrefs)) + " listings ("
+              + str(len(hrefs) - len(known)) + " new).")
+
+        return selected
+
+    def record(self, href, row):
+        """
+        Compares a freshly scraped row with the index and writes it to the delta file if it changed.
+        """
+        price = row.get(self.price_field)
+        price = None if price == None else str(price)
+        content_hash = row_hash(row)
+
+        previous = self.index.lookup(href)
+        if previous == None:
+            change, previous_price = 'new', None
+        elif previous[0] != price:
+            change, previous_price = 'price-changed', previous[0]
+        elif previous[1] != content_hash:
+            change, previous_price = 'changed', previous[0]
+        else:
+            change, previous_price = None, previous[0]
+
+        self.index.update(href, price, content_hash, self.run_time)
+
+        if change != None:
+            self.changes[change] = self.changes[change] + 1
+            delta_row = dict(row)
+            delta_row.update({'Change': change, 'Href': href, 'Previous Price': previous_price})
+            self.delta.write_row(delta_row)
+
+    def finish(self, completed):
+        """
+        PARAMETERS:
+        completed: (Boolean) The crawl went through all of its pages, so listings
+                   missing from this run can be reported as delisted.
+        """
+        if completed:
+            for href, price in self.index.delist(self.run_time):
+                self.changes['delisted'] = self.changes['delisted'] + 1
+                self.delta.write_row({'Change': 'delisted', 'Href': href, 'Previous Price': price})
+            self.index.end_run()
+
+        self.delta.close()
+        print("(IncrementalCrawl) Changes: " + str(self.changes))
@@ -0,0 +1,235 @@
+"""
+Model artifact: a trained forest stored as flat NumPy arrays that are memory-mapped
+on load, so a model opens in milliseconds and every process reading it shares one
+read-only copy through the page cache.
+
+Layout of an artifact directory (e.g. condo_model.model/):
+
+    manifest.json   format version, model version, input columns, defaults,
+                    cleaning parameters, the node offset of every tree and the
+                    model version and date every tree was trained in
+    feature.npy     int32    split feature of every node (-2 on leaves)
+    threshold.npy   float64  split threshold (go left when x <= threshold)
+    left.npy        int32    left child, as a node number in the concatenated arrays (-1 on leaves)
+    right.npy       int32    right child (-1 on leaves)
+    value.npy       float64  prediction of every node (used on leaves)
+    missing_left.npy uint8   1 where a missing (NaN) input goes to the left child (format version 2)
+"""
+import os
+import json
+import time
+import shutil
+
+import numpy as np
+
+from inference_engine import ForestEngine
+
+FORMAT = "condo-forest"
+FORMAT_VERSION = 2
+ARRAYS = {'feature': 'int32', 'threshold': 'float64', 'left': 'int32', 'right': 'int32', 'value': 'float64',
+          'missing_left': 'uint8'}
+
+
+class FlatForest:
+
+    def __init__(self, arrays, tree_offsets, tree_versions = None, tree_dates = None):
+        """
+        A forest of regression trees in flat arrays (see the module docstring).
+        Stands in for the RandomForestRegressor inside a CondoModel.
+
+        PARAMETERS:
+        arrays: (Dictionary) Name of ARRAYS -> array over the nodes of all trees
+        tree_offsets: (Array) Node number of the root of every tree, plus the total node count at the end
+        tree_versions: (List[String] or None) Model version every tree was trained in (None = unknown)
+        tree_dates: (List[String] or None) Date ("YYYY-MM-DD") every tree was trained on (None = unknown)
+        """
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.left = arrays['left']
+        self.right = arrays['right']
+        self.value = arrays['value']
+        self.missing_left = arrays['missing_left']
+        self.tree_offsets = np.asarray(tree_offsets, dtype = 'int64')
+        self.tree_versions = list(tree_versions) if tree_versions != None else [None]*self.n_trees
+        self.tree_dates = list(tree_dates) if tree_dates != None else [None]*self.n_trees
+        self.engine = None
+
+    def __getstate__(self):
+
+        # The engine (and its worker pool) is rebuilt on first use
+        state = dict(self.__dict__)
+        state['engine'] = None
+        return state
+
+    @classmethod
+    def from_estimators(cls, estimators):
+        """
+        Flattens fitted scikit-learn regression trees (forest.estimators_).
+        """
+        columns = {name: [] for name in ARRAYS}
+        offsets = [0]
+
+        for estimator in estimators:
+            tree = estimator.tree_
+            offset = offsets[-1]
+            is_leaf = tree.children_left == -1
+
+            columns['feature'].append(np.where(is_leaf, -2, tree.feature))
+            columns['threshold'].append(tree.threshold)
+            columns['left'].append(np.where(is_leaf, -1, tree.children_left + offset))
+            columns['right'].append(np.where(is_leaf, -1, tree.children_right + offset))
+            columns['value'].append(tree.value.reshape(tree.node_count, -1)[:, 0])
+            # Where predict sends a missing value (scikit-learn >= 1.3); older versions do not accept one
+            columns['missing_left'].append(getattr(tree, 'missing_go_to_left', np.ones(tree.node_count)))
+            offsets.append(offset + tree.node_count)
+
+        arrays = {name: np.concatenate(columns[name]).astype(dtype) for name, dtype in ARRAYS.items()}
+        return cls(arrays, offsets)
+
+    @classmethod
+    def concatenate(cls, forests):
+        """
+        One forest holding the trees of all forests, in order.
+        """
+        arrays = {name: [] for name in ARRAYS}
+        offsets, versions, dates = [0], [], []
+
+        for forest in forests:
+            base = offsets[-1]
+            for name in ARRAYS:
+                array = np.asarray(getattr(forest, name))
+                if name in ('left', 'right'):
+                    array = np.where(array == -1, -1, array + base)
+                arrays[name].append(array)
+            offsets.extend(base + forest.tree_offsets[1:])
+            versions.extend(forest.tree_versions)
+            dates.extend(forest.tree_dates)
+
+        arrays = {name: np.concatenate(arrays[name]).astype(dtype) for name, dtype in ARRAYS.items()}
+        return cls(arrays, offsets, versions, dates)
+
+    def select_trees(self, trees):
+        """
+        A forest of some of the trees (indices, in the order given), copied out of the arrays.
+        """
+        trees = np.asarray(trees, dtype = 'int64')
+        starts, ends = self.tree_offsets[trees], self.tree_offsets[trees + 1]
+        sizes = ends - starts
+        new_starts = np.concatenate([[0], np.cumsum(sizes)])
+
+        nodes = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)]) if len(trees) else np.empty(0, 'int64')
+        shift = np.repeat(new_starts[:-1] - starts, sizes)
+
+        arrays = {}
+        for name, dtype in ARRAYS.items():
+            array = np.asarray(getattr(self, name))[nodes]
+            if name in ('left', 'right'):
+                array = np.where(array == -1, -1, array + shift)
+            arrays[name] = array.astype(dtype)
+
+        return FlatForest(arrays, new_starts, [self.tree_versions[tree] for tree in trees],
+                          [self.tree_dates[tree] for tree in trees])
+
+    @property
+    def n_trees(self):
+
+        return len(self.tree_offsets) - 1
+
+    @property
+    def nbytes(self):
+
+        return sum(getattr(self, name).nbytes for name in ARRAYS)
+
+    def predict(self, X):
+        """
+        Mean of the trees' predictions for every row of X (see inference_engine.ForestEngine).
+        """
+        if self.engine == None:
+            self.engine = ForestEngine(self)
+
+        return self.engine.predict(X)
+
+
+def export_artifact(model, path, metadata = None):
+    """
+    Writes a CondoModel (with a fitted RandomForestRegressor or a FlatForest) as an artifact directory.
+    Trees of unknown version or date are recorded as trained in this model version, today.
+
+    The artifact is written to a hidden sibling directory and swapped in complete, so
+    exporting over a live artifact never changes the files that models loaded from it
+    have memory-mapped (they keep reading the old files until they reload).
+
+    PARAMETERS:
+    metadata: (Dictionary or None) Extra manifest entries (e.g. the history of a refresh)
+    """
+    forest = model.forest if isinstance(model.forest, FlatForest) else FlatForest.from_estimators(model.forest.estimators_)
+    today = time.strftime("%Y-%m-%d")
+
+    path = os.path.normpath(path)
+    parent, base_name = os.path.split(path)
+    temp_path = os.path.join(parent, "." + base_name + ".tmp-" + str(os.getpid()))
+    old_path = os.path.join(parent, "." + base_name + ".old-" + str(os.getpid()))
+
+    shutil.rmtree(temp_path, ignore_errors = True)
+    os.makedirs(temp_path)
+    for name in ARRAYS:
+        np.save(os.path.join(temp_path, name + ".npy"), np.ascontiguousarray(getattr(forest, name)))
+
+    manifest = {'format': FORMAT,
+                'format_version': FORMAT_VERSION,
+                'version': model.version,
+                'created': time.strftime("%Y-%m-%d %H:%M:%S"),
+                'input_cols': model.input_cols,
+                'defaults': model.defaults,
+                'cleaning_params': model.cleaning_params,
+                'n_trees': forest.n_trees,
+                'tree_offsets': [int(offset) for offset in forest.tree_offsets],
+                'tree_versions': [version or model.version for version in forest.tree_versions],
+                'tree_dates': [date or today for date in forest.tree_dates]}
+    manifest.update(metadata or {})
+
+    with open(os.path.join(temp_path, "manifest.json"), 'w') as file:
+        json.dump(manifest, file, indent = 2)
+
+    # Renaming only moves directory entries: the old files stay readable through existing mmaps
+    if os.path.exists(path):
+        shutil.rmtree(old_path, ignore_errors = True)
+        os.rename(path, old_path)
+    os.rename(temp_path, path)
+    shutil.rmtree(old_path, ignore_errors = True)
+
+
+def read_manifest(path):
+
+    with open(os.path.join(path, "manifest.json")) as file:
+        manifest = json.load(file)
+
+    if manifest.get('format') != FORMAT or manifest.get('format_version', 0) > FORMAT_VERSION:
+        raise ValueError("(read_manifest) " + path + " is not a " + FORMAT + " artifact of version <= " + str(FORMAT_VERSION))
+
+    return manifest
+
+
+def load_artifact(path, mmap = True):
+    """
+    Opens an artifact directory as a CondoModel whose forest is a FlatForest.
+
+    PARAMETERS:
+    mmap: (Boolean) Memory-map the arrays read-only (pages are read on first use
+          and shared between processes) instead of reading them into memory.
+    """
+    from condo_model import CondoModel
+
+    manifest = read_manifest(path)
+    arrays = {}
+    for name in ARRAYS:
+        file_name = os.path.join(path, name + ".npy")
+        if name == 'missing_left' and not os.path.exists(file_name):
+            # Version 1 artifacts send missing values left
+            arrays[name] = np.ones(manifest['tree_offsets'][-1], dtype = ARRAYS[name])
+        else:
+            arrays[name] = np.load(file_name, mmap_mode = 'r' if mmap else None)
+
+    forest = FlatForest(arrays, manifest['tree_offsets'], manifest.get('tree_versions'), manifest.get('tree_dates'))
+
+    return CondoModel(forest, manifest['input_cols'], manifest['defaults'], manifest['cleaning_params'], manifest['version'])
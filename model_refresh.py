@@ -0,0 +1,188 @@
+"""
+Incremental refresh of a model artifact from the listings of a new crawl.
+
+Instead of retraining on the whole history, a refresh fits a few new trees on the
+recent listings only and appends them to the existing forest, then evicts the
+trees that are too old (or the oldest ones beyond max_trees). The cost of a
+refresh depends on the size of the delta, not on the history. A refresh is only
+done when the current model has drifted on the new listings: its MAPE on them, or
+the shift of their input medians from the model's, exceeds a threshold.
+
+Every refresh writes a new artifact version. The manifest records the version and
+date every tree was trained in, the parent version and the drift measured.
+
+Usage: python model_refresh.py condo_model.model new_listings.csv condo_model-2.model [--geocode-cache geocode_cache.sqlite]
+                               [--new-trees 10] [--max-trees 60] [--max-age-days 90] [--max-mape 0.1] [--force]
+"""
+import io
+import time
+import hashlib
+import argparse
+import datetime
+from contextlib import redirect_stdout
+
+import numpy as np
+
+import condo_model
+from model_artifact import FlatForest, export_artifact
+
+REFRESH_PARAMS = {'new_trees': 10,            # Trees fitted on the new listings every refresh
+                  'max_trees': 60,            # The oldest trees beyond this are evicted
+                  'max_age_days': 90,         # Trees older than this are evicted
+                  'max_mape': 0.10,           # Refresh when the model's MAPE on the new listings exceeds this
+                  'max_median_shift': 0.10,   # ... or when an input's median moved by more than this (relative)
+                  'min_rows': 50}             # Fewer new listings than this are not enough to fit trees on
+
+
+def drift_metrics(model, table):
+    """
+    How far a model is from new listings (a training_table): its MAPE on them and
+    the largest relative shift of an input median from the model's defaults
+    (the medians of the data it was trained on).
+    """
+    X = table[model.input_cols].to_numpy(dtype = 'float64')
+    y = table[condo_model.TARGET_COL].to_numpy(dtype = 'float64')
+    mape = float(np.mean(np.abs((model.predict(X) - y)/y))) if len(y) else 0.0
+
+    shifts = {}
+    for column in model.input_cols:
+        default = model.defaults.get(column)
+        if default:
+            shifts[column] = abs(float(table[column].median()) - default)/abs(default)
+
+    return {'rows': len(table), 'mape': mape, 'median_shifts': shifts,
+            'max_median_shift': max(shifts.values()) if shifts else 0.0}
+
+
+def tree_ages(forest, today):
+    """
+    Age in days of every tree (0 when its date is unknown).
+    """
+    return np.array([(today - datetime.date.fromisoformat(date)).days if date else 0 for date in forest.tree_dates])
+
+
+def evict_trees(forest, today, max_trees, max_age_days):
+    """
+    Indices of the trees to keep: those younger than max_age_days, at most
+    max_trees of them, newest first when some must go. Trees stay in their order.
+    """
+    ages = tree_ages(forest, today)
+    keep = np.flatnonzero(ages <= max_age_days)
+
+    if len(keep) > max_trees:
+        # Youngest first; among trees of the same age, later trees were appended later
+        newest = keep[np.lexsort((-keep, ages[keep]))]
+        keep = np.sort(newest[0:max_trees])
+
+    return keep
+
+
+def fit_trees(table, input_cols, n_trees, params, random_state):
+    """
+    A FlatForest of n_trees new trees fitted on a training table, with the notebook's hyperparameters.
+    """
+    from sklearn.ensemble import RandomForestRegressor
+
+    params = dict(condo_model.FOREST_PARAMS, **(params or {}), n_estimators = n_trees)
+    forest = RandomForestRegressor(random_state = random_state, **params)
+    forest.fit(table[input_cols].to_numpy(dtype = 'float64'), table[condo_model.TARGET_COL].to_numpy(dtype = 'float64'))
+
+    return FlatForest.from_estimators(forest.estimators_)
+
+
+def refresh_model(model, condos, refresh_params = None, forest_params = None, force = False, today = None):
+    """
+    Refreshes a model with new listings. Returns (model, report): the new CondoModel,
+    or None when no refresh was needed or possible, and what was measured and done.
+
+    PARAMETERS:
+    model: (CondoModel) Current model (a FlatForest or a fitted RandomForestRegressor)
+    condos: (DataFrame) New listings, cleaned and geocoded (condo_model.load_training_table)
+    refresh_params: (Dictionary or None) Overrides of REFRESH_PARAMS
+    forest_params: (Dictionary or None) Overrides of condo_model.FOREST_PARAMS for the new trees
+    force: (Boolean) Refresh even when the drift is below the thresholds
+    today: (datetime.date or None) Date of the refresh, for tree ages
+    """
+    params = dict(REFRESH_PARAMS, **(refresh_params or {}))
+    today = today or datetime.date.today()
+    table = condo_model.training_table(condos, model.input_cols)
+
+    forest = model.forest if isinstance(model.forest, FlatForest) else FlatForest.from_estimators(model.forest.estimators_)
+    drift = drift_metrics(model, table)
+    drifted = drift['mape'] > params['max_mape'] or drift['max_median_shift'] > params['max_median_shift']
+    report = {'parent_version': model.version, 'date': today.isoformat(), 'drift': drift, 'drifted': drifted}
+
+    if len(table) < params['min_rows']:
+        report['skipped'] = "only " + str(len(table)) + " usable new listings (min_rows " + str(params['min_rows']) + ")"
+        return None, report
+    if not (drifted or force):
+        report['skipped'] = "no drift"
+        return None, report
+
+    start_time = time.time()
+    version = time.strftime("%Y%m%d-%H%M%S")
+    if version == model.version:
+        version = version + "-1"    # Refreshed within the second the parent was made
+    random_state = int(hashlib.sha1(version.encode("utf-8")).hexdigest()[0:8], 16)
+
+    new_forest = fit_trees(table, model.input_cols, params['new_trees'], forest_params, random_state)
+    new_forest.tree_versions = [version]*new_forest.n_trees
+    new_forest.tree_dates = [today.isoformat()]*new_forest.n_trees
+
+    # Evict before appending, leaving room for the new trees
+    keep = evict_trees(forest, today, max(params['max_trees'] - new_forest.n_trees, 0), params['max_age_days'])
+    kept = forest.select_trees(keep)
+    kept.tree_versions = [tree_version or model.version for tree_version in kept.tree_versions]
+    refreshed = FlatForest.concatenate([kept, new_forest])
+
+    # Defaults follow the data in proportion of the trees fitted on it
+    weight = new_forest.n_trees/refreshed.n_trees
+    defaults = {column: (1 - weight)*value + weight*float(table[column].median()) for column, value in model.defaults.items()}
+
+    report.update({'trees_kept': len(keep), 'trees_evicted': forest.n_trees - len(keep), 'trees_added': new_forest.n_trees,
+                   'seconds': round(time.time() - start_time, 3)})
+
+    return condo_model.CondoModel(refreshed, model.input_cols, defaults, model.cleaning_params, version), report
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", help = "Current model (artifact directory or .pkl)")
+    parser.add_argument("listings", help = "New listings from the latest crawl (CSV file or Parquet directory)")
+    parser.add_argument("output", help = "Artifact directory to write the refreshed model to")
+    parser.add_argument("--geocode-cache", default = "geocode_cache.sqlite")
+    parser.add_argument("--new-trees", type = int, default = REFRESH_PARAMS['new_trees'])
+    parser.add_argument("--max-trees", type = int, default = REFRESH_PARAMS['max_trees'])
+    parser.add_argument("--max-age-days", type = int, default = REFRESH_PARAMS['max_age_days'])
+    parser.add_argument("--max-mape", type = float, default = REFRESH_PARAMS['max_mape'])
+    parser.add_argument("--max-median-shift", type = float, default = REFRESH_PARAMS['max_median_shift'])
+    parser.add_argument("--min-rows", type = int, default = REFRESH_PARAMS['min_rows'])
+    parser.add_argument("--force", action = "store_true", help = "Refresh even without drift")
+    args = parser.parse_args()
+
+    model = condo_model.load_model(args.model)
+    with redirect_stdout(io.StringIO()):
+        condos = condo_model.load_training_table(args.listings, args.geocode_cache)
+
+    refresh_params = {'new_trees': args.new_trees, 'max_trees': args.max_trees, 'max_age_days': args.max_age_days,
+                      'max_mape': args.max_mape, 'max_median_shift': args.max_median_shift, 'min_rows': args.min_rows}
+    refreshed, report = refresh_model(model, condos, refresh_params, force = args.force)
+
+    drift = report['drift']
+    print("Model " + model.version + " on " + str(drift['rows']) + " new listings: MAPE " + str(round(drift['mape'], 4))
+          + ", largest median shift " + str(round(drift['max_median_shift'], 4)))
+
+    if refreshed == None:
+        print("No refresh: " + report['skipped'])
+        return
+
+    export_artifact(refreshed, args.output, metadata = {'refresh': report})
+    print("Model " + refreshed.version + " written to " + args.output + ": " + str(report['trees_added']) + " trees added, "
+          + str(report['trees_evicted']) + " evicted, " + str(refreshed.forest.n_trees) + " in total ("
+          + str(report['seconds']) + " s)")
+
+
+if __name__ == '__main__':
+
+    main()
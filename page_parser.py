@@ -0,0 +1,467 @@
+import time
+from numpy import nan
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+
+def lxml_available():
+
+    return lxml != None
+
+
+def extract_area(area_info, link):
+    """
+    Finds the two values for the lengths of the area dimensions and
+    multiplies them together.
+
+    PARAMETERS:
+    area_info: (String) We assume that this has the format "float_1 m x float_2 m"
+    """
+    area_info_split = area_info.strip().split(" ")
+
+    try:
+        first_num = float(area_info_split[0])
+        second_num = float(area_info_split[3])
+    except:
+        print("ERROR (extract_area): Attempted Area Float Conversion for '" + link + "' failed." )
+        return 0
+    else:
+        return round(first_num*second_num,2)
+
+
+def extract_storey_level(storey_string):
+    """
+    Modify floor according to target website format. RoyalLePage storey_strings
+    take the form 'Lower Level'/'Basement Level' 'Sub-Basement Level', 'Main Level'/'Ground Level',
+    'Flat/Apartment Level', 'In-Between Level', '2nd Level', 'Upper Level', '3rd Level'.
+
+    PARAMETERS:
+    storey_string: (String) The string corresponding to html_object.string for storey_level
+    """
+
+    try:
+        floor = storey_string[0].upper()
+    except:
+        print("ERROR (extract_storey_level): Floor Index 0 out of range")
+        return 0
+    else:
+
+        if floor in ["L", "B", "S"]:
+            return 0
+        elif floor in ["M", "G", "I", "F"]:
+            return 1
+        elif floor in ["U"]:
+            return 2
+        else:
+            try:
+                floor_val = int(floor)
+            except:
+                print("ERROR (extract_storey_level): New 'Level' String Found -> assigned Basement Value 0")
+                return 0
+            else:
+                return floor_val
+
+
+def field_name(label):
+    """
+    Column name for a container label, e.g. "Condo Fees:" -> "Condo Fees"
+    """
+    if label.endswith(":"):
+        return label[0:-1]
+    else:
+        return label
+
+
+def xpath_literal(value):
+
+    if "'" not in value:
+        return "'" + value + "'"
+    elif '"' not in value:
+        return '"' + value + '"'
+    else:
+        return "concat('" + value.replace("'", "', \"'\", '") + "')"
+
+
+def xpath_selector(html_type, html_attr = None, relative = True):
+    """
+    Translates a BeautifulSoup find_all(html_type, html_attr) search into the
+    equivalent XPath expression. As in BeautifulSoup, a class value without
+    spaces matches any element carrying that class, while a value with spaces
+    has to match the whole class attribute.
+
+    PARAMETERS:
+    html_type: (String) HTML type to search for
+    html_attr: (Dictionary or None) HTML attributes to filter search
+    relative: (Boolean) Search the descendants of the context element rather than the whole document
+    """
+    predicates = []
+
+    for attr, value in (html_attr or {}).items():
+        if value == None:
+            continue
+        elif value == True:
+            predicates.append("@" + attr)
+        elif attr == 'class' and " " not in value.strip():
+            predicates.append("contains(concat(' ', normalize-space(@class), ' '), " + xpath_literal(" " + value.strip() + " ") + ")")
+        elif attr == 'class':
+            predicates.append("normalize-space(@class)=" + xpath_literal(" ".join(value.split())))
+        else:
+            predicates.append("@" + attr + "=" + xpath_literal(value))
+
+    selector = (".//" if relative else "//") + html_type
+    for predicate in predicates:
+        selector = selector + "[" + predicate + "]"
+
+    return selector
+
+
+def element_string(element):
+    """
+    lxml counterpart of BeautifulSoup's Tag.string: the text of an element that
+    has exactly one child (recursing into a lone child tag), otherwise None.
+    """
+    while True:
+        contents = []
+        if element.text:
+            contents.append(element.text)
+        for child in element:
+            contents.append(child)
+            if child.tail:
+                contents.append(child.tail)
+
+        if len(contents) != 1:
+            return None
+        elif isinstance(contents[0], str):
+            return contents[0]
+        else:
+            element = contents[0]
+
+
+def element_text(element):
+    """
+    lxml counterpart of BeautifulSoup's Tag.text.
+    """
+    return "".join(element.itertext())
+
+
+def report_error(errors, function, message):
+    """
+    Prints a CompiledPageSpec error and counts it in errors under the name of the
+    RealEstateCrawler function that reports the same error, so both backends share metrics.
+    """
+    print("ERROR (CompiledPageSpec): " + message)
+    if errors != None:
+        errors[function] = errors.get(function, 0) + 1
+
+
+def nth(elements, index):
+
+    if 0 <= index < len(elements):
+        return elements[index]
+    else:
+        return None
+
+
+class CompiledPageSpec:
+
+    def __init__(self, crawler_type, crawler_attr, particulars, containers, rooms = False):
+        """
+        The crawler's scraping template (crawl links, scraper particulars and
+        DataContainers) compiled once into XPath expressions and evaluated with
+        lxml. A listing page is parsed once and each selector runs once against
+        it, instead of re-running BeautifulSoup's find_all over the whole tree
+        for every field. Produces the same rows as RealEstateCrawler.scraper.
+
+        Only plain data is kept on the instance and the XPath objects are
+        compiled on first use, so a spec can be pickled and sent to worker processes.
+
+        PARAMETERS:
+        crawler_type, crawler_attr: See RealEstateCrawler.set_crawler_property
+        particulars: (Dictionary) See RealEstateCrawler.set_scraper_particulars
+        containers: (List[DataContainer]) See RealEstateCrawler.set_scraper_containers
+        rooms: (Boolean) Keep the raw rooms of the listing in the row's 'Rooms' instead of
+               computing Storeys and Floor Area [See RealEstateCrawler.set_rooms_output]
+        """
+        if lxml == None:
+            raise ImportError("CompiledPageSpec requires lxml (pip install lxml)")
+
+        self.crawl_selector = xpath_selector(crawler_type, crawler_attr, relative = False)
+        self.rooms = rooms
+
+        self.particulars = []
+        for value, prop in (particulars or {}).items():
+            self.particulars.append({'value': value,
+                                     'selector': xpath_selector(prop['type'], prop['attr'], relative = False),
+                                     'index': prop['index'],
+                                     'child': None if prop['child'] == None else xpath_selector(prop['child']),
+                                     'child index': prop['child index'],
+                                     'sibling': prop['sibling']})
+
+        self.containers = []
+        for container in (containers or []):
+            compiled_container = {'name': container.name,
+                                  'selector': xpath_selector(container.details['type'], container.details['attr'], relative = False),
+                                  'index': container.details['index'],
+                                  'name selector': xpath_selector(container.name_access['type'], container.name_access['attr']),
+                                  'name index': container.name_access['index'],
+                                  'list selector': xpath_selector(container.list_type),
+                                  'element selector': xpath_selector(container.element_type),
+                                  'labels': container.labels}
+
+            if container.labels:
+                label_specs = []
+                for element in container.elements:
+                    spec = (xpath_selector(element['type']), element['index'],
+                            xpath_selector(element['value type']), element['value index'])
+                    if spec not in label_specs:
+                        label_specs.append(spec)
+
+                compiled_container['label specs'] = label_specs
+                compiled_container['fields'] = [(element['name'][0:-1], element['name'].strip())
+                                                for element in container.elements]
+            else:
+                element_tree = container.elements
+                last_depth = element_tree[len(element_tree)-1]
+
+                compiled_container['dig'] = [(xpath_selector(depth['value type']), depth['value index'])
+                                             for depth in element_tree[0:-1]]
+                compiled_container['level'] = (xpath_selector(last_depth['level']['value type'], last_depth['level']['value attr']),
+                                               last_depth['level']['value index'])
+                compiled_container['area'] = (xpath_selector(last_depth['area']['value type'], last_depth['area']['value attr']),
+                                              last_depth['area']['value index'])
+                if 'name' in last_depth:
+                    compiled_container['room name'] = (xpath_selector(last_depth['name']['value type'], last_depth['name']['value attr']),
+                                                       last_depth['name']['value index'])
+
+            self.containers.append(compiled_container)
+
+        self.compiled = None
+
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+        state['compiled'] = None
+        return state
+
+    def xpath(self, selector):
+
+        if self.compiled == None:
+            self.compiled = {}
+
+        compiled = self.compiled.get(selector)
+        if compiled == None:
+            compiled = etree.XPath(selector)
+            self.compiled[selector] = compiled
+
+        return compiled
+
+    def document(self, html):
+
+        return lxml.html.document_fromstring(html)
+
+    def crawl_links(self, html):
+        """
+        Returns the hrefs of every crawl button on an index page.
+        """
+        root = self.document(html)
+        return [element.get('href') for element in self.xpath(self.crawl_selector)(root)]
+
+    def parse(self, html, link, stats = None):
+        """
+        Scrapes a listing page into a row dictionary.
+
+        PARAMETERS:
+        html: (String) Listing page HTML
+        link: (String) The http link of the listing, used in error messages
+        stats: (Dictionary or None) Filled with the parse time ('seconds'), the time
+               per container ('containers') and the errors by function ('errors')
+               [See crawl_metrics.CrawlMetrics.record_parse]
+        """
+        start_time = time.perf_counter()
+        errors = None if stats == None else stats.setdefault('errors', {})
+        container_times = None if stats == None else stats.setdefault('containers', {})
+
+        root = self.document(html)
+        data_dict = {}
+
+        for particular in self.particulars:
+            value = self.particular_value(root, particular, errors)
+            data_dict[particular['value']] = nan if value == None else value.strip()
+
+        for container in self.containers:
+            container_start = time.perf_counter()
+            container_root = self.container_root(root, container, errors)
+
+            if container['labels']:
+                label_index = {} if container_root == None else self.label_index(container_root, container)
+
+                for field, label in container['fields']:
+                    data_dict[field] = label_index.get(label, nan)
+
+                # Labels that are not configured are kept too, so new fields show up in the data
+                for label, value in label_index.items():
+                    data_dict.setdefault(field_name(label), value)
+            elif container_root == None:
+                data_dict['Storeys'] = nan
+                data_dict['Floor Area (m^2)'] = nan
+            elif self.rooms:
+                data_dict['Rooms'] = self.room_rows(container_root, container, link)
+            else:
+                storeys_area = self.levels_and_space(container_root, container, link, errors)
+                data_dict['Storeys'] = storeys_area['Storeys']
+                data_dict['Floor Area (m^2)'] = storeys_area['Floor Area']
+
+            if container_times != None:
+                container_times[str(container['name'])] = time.perf_counter() - container_start
+
+        if stats != None:
+            stats['seconds'] = time.perf_counter() - start_time
+
+        return data_dict
+
+    def particular_value(self, root, particular, errors = None):
+
+        if particular['sibling'] != None:
+            return None
+
+        element = nth(self.xpath(particular['selector'])(root), particular['index'])
+        if element == None:
+            report_error(errors, "access_string_particular", "Failed Attempt at finding '" + particular['value'] + "'.")
+            return None
+
+        if particular['child'] == None:
+            return element_string(element)
+
+        child = nth(self.xpath(particular['child'])(element), particular['child index'])
+        return None if child == None else element_text(child)
+
+    def container_root(self, root, container, errors = None):
+        """
+        Returns the container's element if it exists and carries the expected name, otherwise None.
+        """
+        element = nth(self.xpath(container['selector'])(root), container['index'])
+        if element == None:
+            report_error(errors, "soupify_container", "Index out of range for " + str(container['name']) + ".")
+            return None
+
+        name_element = nth(self.xpath(container['name selector'])(element), container['name index'])
+        if name_element == None:
+            return None
+
+        html_name = element_string(name_element)
+        if html_name == None or html_name.strip() != container['name']:
+            return None
+
+        return element
+
+    def label_index(self, container_root, container):
+        """
+        Reads every list item of a container once into a dictionary of
+        label -> value [See RealEstateCrawler.label_index].
+        """
+        label_index = {}
+
+        for item in self.xpath(container['element selector'])(container_root):
+            for label_selector, label_idx, value_selector, value_idx in container['label specs']:
+
+                label = nth(self.xpath(label_selector)(item), label_idx)
+                label = None if label == None else element_string(label)
+                if label == None:
+                    continue
+
+                label = label.strip()
+                if label in label_index:
+                    continue
+
+                value = nth(self.xpath(value_selector)(item), value_idx)
+                value = None if value == None else element_string(value)
+                label_index[label] = nan if value == None else value.strip()
+
+        return label_index
+
+    def room_rows(self, container_root, container, link):
+        """
+        See RealEstateCrawler.room_rows
+        """
+        level_selector = self.xpath(container['level'][0])
+        area_selector = self.xpath(container['area'][0])
+        name_selector = None if 'room name' not in container else self.xpath(container['room name'][0])
+
+        list_root = nth(self.xpath(container['list selector'])(container_root), 0)
+        element_list = [] if list_root == None else self.xpath(container['element selector'])(list_root)
+
+        rooms = []
+        for element in element_list:
+            info_depth = element
+            for selector, index in container['dig']:
+                if info_depth != None:
+                    info_depth = nth(self.xpath(selector)(info_depth), index)
+
+            name = None if name_selector == None else nth(name_selector(element), container['room name'][1])
+            level = None if info_depth == None else nth(level_selector(info_depth), container['level'][1])
+            area = None if info_depth == None else nth(area_selector(info_depth), container['area'][1])
+
+            rooms.append((link,
+                          None if name == None else element_text(name).strip(),
+                          None if level == None else element_text(level).strip(),
+                          None if area == None else element_string(area)))
+
+        return rooms
+
+    def levels_and_space(self, container_root, container, link, errors = None):
+        """
+        See RealEstateCrawler.compute_levels_and_space
+        """
+        level_selector = self.xpath(container['level'][0])
+        area_selector = self.xpath(container['area'][0])
+
+        list_root = nth(self.xpath(container['list selector'])(container_root), 0)
+        element_list = [] if list_root == None else self.xpath(container['element selector'])(list_root)
+
+        max_storey = 0
+        tot_area = 0
+        missing_area = False
+
+        for element in element_list:
+            info_depth = element
+            for selector, index in container['dig']:
+                if info_depth != None:
+                    info_depth = nth(self.xpath(selector)(info_depth), index)
+
+            level_element = None if info_depth == None else nth(level_selector(info_depth), container['level'][1])
+            if level_element == None:
+                report_error(errors, "compute_levels_and_space", "Attempt at extracting Room Level Info for '" + link + "' failed.")
+                element_level = -1
+            else:
+                element_level = extract_storey_level(element_text(level_element).strip().split(" ")[0])
+
+            if element_level > max_storey:
+                max_storey = element_level
+
+            if element_level > 0:
+                area_element = nth(area_selector(info_depth), container['area'][1])
+                area_info = None if area_element == None else element_string(area_element)
+
+                if area_info == None:
+                    report_error(errors, "compute_levels_and_space", "Attempt at extracting Room Area Info for '" + link + "' failed.")
+                    element_area = 0
+                else:
+                    element_area = extract_area(area_info, link)
+
+                if element_area == 0:
+                    missing_area = True
+            else:
+                element_area = 0
+
+            tot_area = tot_area + element_area
+
+        if missing_area:
+            total_area = nan
+        else:
+            total_area = tot_area
+
+        return {'Storeys': max_storey, 'Floor Area': total_area}
@@ -0,0 +1,307 @@
+"""
+Condo price prediction service around a trained model (condo_model.py).
+
+    python prediction_service.py condo_model.model serve [--port 8000] [--max-batch 64] [--max-wait-ms 5]
+    python prediction_service.py condo_model.model predict listings.csv predictions.csv
+
+HTTP:
+    POST /predict  A JSON object (one listing), a JSON list or a CSV body (bulk)
+                   with the fields of condo_model.REQUEST_FIELDS or the model's input columns.
+    GET  /stats    Request count, throughput, p50 / p99 latency and batch sizes.
+
+Concurrent single-listing requests are coalesced into micro-batches (MicroBatcher),
+so the forest's vectorized predict runs once per batch instead of once per request.
+"""
+import io
+import csv
+import json
+import time
+import queue
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+from condo_model import load_model
+
+
+class PredictionHTTPServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class LatencyStats:
+
+    def __init__(self, window = 10000):
+        """
+        Latencies of the last window requests, for p50 / p99 and throughput.
+        """
+        self.latencies = deque(maxlen = window)
+        self.finished_at = deque(maxlen = window)
+        self.batch_sizes = deque(maxlen = window)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds, rows = 1):
+
+        with self.lock:
+            self.latencies.append(seconds)
+            self.finished_at.append(time.perf_counter())
+            self.count = self.count + rows
+
+    def record_batch(self, size):
+
+        with self.lock:
+            self.batch_sizes.append(size)
+
+    def summary(self):
+
+        with self.lock:
+            latencies = np.array(self.latencies)
+            finished_at = np.array(self.finished_at)
+            batch_sizes = np.array(self.batch_sizes)
+            count = self.count
+
+        summary = {'predictions': count, 'requests': len(latencies)}
+        if len(latencies):
+            summary['p50_ms'] = round(1000*float(np.percentile(latencies, 50)), 3)
+            summary['p99_ms'] = round(1000*float(np.percentile(latencies, 99)), 3)
+        if len(finished_at) > 1 and finished_at[-1] > finished_at[0]:
+            summary['requests_per_second'] = round((len(finished_at) - 1)/(finished_at[-1] - finished_at[0]), 1)
+        if len(batch_sizes):
+            summary['mean_batch_size'] = round(float(batch_sizes.mean()), 2)
+
+        return summary
+
+
+class MicroBatcher:
+
+    def __init__(self, predict, max_batch_size = 64, max_wait = 0.005, stats = None):
+        """
+        Collects single rows submitted from many threads and predicts them together.
+        A batch is closed when it holds max_batch_size rows or when its first row has
+        waited max_wait seconds, whichever comes first.
+
+        PARAMETERS:
+        predict: (Function) Rows array -> predictions array
+        max_batch_size: (Int)
+        max_wait: (Float) Seconds. 0 = Predict whatever is queued without waiting for more.
+        stats: (LatencyStats or None) Receives the batch sizes
+        """
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = stats
+
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def submit(self, row):
+        """
+        Returns a Future of the prediction for one feature row.
+        """
+        future = Future()
+        self.requests.put((row, future))
+        return future
+
+    def next_batch(self):
+
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.requests.get(timeout = remaining) if remaining > 0 else self.requests.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def run(self):
+
+        while True:
+            batch = self.next_batch()
+
+            try:
+                predictions = self.predict(np.vstack([row for row, _ in batch]))
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+
+            if self.stats != None:
+                self.stats.record_batch(len(batch))
+            for (_, future), prediction in zip(batch, predictions):
+                future.set_result(float(prediction))
+
+
+class PredictionService:
+
+    def __init__(self, model, max_batch_size = 64, max_wait = 0.005):
+        """
+        PARAMETERS:
+        model: (CondoModel) Loaded once and shared by every request
+        max_batch_size, max_wait: MicroBatcher settings. max_batch_size 1 = No batching.
+        """
+        self.model = model
+        self.stats = LatencyStats()
+        self.batcher = MicroBatcher(model.predict, max_batch_size, max_wait, self.stats)
+
+    def predict_one(self, record):
+
+        return self.batcher.submit(self.model.feature_rows([record])[0]).result()
+
+    def predict_many(self, records):
+
+        return [float(prediction) for prediction in self.model.predict_records(records)]
+
+    def handle(self, body, content_type):
+        """
+        Returns the response dictionary of a /predict request body.
+        Raises ValueError if the body is not a listing or a list of listings.
+        """
+        start_time = time.perf_counter()
+
+        if "csv" in content_type:
+            records = list(csv.DictReader(io.StringIO(body.decode("utf-8"))))
+            predictions = self.predict_many(records)
+            response = {'predictions': predictions}
+        else:
+            payload = json.loads(body)
+            if not isinstance(payload, (dict, list)) or (isinstance(payload, list)
+                                                         and not all(isinstance(record, dict) for record in payload)):
+                raise ValueError("(handle) The body must be a JSON object (one listing) or a list of objects")
+
+            if isinstance(payload, list):
+                predictions = self.predict_many(payload)
+                response = {'predictions': predictions}
+            else:
+                predictions = [self.predict_one(payload)]
+                response = {'prediction': predictions[0]}
+
+        self.stats.record(time.perf_counter() - start_time, rows = len(predictions))
+        response['model'] = self.model.version
+
+        return response
+
+    def handler_class(self):
+
+        service = self
+
+        class PredictionHandler(BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+
+                if self.path != "/predict":
+                    return self.reply(404, {'error': "unknown path " + self.path})
+
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                try:
+                    self.reply(200, service.handle(body, self.headers.get('Content-Type', "application/json")))
+                except (ValueError, KeyError) as error:
+                    self.reply(400, {'error': repr(error)})
+                except Exception as error:
+                    # The client gets an answer even when a request fails in an unexpected way
+                    self.reply(500, {'error': repr(error)})
+
+            def do_GET(self):
+
+                if self.path == "/stats":
+                    self.reply(200, service.stats.summary())
+                else:
+                    self.reply(404, {'error': "unknown path " + self.path})
+
+            def reply(self, status, payload):
+
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return PredictionHandler
+
+    def make_server(self, host = "127.0.0.1", port = 8000):
+        """
+        Returns the HTTP server without starting it (port 0 = Pick a free port).
+        """
+        return PredictionHTTPServer((host, port), self.handler_class())
+
+    def serve(self, host = "127.0.0.1", port = 8000):
+
+        httpd = self.make_server(host, port)
+        print("Serving model " + self.model.version + " on http://" + host + ":" + str(httpd.server_address[1]))
+
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.server_close()
+            print(json.dumps(self.stats.summary()))
+
+
+def predict_file(model, input_file, output_file):
+    """
+    Bulk mode: predicts every row of a CSV file in one vectorized call and writes
+    the rows back with a 'Predicted Price ($)' column.
+    """
+    with open(input_file, newline = '') as file:
+        records = list(csv.DictReader(file))
+
+    start_time = time.perf_counter()
+    predictions = model.predict_records(records)
+    elapsed = time.perf_counter() - start_time
+
+    with open(output_file, 'w', newline = '') as file:
+        writer = csv.DictWriter(file, fieldnames = list(records[0].keys()) + ['Predicted Price ($)'] if records else [])
+        writer.writeheader()
+        for record, prediction in zip(records, predictions):
+            record['Predicted Price ($)'] = round(float(prediction), 2)
+            writer.writerow(record)
+
+    print("Predicted " + str(len(records)) + " rows in " + str(round(elapsed, 3)) + " s ("
+          + str(round(len(records)/max(elapsed, 1e-9))) + " rows/s)")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", help = "Model artifact (or .pkl file) written by condo_model.py")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    serve = commands.add_parser("serve")
+    serve.add_argument("--host", default = "127.0.0.1")
+    serve.add_argument("--port", type = int, default = 8000)
+    serve.add_argument("--max-batch", type = int, default = 64)
+    serve.add_argument("--max-wait-ms", type = float, default = 5)
+
+    predict = commands.add_parser("predict")
+    predict.add_argument("input", help = "CSV file of listings")
+    predict.add_argument("output", help = "CSV file written with predictions")
+
+    args = parser.parse_args()
+    model = load_model(args.model)
+
+    if args.command == "serve":
+        PredictionService(model, args.max_batch, args.max_wait_ms/1000).serve(args.host, args.port)
+    else:
+        predict_file(model, args.input, args.output)
+
+
+if __name__ == '__main__':
+
+    main()
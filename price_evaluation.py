@@ -0,0 +1,251 @@
+"""
+Evaluation of price predictions: the MAPE accuracy and threshold accuracies of
+CondoPrices.ipynb, error quantiles and per-segment breakdowns.
+
+The batch functions sort the absolute errors once and read the whole
+accuracy-vs-threshold curve off the sorted array (O(n log n)), instead of
+recomputing the errors for every threshold. StreamingEvaluation gives the same
+report for prediction files too large to load, one chunk at a time.
+
+    curve = accuracy_curve(predictions, y)                 # threshold, accuracy
+    report = evaluate(predictions, y, segments = segment_columns(condos))
+    report = evaluate_file("predictions.csv", chunksize = 100000)
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+BENCHMARK = 60000                    # +/- $ of the notebook's performance accuracy
+THRESHOLDS = 10000*np.arange(100)    # Thresholds of the notebook's accuracy curve
+QUANTILES = [0.5, 0.75, 0.9, 0.95, 0.99]
+
+# Streaming quantiles: absolute errors are counted in log-spaced bins 0.1% wide, from $1 to $1B
+ERROR_BINS = np.concatenate([[0], np.geomspace(1, 1e9, int(np.log(1e9)/np.log(1.001)) + 1)])
+
+
+def mape(predictions, y):
+
+    return float(np.mean(np.abs((np.asarray(predictions) - np.asarray(y))/np.asarray(y))))
+
+
+def mape_performance(predictions, y):
+    """
+    The notebook's "MAPE accuracy": 100*(1 - MAPE).
+    """
+    return 100*(1 - mape(predictions, y))
+
+
+def accuracy_curve(predictions, y, thresholds = THRESHOLDS):
+    """
+    Fraction of predictions within each threshold (|prediction - y| < threshold), for all thresholds at once.
+    Returns a DataFrame with 'Threshold' and 'Accuracy' columns.
+    """
+    errors = np.sort(np.abs(np.asarray(predictions, dtype = 'float64') - np.asarray(y, dtype = 'float64')))
+    within = np.searchsorted(errors, thresholds, side = 'left')
+
+    return pd.DataFrame({'Threshold': thresholds, 'Accuracy': within/max(len(errors), 1)})
+
+
+def accuracy_levels(curve, levels):
+    """
+    The first threshold of the curve at which the accuracy exceeds each level
+    (what display_threshold_accuracies printed). Returns {level: threshold or None}.
+    """
+    accuracies = curve['Accuracy'].to_numpy()
+    positions = np.searchsorted(accuracies, levels, side = 'right')
+
+    return {level: (curve['Threshold'].iloc[position].item() if position < len(curve) else None)
+            for level, position in zip(levels, positions)}
+
+
+def segment_columns(condos, postal_code_col = 'Postal Code', bedrooms_col = 'Bedrooms'):
+    """
+    The default segments: postal code prefix (forward sortation area, e.g. "M5V") and bedrooms.
+    """
+    return {'Postal Prefix': condos[postal_code_col].astype(str).str[0:3].to_numpy(),
+            'Bedrooms': condos[bedrooms_col].to_numpy()}
+
+
+def segment_report(errors, percent_errors, segments, benchmark = BENCHMARK):
+    """
+    Per-segment count, MAPE, mean and median absolute error and benchmark accuracy,
+    one groupby per segment column. Returns {segment name: DataFrame}.
+    """
+    reports = {}
+    for name, values in segments.items():
+        table = pd.DataFrame({name: values, 'error': errors, 'percent_error': percent_errors,
+                              'within': errors < benchmark})
+        groups = table.groupby(name, observed = True)
+
+        reports[name] = pd.DataFrame({'Count': groups['error'].size(),
+                                      'MAPE': groups['percent_error'].mean(),
+                                      'Mean Error': groups['error'].mean(),
+                                      'Median Error': groups['error'].median(),
+                                      'Accuracy': groups['within'].mean()})
+
+    return reports
+
+
+def evaluate(predictions, y, segments = None, thresholds = THRESHOLDS, benchmark = BENCHMARK, quantiles = QUANTILES):
+    """
+    Full report for predictions held in memory.
+
+    PARAMETERS:
+    segments: (Dictionary or None) {segment name: array of group labels}, e.g. segment_columns(condos)
+    Returns {'count', 'mape', 'mape_performance', 'accuracy' (within benchmark), 'quantiles', 'curve', 'segments'}
+    """
+    predictions = np.asarray(predictions, dtype = 'float64')
+    y = np.asarray(y, dtype = 'float64')
+
+    errors = np.abs(predictions - y)
+    percent_errors = errors/np.abs(y)
+    sorted_errors = np.sort(errors)
+    count = len(errors)
+
+    curve = pd.DataFrame({'Threshold': thresholds,
+                          'Accuracy': np.searchsorted(sorted_errors, thresholds, side = 'left')/max(count, 1)})
+
+    return {'count': count,
+            'mape': float(percent_errors.mean()),
+            'mape_performance': float(100*(1 - percent_errors.mean())),
+            'accuracy': float(np.searchsorted(sorted_errors, benchmark, side = 'left')/max(count, 1)),
+            'quantiles': {q: float(np.quantile(sorted_errors, q)) for q in quantiles},
+            'curve': curve,
+            'segments': segment_report(errors, percent_errors, segments or {}, benchmark)}
+
+
+class StreamingEvaluation:
+
+    def __init__(self, thresholds = THRESHOLDS, benchmark = BENCHMARK, quantiles = QUANTILES):
+        """
+        Accumulates the evaluate() report over chunks of predictions in fixed memory:
+        error counts per threshold interval (so the curve and the benchmark accuracy
+        are exact), error counts in fine log-spaced bins (quantiles to within 0.1%),
+        and running sums per segment group. Segment medians are left out.
+        """
+        self.thresholds = np.asarray(thresholds)
+        self.benchmark = benchmark
+        self.quantiles = quantiles
+
+        self.count = 0
+        self.percent_error_sum = 0.0
+        self.within_benchmark = 0
+        self.threshold_counts = np.zeros(len(self.thresholds) + 1, dtype = 'int64')
+        self.bin_counts = np.zeros(len(ERROR_BINS), dtype = 'int64')
+        self.segment_sums = {}
+
+    def update(self, predictions, y, segments = None):
+
+        predictions = np.asarray(predictions, dtype = 'float64')
+        y = np.asarray(y, dtype = 'float64')
+        errors = np.abs(predictions - y)
+        percent_errors = errors/np.abs(y)
+
+        self.count = self.count + len(errors)
+        self.percent_error_sum = self.percent_error_sum + float(percent_errors.sum())
+        self.within_benchmark = self.within_benchmark + int((errors < self.benchmark).sum())
+
+        # Errors e with thresholds[i-1] <= e < thresholds[i] are counted in slot i
+        slots = np.searchsorted(self.thresholds, errors, side = 'right')
+        self.threshold_counts += np.bincount(slots, minlength = len(self.threshold_counts))
+        self.bin_counts += np.bincount(np.searchsorted(ERROR_BINS, errors, side = 'right') - 1,
+                                       minlength = len(ERROR_BINS))[0:len(ERROR_BINS)]
+
+        for name, values in (segments or {}).items():
+            table = pd.DataFrame({name: values, 'Count': 1, 'error': errors, 'percent_error': percent_errors,
+                                  'within': (errors < self.benchmark).astype('int64')})
+            sums = table.groupby(name, observed = True).sum()
+            self.segment_sums[name] = sums if name not in self.segment_sums else self.segment_sums[name].add(sums, fill_value = 0)
+
+    def report(self):
+
+        count = max(self.count, 1)
+        curve = pd.DataFrame({'Threshold': self.thresholds, 'Accuracy': np.cumsum(self.threshold_counts)[0:-1]/count})
+
+        # Quantiles are read from the cumulative bin counts (upper edge of the bin holding the quantile)
+        cumulative = np.cumsum(self.bin_counts)
+        upper_edges = np.append(ERROR_BINS[1:], np.inf)
+        quantiles = {q: float(upper_edges[np.searchsorted(cumulative, q*self.count, side = 'left')]) for q in self.quantiles}
+
+        segments = {}
+        for name, sums in self.segment_sums.items():
+            segments[name] = pd.DataFrame({'Count': sums['Count'].astype('int64'),
+                                           'MAPE': sums['percent_error']/sums['Count'],
+                                           'Mean Error': sums['error']/sums['Count'],
+                                           'Accuracy': sums['within']/sums['Count']})
+
+        return {'count': self.count,
+                'mape': self.percent_error_sum/count,
+                'mape_performance': 100*(1 - self.percent_error_sum/count),
+                'accuracy': self.within_benchmark/count,
+                'quantiles': quantiles,
+                'curve': curve,
+                'segments': segments}
+
+
+def evaluate_file(file_name, prediction_col = 'Predicted Price ($)', target_col = 'Price ($)', chunksize = 100000,
+                  segment_cols = ('Postal Code', 'Bedrooms'), **kwargs):
+    """
+    Streams a CSV of predictions (e.g. from prediction_service.py predict) through
+    StreamingEvaluation. Postal Code is reduced to its three-character prefix.
+    """
+    evaluation = StreamingEvaluation(**kwargs)
+
+    for chunk in pd.read_csv(file_name, chunksize = chunksize):
+        segments = {}
+        for column in segment_cols:
+            if column in chunk.columns:
+                values = chunk[column]
+                segments['Postal Prefix' if column == 'Postal Code' else column] = \
+                    values.astype(str).str[0:3].to_numpy() if column == 'Postal Code' else values.to_numpy()
+
+        evaluation.update(chunk[prediction_col].to_numpy(), chunk[target_col].to_numpy(), segments)
+
+    return evaluation.report()
+
+
+def plot_accuracy_curve(curve, ax = None):
+    """
+    The notebook's accuracy-vs-threshold plot.
+    """
+    import matplotlib.pyplot as plt
+
+    ax = ax or plt.gca()
+    ax.plot(curve['Threshold'], curve['Accuracy'])
+    ax.set_xlabel("Threshold")
+    ax.set_ylabel("Accuracy")
+
+    return ax
+
+
+def print_report(report, levels = (0.5, 0.75, 0.9)):
+
+    print("Listings: {:,}".format(report['count']))
+    print("MAPE Accuracy = {:.1f}%".format(report['mape_performance']))
+    print("Performance Accuracy (+/- ${:n}) = {:.2f}".format(BENCHMARK, report['accuracy']))
+    print("Error quantiles: " + ", ".join("p{:g} ${:,.0f}".format(100*q, value) for q, value in report['quantiles'].items()))
+
+    curve = report['curve'].set_index('Threshold')['Accuracy']
+    for threshold in accuracy_levels(report['curve'], list(levels)).values():
+        if threshold != None:
+            print("Accuracy of {:f} occurs for +- ${:n}".format(curve[threshold], threshold))
+
+    for name, table in report['segments'].items():
+        print("\nBy " + name + ":")
+        print(table.sort_values('Count', ascending = False).head(15).to_string(float_format = lambda value: "{:,.3f}".format(value)))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Evaluate a CSV of predictions ('Predicted Price ($)' vs 'Price ($)').")
+    parser.add_argument("predictions", help = "CSV written by prediction_service.py predict")
+    parser.add_argument("--chunksize", type = int, default = 100000)
+    args = parser.parse_args()
+
+    print_report(evaluate_file(args.predictions, chunksize = args.chunksize))
+
+
+if __name__ == '__main__':
+
+    main()
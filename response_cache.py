@@ -0,0 +1,181 @@
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+
+
+class CachedResponse:
+
+    def __init__(self, url, status_code, content, encoding, headers, fetched_at):
+        """
+        A stand-in for requests.Response built from a cache entry. It exposes the
+        attributes the crawler reads (status_code, text, content, headers, url).
+        """
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.encoding = encoding
+        self.headers = headers
+        self.fetched_at = fetched_at
+        self.from_cache = True
+
+    @property
+    def text(self):
+
+        return self.content.decode(self.encoding or "utf-8", errors = "replace")
+
+
+class ResponseCache:
+
+    def __init__(self, path, ttl = 24*3600, max_bytes = 512*1024*1024, offline = False):
+        """
+        Persistent on-disk cache of successful HTTP responses, stored in a single
+        SQLite file. Entries are keyed by the SHA-256 of the URL and bodies are
+        zlib-compressed. Entries younger than ttl are served without touching the
+        network; older ones are revalidated with If-None-Match / If-Modified-Since.
+        When the compressed bodies exceed max_bytes, the least recently used
+        entries are evicted.
+
+        PARAMETERS:
+        path: (String) SQLite file holding the cache. Created if missing.
+        ttl: (Float or None) Seconds an entry is served without revalidation. None = Never expires.
+        max_bytes: (Int or None) Size budget for the stored (compressed) bodies. None = Unbounded.
+        offline: (Boolean) Replay only. Cached entries are served regardless of age and
+                 anything not in the cache fails instead of going to the network.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                body BLOB NOT NULL,
+                encoding TEXT,
+                content_type TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (accessed_at)")
+        self.connection.commit()
+
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def key(self, url):
+
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def lookup(self, url):
+        """
+        Returns the CachedResponse for url, or None if it is not cached.
+        """
+        key = self.key(url)
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT status, body, encoding, content_type, etag, last_modified, fetched_at FROM responses WHERE key = ?",
+                (key,)).fetchone()
+            if row == None:
+                return None
+
+            self.connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+
+        status, body, encoding, content_type, etag, last_modified, fetched_at = row
+
+        headers = {}
+        if content_type != None:
+            headers["Content-Type"] = content_type
+        if etag != None:
+            headers["ETag"] = etag
+        if last_modified != None:
+            headers["Last-Modified"] = last_modified
+
+        return CachedResponse(url, status, zlib.decompress(body), encoding, headers, fetched_at)
+
+    def is_fresh(self, cached):
+
+        if self.ttl == None:
+            return True
+        return time.time() - cached.fetched_at < self.ttl
+
+    def conditional_headers(self, cached, headers = None):
+        """
+        Adds the validators of a stale entry to the request headers so that the
+        server can answer 304 Not Modified instead of resending the page.
+        """
+        headers = dict(headers) if headers != None else {}
+
+        if cached != None:
+            if "ETag" in cached.headers:
+                headers["If-None-Match"] = cached.headers["ETag"]
+            if "Last-Modified" in cached.headers:
+                headers["If-Modified-Since"] = cached.headers["Last-Modified"]
+
+        return headers
+
+    def revalidated(self, url):
+        """
+        Marks an entry as fresh again after the server answered 304 Not Modified.
+        """
+        time_now = time.time()
+
+        with self.lock:
+            self.connection.execute("UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE key = ?",
+                                    (time_now, time_now, self.key(url)))
+            self.connection.commit()
+
+    def store(self, url, response):
+        """
+        Saves a successful requests.Response.
+        """
+        body = zlib.compress(response.content)
+        encoding = response.encoding or response.apparent_encoding
+        time_now = time.time()
+        key = self.key(url)
+
+        with self.lock:
+            previous = self.connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, url, response.status_code, body, encoding, response.headers.get("Content-Type"),
+                 response.headers.get("ETag"), response.headers.get("Last-Modified"), time_now, time_now, len(body)))
+
+            self.total_bytes = self.total_bytes + len(body) - (previous[0] if previous != None else 0)
+
+            if self.max_bytes != None and self.total_bytes > self.max_bytes:
+                self.evict()
+
+            self.connection.commit()
+
+    def evict(self):
+        """
+        Deletes least recently used entries until the cache fits in max_bytes.
+        Must be called with the lock held.
+        """
+        rows = self.connection.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC").fetchall()
+
+        evicted = []
+        for key, size in rows:
+            if self.total_bytes <= self.max_bytes:
+                break
+            evicted.append((key,))
+            self.total_bytes = self.total_bytes - size
+
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def close(self):
+
+        with self.lock:
+            self.connection.close()
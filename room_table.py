@@ -0,0 +1,131 @@
+"""
+Room-level side output of the crawler and the storey / floor area computation on it.
+
+With RealEstateCrawler.set_rooms_output the scraper keeps the raw text of every
+room of a listing (name, level, dimensions) instead of computing Storeys and
+Floor Area room by room while crawling. Both are computed here for many listings
+at once, as a groupby over the rooms table, with repeated rooms (the same name,
+level and dimensions listed twice) counted once. The rooms table is written next
+to the listings, so the two columns can be recomputed without fetching anything.
+
+Usage: python room_table.py listings.csv rooms.csv output.csv [--keep-duplicates]
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+ROOM_FIELDS = ["Listing", "Room", "Level", "Dimensions"]
+
+# First letter of a RoyalLePage level ("Main Level", "Upper Level", ...) -> storey [See page_parser.extract_storey_level]
+STOREY_CODES = {"L": 0, "B": 0, "S": 0, "M": 1, "G": 1, "I": 1, "F": 1, "U": 2}
+STOREY_CODES.update({str(digit): digit for digit in range(10)})
+
+
+def storey_levels(levels):
+    """
+    Vectorized page_parser.extract_storey_level over a Series of level texts.
+    A missing level (the element was not found) is -1.
+    """
+    first = levels.fillna("").astype(str).str.strip().str.split(" ").str[0].str[0:1].str.upper()
+    storeys = first.map(STOREY_CODES).fillna(0).astype('int64')
+    storeys[levels.isna()] = -1
+    return storeys
+
+
+def room_areas(dimensions):
+    """
+    Vectorized page_parser.extract_area over a Series of "a m x b m" texts. Unparseable dimensions are NaN.
+    """
+    parts = dimensions.fillna("").astype(str).str.strip().str.split(" ")
+    first = parse_float(parts.str[0])
+    second = parse_float(parts.str[3])
+    return (first*second).round(2)
+
+
+def parse_float(values):
+
+    return pd.to_numeric(values, errors = 'coerce').astype('float64')
+
+
+def levels_and_space(rooms, keys = None, key = "Listing", dedup = True):
+    """
+    Storeys and Floor Area of every listing from its rooms, as in
+    RealEstateCrawler.compute_levels_and_space: Storeys is the highest level,
+    Floor Area the sum of the room areas above the basement (rounded to 0.01 m^2),
+    and NaN when one of those rooms has no area. Returns a DataFrame indexed by key.
+
+    PARAMETERS:
+    rooms: (DataFrame) Rooms table with the columns key, "Room", "Level" and "Dimensions"
+    keys: (List or None) Listings to report, including those without rooms (Storeys 0, Floor Area 0). None = Those in rooms.
+    key: (String) Column identifying the listing
+    dedup: (Boolean) Count a room listed twice (same name, level and dimensions) once
+    """
+    if dedup:
+        rooms = rooms.drop_duplicates([key, "Room", "Level", "Dimensions"])
+
+    storeys = storey_levels(rooms["Level"])
+    above_basement = storeys > 0
+    areas = room_areas(rooms["Dimensions"]).where(above_basement, 0.0)
+    missing = above_basement & (areas.isna() | (areas == 0))
+
+    failed = int((above_basement & areas.isna()).sum())
+    if failed:
+        print("ERROR (levels_and_space): Attempted Area Float Conversion failed for " + str(failed) + " rooms.")
+
+    grouped = pd.DataFrame({key: rooms[key].to_numpy(), 'Storeys': storeys.clip(lower = 0).to_numpy(),
+                            'Floor Area': areas.fillna(0.0).to_numpy(), 'Missing': missing.to_numpy()}).groupby(key, sort = False)
+
+    # Room areas have two decimals, so does their sum (without the float noise of adding them one by one)
+    result = pd.DataFrame({'Storeys': grouped['Storeys'].max(), 'Floor Area': grouped['Floor Area'].sum().round(2)})
+    result.loc[grouped['Missing'].any(), 'Floor Area'] = np.nan
+
+    if keys != None:
+        result = result.reindex(keys)
+        result['Storeys'] = result['Storeys'].fillna(0).astype('int64')
+        result['Floor Area'] = result['Floor Area'].where(result.index.isin(rooms[key]), 0.0)
+
+    return result
+
+
+def recompute(listings, rooms, dedup = True, key = "Listing"):
+    """
+    Returns listings with Storeys and Floor Area (m^2) recomputed from a rooms
+    table. listings must have the key column; those without rooms are left as they are.
+    """
+    space = levels_and_space(rooms, key = key, dedup = dedup)
+    listings = listings.copy()
+
+    found = listings[key].isin(space.index)
+    listings.loc[found, 'Storeys'] = listings.loc[found, key].map(space['Storeys'])
+    listings.loc[found, 'Floor Area (m^2)'] = listings.loc[found, key].map(space['Floor Area'])
+    return listings
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("listings", help = "Listings CSV written with a Listing column [See RealEstateCrawler.set_rooms_output]")
+    parser.add_argument("rooms", help = "Rooms CSV written next to it")
+    parser.add_argument("output")
+    parser.add_argument("--keep-duplicates", action = "store_true", help = "Count repeated rooms every time, as the crawler used to")
+    args = parser.parse_args()
+
+    listings = pd.read_csv(args.listings)
+    rooms = pd.read_csv(args.rooms, dtype = {"Room": str, "Level": str, "Dimensions": str}, keep_default_na = False,
+                        na_values = {"Level": [""], "Dimensions": [""]})
+    if "Listing" not in listings:
+        print("ERROR (room_table): " + args.listings + " has no Listing column to match the rooms with")
+        return
+
+    recomputed = recompute(listings, rooms, dedup = not args.keep_duplicates)
+    recomputed.to_csv(args.output, index = False)
+
+    changed = (recomputed['Floor Area (m^2)'].fillna(-1) != listings['Floor Area (m^2)'].fillna(-1)).sum()
+    print("Recomputed " + str(len(recomputed)) + " listings from " + str(len(rooms)) + " rooms, "
+          + str(changed) + " floor areas changed. Written to " + args.output)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,241 @@
+"""
+Spatial index over geocoded listings: neighbourhood features for the model and
+nearest-comparable lookups.
+
+    index = SpatialIndex.from_listings(condos)          # Latitude / Longitude from geocoder.py
+    condos = neighbourhood_features(condos, index)
+    index.comparables(43.6453, -79.3806, k = 5)
+"""
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+
+EARTH_RADIUS_KM = 6371.0088
+DOWNTOWN = (43.6453, -79.3806)   # Union Station, Toronto
+
+# Columns of clean_condos used for price per sqft
+PRICE_COL = 'Price ($)'
+AREA_COL = 'Floor Area (sqft)'
+
+
+def to_radians(latitudes, longitudes):
+
+    return np.radians(np.column_stack([np.asarray(latitudes, dtype = 'float64'),
+                                       np.asarray(longitudes, dtype = 'float64')]))
+
+
+def to_unit_vectors(latitudes, longitudes):
+    """
+    Points on the unit sphere. Straight-line (chord) distances between them grow
+    with great-circle distances, so a euclidean KD-tree over them answers the same
+    nearest-neighbour and radius queries as a haversine BallTree, several times faster.
+    """
+    points = to_radians(latitudes, longitudes)
+    return np.column_stack([np.cos(points[:, 0])*np.cos(points[:, 1]),
+                            np.cos(points[:, 0])*np.sin(points[:, 1]),
+                            np.sin(points[:, 0])])
+
+
+def chord_to_km(chords):
+
+    return 2*EARTH_RADIUS_KM*np.arcsin(np.minimum(chords/2, 1.0))
+
+
+def km_to_chord(distances):
+
+    return 2*np.sin(np.asarray(distances)/(2*EARTH_RADIUS_KM))
+
+
+def haversine_km(points, point):
+    """
+    Great-circle distances (km) from every row of points to point, both in radians [lat, lon].
+    """
+    d_lat = points[:, 0] - point[0]
+    d_lon = points[:, 1] - point[1]
+    a = np.sin(d_lat/2)**2 + np.cos(points[:, 0])*np.cos(point[0])*np.sin(d_lon/2)**2
+    return 2*EARTH_RADIUS_KM*np.arcsin(np.sqrt(a))
+
+
+class SpatialIndex:
+
+    def __init__(self, listings, lat_col = 'Latitude', lon_col = 'Longitude', leaf_size = 40, rebuild_fraction = 0.1):
+        """
+        KD-tree over the listings that have coordinates (as points on the unit
+        sphere, see to_unit_vectors).
+
+        New listings added with insert() go to a small buffer that is searched by
+        brute force next to the tree; the tree is rebuilt once the buffer holds
+        more than rebuild_fraction of the indexed listings, so inserts stay cheap
+        and queries stay O(log n).
+
+        PARAMETERS:
+        listings: (DataFrame) Listings with coordinates. Their index labels identify them in query results
+                  and must be unique (see insert).
+        lat_col, lon_col: (String) Coordinate columns
+        leaf_size: (Int) KDTree leaf size
+        rebuild_fraction: (Float) Buffer size, relative to the tree, that triggers a rebuild
+        """
+        self.lat_col = lat_col
+        self.lon_col = lon_col
+        self.leaf_size = leaf_size
+        self.rebuild_fraction = rebuild_fraction
+
+        self.listings = listings.iloc[0:0]
+        self.points = np.empty((0, 3))
+        self.tree = None
+        self.tree_size = 0
+
+        self.insert(listings)
+        self.rebuild()
+
+    @classmethod
+    def from_listings(cls, listings, **kwargs):
+
+        return cls(listings, **kwargs)
+
+    def __len__(self):
+
+        return len(self.points)
+
+    def insert(self, listings):
+        """
+        Adds listings (rows without coordinates are skipped).
+
+        Raises ValueError if an index label is repeated or already indexed: listings are
+        told apart by label (e.g. to leave a listing out of its own comparables), so a
+        frame with a default RangeIndex has to be given other labels first.
+        """
+        listings = listings[listings[self.lat_col].notna() & listings[self.lon_col].notna()]
+        if len(listings) == 0:
+            return
+
+        if listings.index.has_duplicates or self.listings.index.isin(listings.index).any():
+            raise ValueError("(SpatialIndex.insert) Index labels must be unique, and these listings repeat a label "
+                             "or use one that is already indexed")
+
+        self.listings = pd.concat([self.listings, listings]) if len(self.listings) else listings.copy()
+        self.points = np.vstack([self.points, to_unit_vectors(listings[self.lat_col], listings[self.lon_col])])
+
+        if len(self.points) - self.tree_size > self.rebuild_fraction*max(self.tree_size, 1):
+            self.rebuild()
+
+    def rebuild(self):
+
+        self.tree = KDTree(self.points, leaf_size = self.leaf_size) if len(self.points) else None
+        self.tree_size = len(self.points)
+
+    def query(self, latitudes, longitudes, k = 10):
+        """
+        k nearest listings of every query point.
+
+        Returns (distances in km, positions), both of shape (queries, k), nearest
+        first. Positions index into self.listings / self.points.
+        """
+        queries = to_unit_vectors(np.atleast_1d(latitudes), np.atleast_1d(longitudes))
+        k = min(k, len(self.points))
+
+        if self.tree_size > 0:
+            distances, positions = self.tree.query(queries, k = min(k, self.tree_size))
+        else:
+            distances, positions = np.empty((len(queries), 0)), np.empty((len(queries), 0), dtype = int)
+
+        buffer = self.points[self.tree_size:]
+        if len(buffer):
+            buffer_distances = np.column_stack([np.linalg.norm(queries - point, axis = 1) for point in buffer])
+            distances = np.hstack([distances, buffer_distances])
+            positions = np.hstack([positions, np.arange(self.tree_size, len(self.points))[None, :].repeat(len(queries), 0)])
+
+            order = np.argsort(distances, axis = 1, kind = 'stable')[:, 0:k]
+            distances = np.take_along_axis(distances, order, axis = 1)
+            positions = np.take_along_axis(positions, order, axis = 1)
+
+        return chord_to_km(distances), positions
+
+    def count_within(self, latitudes, longitudes, radius_km):
+        """
+        Number of indexed listings within radius_km of every query point.
+        """
+        queries = to_unit_vectors(np.atleast_1d(latitudes), np.atleast_1d(longitudes))
+        radius = km_to_chord(radius_km)
+
+        counts = np.zeros(len(queries), dtype = 'int64')
+        if self.tree_size > 0:
+            counts = self.tree.query_radius(queries, r = radius, count_only = True)
+
+        for point in self.points[self.tree_size:]:
+            counts = counts + (np.linalg.norm(queries - point, axis = 1) <= radius)
+
+        return counts
+
+    def comparables(self, latitude, longitude, k = 10, exclude = None):
+        """
+        The k listings nearest to a point, nearest first, with a 'Distance (km)' column.
+
+        PARAMETERS:
+        exclude: (Index label or None) Listing left out of the results (e.g. the listing being priced)
+        """
+        distances, positions = self.query(latitude, longitude, k + (exclude != None))
+        distances, positions = distances[0], positions[0]
+
+        if exclude != None:
+            keep = self.listings.index[positions] != exclude
+            distances, positions = distances[keep][0:k], positions[keep][0:k]
+
+        comparables = self.listings.iloc[positions].copy()
+        comparables['Distance (km)'] = distances
+
+        return comparables
+
+
+def neighbourhood_features(listings, index, k = 10, radius_km = 1.0, downtown = DOWNTOWN):
+    """
+    Adds to every listing with coordinates, computed for the whole table at once:
+
+    'Comparable Price per sqft': median price per sqft of its k nearest indexed listings
+    'Listings within {radius_km} km': number of indexed listings within radius_km
+    'Distance to Downtown (km)'
+
+    A listing that is itself in the index is left out of its own comparables and count.
+
+    PARAMETERS:
+    listings: (DataFrame) Listings with Latitude / Longitude (index.lat_col / index.lon_col)
+    index: (SpatialIndex) Built over listings with PRICE_COL and AREA_COL
+    """
+    listings = listings.copy()
+    located = listings[index.lat_col].notna() & listings[index.lon_col].notna()
+    rows = listings[located]
+
+    count_col = 'Listings within ' + str(radius_km) + ' km'
+    for column in ['Comparable Price per sqft', count_col, 'Distance to Downtown (km)']:
+        listings[column] = np.nan
+
+    if len(rows) == 0 or len(index) == 0:
+        return listings
+
+    # Position of every listing in the index, found by label (-1 when it is not indexed): a
+    # listing is left out of its own count even when more than k + 1 listings share its coordinates
+    own = index.listings.index.get_indexer(rows.index)
+
+    # One extra neighbour, so that a listing can be dropped (by label) from its own comparables
+    distances, positions = index.query(rows[index.lat_col], rows[index.lon_col], k + 1)
+    is_self = index.listings.index.to_numpy()[positions] == rows.index.to_numpy()[:, None]
+
+    # Keep the first k neighbours that are not the listing itself
+    neighbours = np.where(is_self, -1, positions)
+    order = np.argsort(neighbours == -1, axis = 1, kind = 'stable')[:, 0:k]
+    neighbours = np.take_along_axis(neighbours, order, axis = 1)
+
+    price_per_sqft = (index.listings[PRICE_COL]/index.listings[AREA_COL]).to_numpy(dtype = 'float64')
+    comparable_prices = np.where(neighbours >= 0, price_per_sqft[neighbours], np.nan)
+
+    points = to_unit_vectors(rows[index.lat_col], rows[index.lon_col])
+    self_within = (own >= 0) & (np.linalg.norm(index.points[own] - points, axis = 1) <= km_to_chord(radius_km))
+    counts = index.count_within(rows[index.lat_col], rows[index.lon_col], radius_km) - self_within
+
+    queries = to_radians(rows[index.lat_col], rows[index.lon_col])
+
+    listings.loc[located, 'Comparable Price per sqft'] = np.nanmedian(comparable_prices, axis = 1)
+    listings.loc[located, count_col] = counts
+    listings.loc[located, 'Distance to Downtown (km)'] = haversine_km(queries, np.radians(downtown))
+
+    return listings
@@ -0,0 +1,351 @@
+"""
+Hyperparameter search for the condo price RandomForest.
+
+Random configurations of FOREST_PARAMS are scored by k-fold cross-validation
+(mean validation MAPE) with successive halving: every rung trains the surviving
+configurations with more trees and keeps the best 1/eta of them. Fits run on a
+process pool; the training arrays are put once in shared memory and every worker
+reads its folds from there instead of receiving pickled copies.
+
+Every finished evaluation is appended to a JSONL trial log. Running the same search
+again (same seed) skips whatever the log already holds, so an interrupted search
+resumes where it stopped. The log starts with a fingerprint of the training data,
+the folds and the seed, and a search on anything else refuses to resume from it.
+
+Usage: python tuning.py TorontoCondos-August2020.csv [--trials 64] [--folds 5] [--workers N] [--log tuning_trials.jsonl]
+                        [--max-minutes 30] [--model condo_model.model]
+"""
+import os
+import io
+import json
+import time
+import hashlib
+import argparse
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import condo_model
+
+# Values sampled for every parameter. n_estimators is the resource of successive halving.
+PARAM_SPACE = {'max_depth': [8, 12, 16, 20, 25, 30, None],
+               'max_features': [1, 2, 3, 4, 5, 6],
+               'min_samples_leaf': [1, 2, 3, 4, 6, 8],
+               'min_samples_split': [2, 4, 6, 8, 10],
+               'bootstrap': [True, False]}
+
+# Arrays of the search as seen by every worker process, set once by attach_shared_arrays
+worker_arrays = {}
+worker_memory = []
+
+
+def share_arrays(arrays):
+    """
+    Copies arrays into new shared memory blocks. Returns (blocks, descriptions),
+    where descriptions {name: (block name, shape, dtype)} lets other processes attach.
+    """
+    blocks, descriptions = [], {}
+    for name, array in arrays.items():
+        block = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype = array.dtype, buffer = block.buf)[...] = array
+        blocks.append(block)
+        descriptions[name] = (block.name, array.shape, array.dtype.str)
+
+    return blocks, descriptions
+
+
+def attach_shared_arrays(descriptions):
+    """
+    Process pool initializer: maps the shared arrays into the worker without copying them.
+    """
+    for name, (block_name, shape, dtype) in descriptions.items():
+        try:
+            block = shared_memory.SharedMemory(name = block_name, track = False)
+        except TypeError:
+            # Python < 3.13: the block is registered with the parent's resource tracker, which
+            # already knows it and forgets it when the parent unlinks it
+            block = shared_memory.SharedMemory(name = block_name)
+
+        worker_memory.append(block)
+        worker_arrays[name] = np.ndarray(shape, dtype = dtype, buffer = block.buf)
+
+
+def mape(predictions, y):
+
+    return float(np.mean(np.abs((predictions - y)/y)))
+
+
+def evaluate_fold(params, n_estimators, fold, random_state):
+    """
+    Runs in a worker: fits on every fold but one and returns the MAPE on that one.
+    """
+    from sklearn.ensemble import RandomForestRegressor
+
+    X, y, folds = worker_arrays['X'], worker_arrays['y'], worker_arrays['folds']
+    train, valid = folds != fold, folds == fold
+
+    forest = RandomForestRegressor(n_estimators = n_estimators, random_state = random_state, n_jobs = 1, **params)
+    forest.fit(X[train], y[train])
+
+    return mape(forest.predict(X[valid]), y[valid])
+
+
+def trial_id(params):
+
+    return hashlib.sha1(json.dumps(params, sort_keys = True).encode("utf-8")).hexdigest()[0:12]
+
+
+def sample_configurations(n_trials, seed, space = PARAM_SPACE):
+    """
+    n_trials distinct random configurations, always the same ones for the same seed.
+    """
+    random = np.random.default_rng(seed)
+    configurations = {}
+
+    for _ in range(100*n_trials):
+        params = {name: values[random.integers(len(values))] for name, values in space.items()}
+        configurations.setdefault(trial_id(params), params)
+        if len(configurations) == n_trials:
+            break
+
+    return configurations
+
+
+def search_fingerprint(X, y, folds, seed):
+    """
+    What the scores of a trial depend on besides its parameters: the training data,
+    the cross-validation folds and the seed of the forests.
+    """
+    def digest(array):
+        return hashlib.sha1(np.ascontiguousarray(array).tobytes()).hexdigest()[0:16]
+
+    return {'rows': int(X.shape[0]), 'columns': int(X.shape[1]), 'data': digest(X) + digest(y),
+            'n_folds': int(folds.max()) + 1 if len(folds) else 0, 'folds': digest(folds), 'seed': seed}
+
+
+class TrialLog:
+
+    def __init__(self, file_name, fingerprint):
+        """
+        Append-only JSONL record of finished evaluations: a first line with the
+        fingerprint of the search (see search_fingerprint), then one line per
+        (configuration, number of trees) with its fold scores.
+
+        Raises ValueError if the file is the log of a search with another fingerprint.
+        """
+        self.file_name = file_name
+        self.results = {}
+        header = None
+
+        if os.path.exists(file_name) and os.path.getsize(file_name) > 0:
+            with open(file_name) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue    # Partial last line of an interrupted run
+                    if 'fingerprint' in entry:
+                        header = header or entry['fingerprint']
+                    else:
+                        self.results[(entry['trial'], entry['n_estimators'])] = entry
+
+            if header != fingerprint:
+                raise ValueError("(TrialLog) " + file_name + " is the log of a search on other data, folds or seed; "
+                                 "use another log file to start a new search")
+
+        self.file = open(file_name, 'a')
+        if header == None:
+            self.file.write(json.dumps({'fingerprint': fingerprint}) + "\n")
+            self.file.flush()
+
+    def lookup(self, trial, n_estimators):
+
+        return self.results.get((trial, n_estimators))
+
+    def record(self, entry):
+
+        self.results[(entry['trial'], entry['n_estimators'])] = entry
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+
+    def close(self):
+
+        self.file.close()
+
+
+class HyperparameterSearch:
+
+    def __init__(self, X, y, n_trials = 64, n_folds = 5, min_trees = 10, max_trees = 160, eta = 3,
+                 workers = None, log_file = "tuning_trials.jsonl", max_seconds = None, seed = 0):
+        """
+        PARAMETERS:
+        X, y: (Arrays) Training inputs (condo_model.INPUT_COLS) and prices
+        n_trials: (Int) Random configurations in the first rung
+        n_folds: (Int) Cross-validation folds
+        min_trees, max_trees: (Int) Trees of the first and the last rung; every rung multiplies them by eta
+        eta: (Int) Every rung keeps the best 1/eta configurations
+        workers: (Int or None) Processes fitting forests. None = One per CPU core.
+        log_file: (String) Trial log, also used to resume
+        max_seconds: (Float or None) No new fits are started after this many seconds
+        seed: (Int) Seeds the configurations, the folds and the forests
+        """
+        self.X = np.ascontiguousarray(X, dtype = 'float64')
+        self.y = np.ascontiguousarray(y, dtype = 'float64')
+        self.n_trials = n_trials
+        self.n_folds = n_folds
+        self.min_trees = min_trees
+        self.max_trees = max_trees
+        self.eta = eta
+        self.workers = workers or os.cpu_count() or 1
+        self.log_file = log_file
+        self.max_seconds = max_seconds
+        self.seed = seed
+
+        folds = np.random.default_rng(seed).permutation(len(self.y)) % n_folds
+        self.folds = folds.astype('int8')
+
+    def rungs(self):
+
+        trees = [self.min_trees]
+        while trees[-1]*self.eta <= self.max_trees:
+            trees.append(trees[-1]*self.eta)
+        return trees
+
+    def run(self):
+        """
+        Returns the log entry of the best configuration of the highest rung reached.
+        Raises ValueError if the trial log belongs to another search (see TrialLog).
+        """
+        start_time = time.time()
+        log = TrialLog(self.log_file, search_fingerprint(self.X, self.y, self.folds, self.seed))
+        blocks, descriptions = share_arrays({'X': self.X, 'y': self.y, 'folds': self.folds})
+
+        survivors = sample_configurations(self.n_trials, self.seed)
+        best = None
+
+        try:
+            with ProcessPoolExecutor(max_workers = self.workers, initializer = attach_shared_arrays,
+                                     initargs = (descriptions,)) as executor:
+                for rung, n_estimators in enumerate(self.rungs()):
+                    entries = self.run_rung(executor, log, survivors, rung, n_estimators, start_time)
+                    if not entries:
+                        break
+
+                    entries.sort(key = lambda entry: entry['score'])
+                    best = entries[0]
+                    print("(HyperparameterSearch) Rung " + str(rung) + ": " + str(len(entries)) + " configurations x "
+                          + str(n_estimators) + " trees, best MAPE " + str(round(best['score'], 4)) + " " + str(best['params']))
+
+                    if len(entries) < len(survivors):
+                        break    # Out of time: the rung is incomplete, so it is the last one
+
+                    keep = max(1, len(entries)//self.eta)
+                    survivors = {entry['trial']: entry['params'] for entry in entries[0:keep]}
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+            log.close()
+
+        return best
+
+    def run_rung(self, executor, log, configurations, rung, n_estimators, start_time):
+        """
+        Cross-validates every configuration with n_estimators trees. Returns the log
+        entries of the configurations that finished (from the log when already done).
+        """
+        entries = []
+        pending = {}
+
+        for trial, params in configurations.items():
+            entry = log.lookup(trial, n_estimators)
+            if entry != None:
+                entries.append(entry)
+            else:
+                pending[trial] = {'params': params, 'scores': {}, 'submitted': time.time()}
+
+        futures = {}
+        queue = [(trial, fold) for trial in pending for fold in range(self.n_folds)]
+
+        # Keep the pool busy without queueing work past the time budget
+        while queue or futures:
+            while queue and len(futures) < 2*self.workers and not self.out_of_time(start_time):
+                trial, fold = queue.pop(0)
+                future = executor.submit(evaluate_fold, pending[trial]['params'], n_estimators, fold, self.seed)
+                futures[future] = (trial, fold)
+
+            if not futures:
+                break
+
+            done, _ = wait(futures, return_when = FIRST_COMPLETED)
+            for future in done:
+                trial, fold = futures.pop(future)
+                state = pending[trial]
+                state['scores'][fold] = future.result()
+
+                if len(state['scores']) == self.n_folds:
+                    fold_scores = [state['scores'][fold] for fold in range(self.n_folds)]
+                    entry = {'trial': trial, 'rung': rung, 'n_estimators': n_estimators, 'params': state['params'],
+                             'fold_scores': fold_scores, 'score': float(np.mean(fold_scores)),
+                             'seconds': round(time.time() - state['submitted'], 2)}
+                    log.record(entry)
+                    entries.append(entry)
+
+        return entries
+
+    def out_of_time(self, start_time):
+
+        return self.max_seconds != None and time.time() - start_time > self.max_seconds
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("listings", help = "Crawler output (CSV file or Parquet directory)")
+    parser.add_argument("--geocode-cache", default = "geocode_cache.sqlite")
+    parser.add_argument("--seed-coordinates", help = "Coordinates file to load into the geocode cache first")
+    parser.add_argument("--trials", type = int, default = 64)
+    parser.add_argument("--folds", type = int, default = 5)
+    parser.add_argument("--min-trees", type = int, default = 10)
+    parser.add_argument("--max-trees", type = int, default = 160)
+    parser.add_argument("--eta", type = int, default = 3)
+    parser.add_argument("--workers", type = int)
+    parser.add_argument("--log", default = "tuning_trials.jsonl")
+    parser.add_argument("--max-minutes", type = float)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--model", help = "Train the best configuration on all listings and save it here")
+    args = parser.parse_args()
+
+    with redirect_stdout(io.StringIO()):
+        condos = condo_model.load_training_table(args.listings, args.geocode_cache, args.seed_coordinates)
+    table = condo_model.training_table(condos)
+
+    search = HyperparameterSearch(table[condo_model.INPUT_COLS].to_numpy(), table[condo_model.TARGET_COL].to_numpy(),
+                                  n_trials = args.trials, n_folds = args.folds, min_trees = args.min_trees,
+                                  max_trees = args.max_trees, eta = args.eta, workers = args.workers, log_file = args.log,
+                                  max_seconds = None if args.max_minutes == None else 60*args.max_minutes, seed = args.seed)
+    try:
+        best = search.run()
+    except ValueError as error:
+        print("ERROR (tuning): " + str(error))
+        return
+
+    if best == None:
+        print("ERROR (tuning): No configuration finished within the time budget")
+        return
+
+    print("Best: " + json.dumps(best['params']) + " with " + str(best['n_estimators']) + " trees, CV MAPE "
+          + str(round(best['score'], 4)))
+
+    if args.model:
+        model = condo_model.train(condos, params = dict(best['params'], n_estimators = best['n_estimators']),
+                                  random_state = args.seed)
+        condo_model.save_model(model, args.model)
+        print("Model " + model.version + " written to " + args.model)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -1,10 +1,20 @@
-import requests
 import csv
 import time
+from concurrent.futures import ThreadPoolExecutor
 from math import floor
 from numpy import nan
 from bs4 import BeautifulSoup
 
+from http_transport import HttpTransport, AdaptiveConcurrency
+from response_cache import ResponseCache
+from crawl_output import StreamingCSVWriter, CrawlCheckpoint, ParquetRowWriter, WriterGroup, RowStore, PARQUET_FLUSH_ROWS
+from crawl_pipeline import CrawlPipeline
+from listing_index import IncrementalCrawl
+from crawl_frontier import CrawlFrontier, normalize_href
+from crawl_metrics import CrawlMetrics, MetricsExporter, PageProfiler
+import page_parser
+from page_parser import CompiledPageSpec
+
 class DataContainer:
     
     def __init__(self, name, html_object, name_access, list_type, element_type, labels = True):
@@ -60,12 +70,22 @@ class DataContainer:
         
         self.elements = elements
         
+    def normalize_string(self, string_html):
+        
+        return string_html.strip()
+        
     def compare_strings(self, string, string_html):
         
-        if string == string_html.strip():
+        if string == self.normalize_string(string_html):
             return True
         else:
             return False
+            
+    def field_name(self, label):
+        """
+        Column name for a label, e.g. "Condo Fees:" -> "Condo Fees"
+        """
+        return page_parser.field_name(label)
         
     def check_name(self, container_soup):
         """
@@ -119,8 +139,31 @@ class RealEstateCrawler:
         self.scrap_containers = None
         self.data = []
         
+        self.max_workers = 1
+        self.transport = HttpTransport()
+        self.pipeline = None
+        
+        self.output = None
+        self.flush_rows = 1
+        self.unflushed = []
+        self.unflushed_pages = []
+        self.rooms = False
+        self.rooms_output = None
+        self.checkpoint = None
+        self.incremental = None
+        self.frontier = None
+        
+        self.parser_backend = "lxml" if page_parser.lxml_available() else "html.parser"
+        self.page_spec = None
+        
+        self.metrics = CrawlMetrics()
+        self.exporter = None
+        self.profiler = None
+        self.verbose = True
+        
         self.total_count = total_pages*limit_per_page
         self.counter = 0
+        self.failures = 0
         self.start_time = time.time()
         
     def set_page_link(self, main_http, page):
@@ -147,15 +190,315 @@ class RealEstateCrawler:
         
         self.scrap_containers = containers
         
-    def crawl(self, headers = None, timeout = 5):
+    def set_concurrency(self, max_workers, rate_limit = None):
+        """
+        Listings found on an index page are fetched and scraped by a pool of
+        max_workers threads. Rows are still stored in the order the listings
+        appear on the page, so write() produces the same file as a serial crawl.
+        
+        PARAMETERS:
+        max_workers: (Int) Maximum number of listing requests in flight at once. 1 = Serial Crawl.
+        rate_limit: (Float or None) Maximum requests per second sent to a single host. None = No limit.
+        """
+        self.max_workers = max(1, int(max_workers))
+        
+        if self.transport.pool_size < self.max_workers:
+            self.transport.set_pool_size(self.max_workers)
+        self.transport.set_rate_limit(rate_limit)
+        
+    def set_adaptive_concurrency(self, max_workers, initial_window = 4, rate_limit = None, **options):
+        """
+        Listings are fetched by up to max_workers threads, but only as many requests
+        are let through to a host at once as the site keeps up with: the window grows
+        while the site's p95 latency stays flat and is cut back on 429 / 503 responses
+        and timeouts [See http_transport.AdaptiveConcurrency]. The current window is
+        reported in self.metrics as concurrency_window.
+        
+        PARAMETERS:
+        max_workers: (Int) Fetcher threads, the largest window reachable
+        initial_window: (Int) Requests in flight per host at the start
+        rate_limit: (Float or None) Maximum requests per second sent to a single host. None = No limit.
+        options: Other AdaptiveConcurrency parameters (min_window, decrease, latency_tolerance, ...)
+        """
+        self.set_concurrency(max_workers, rate_limit)
+        
+        controller = AdaptiveConcurrency(initial_window = min(initial_window, self.max_workers),
+                                         max_window = self.max_workers, **options)
+        controller.metrics = self.metrics
+        self.transport.set_concurrency_control(controller)
+        
+    def set_pipeline(self, parse_workers = None, queue_size = 64):
+        """
+        Parse listings in a pool of worker processes, fed by the max_workers fetcher
+        threads through a bounded queue [See crawl_pipeline.CrawlPipeline]. Requires
+        the "lxml" parser backend.
+        
+        PARAMETERS:
+        parse_workers: (Int or None) Parser processes. None = One per CPU core. 0 = Disable the pipeline.
+        queue_size: (Int) Maximum number of fetched pages waiting to be parsed.
+        """
+        if parse_workers == 0:
+            self.pipeline = None
+        else:
+            self.pipeline = CrawlPipeline(self, parse_workers = parse_workers, queue_size = queue_size)
+        
+    def set_transport(self, transport):
+        """
+        Replace the crawler's HttpTransport, e.g. to share one connection pool
+        between several crawlers or to change the retry policy.
+        
+        PARAMETERS:
+        transport: (HttpTransport)
+        """
+        self.transport = transport
+        
+    def set_parser_backend(self, backend):
+        """
+        Choose how pages are parsed.
+        
+        PARAMETERS:
+        backend: (String) "lxml" = The crawl links, particulars and containers are compiled
+                 into XPath selectors once and evaluated with lxml [See page_parser.CompiledPageSpec].
+                 Any other value is handed to BeautifulSoup as its parser (e.g. "html.parser")
+                 and pages are scraped with scraper().
+        """
+        if backend == "lxml" and not page_parser.lxml_available():
+            print("ERROR (set_parser_backend): lxml is not installed, using 'html.parser'")
+            backend = "html.parser"
+            
+        self.parser_backend = backend
+        self.page_spec = None
+        
+    def compile_page_spec(self):
+        """
+        Compile the scraping template for the lxml backend. Called at the start of
+        every crawl so that later changes to the particulars or containers are picked up.
+        """
+        if self.parser_backend == "lxml":
+            self.page_spec = CompiledPageSpec(self.crawler_type, self.crawler_attr,
+                                              self.scrap_particulars, self.scrap_containers, rooms = self.rooms)
+        else:
+            self.page_spec = None
+            
+        return self.page_spec
+        
+    def set_row_store(self, field_names):
+        """
+        Keep the scraped rows in a column-wise store bound to field_names instead of
+        a list of dictionaries [See crawl_output.RowStore]. self.data still iterates
+        as row dictionaries, with only the fields of field_names.
+        """
+        self.data = RowStore(field_names)
+        
+    def set_output(self, file_name, field_names, checkpoint_file = None, parquet_path = None, flush_rows = None):
+        """
+        Stream rows to file_name as they are scraped instead of keeping them in
+        self.data for write(). With a checkpoint_file, completed pages and listings
+        are recorded so that crawl(resume = True) can pick up where a previous
+        crawl stopped.
+        
+        PARAMETERS:
+        file_name: (String) Output CSV file
+        field_names: (List[String]) Column order of the CSV file
+        checkpoint_file: (String or None) Progress file for resumable crawls
+        parquet_path: (String or None) Also write the rows as typed Parquet row groups to this directory [See crawl_output.ParquetRowWriter]
+        flush_rows: (Int or None) Rows are kept in self.data and written in chunks of this many, so memory stays
+                    bounded by the chunk. Listings are checkpointed (and recorded in the listing index
+                    of an incremental crawl) once their chunk is written. Every chunk is a Parquet part file.
+                    None = 1 row, or PARQUET_FLUSH_ROWS rows with a parquet_path.
+        """
+        if flush_rows == None:
+            flush_rows = 1 if parquet_path == None else PARQUET_FLUSH_ROWS
+        
+        self.set_row_store(field_names)
+        self.flush_rows = flush_rows
+        self.unflushed = []
+        self.unflushed_pages = []
+        
+        if parquet_path == None:
+            self.output = StreamingCSVWriter(file_name, field_names)
+        else:
+            self.output = WriterGroup([StreamingCSVWriter(file_name, field_names), ParquetRowWriter(parquet_path, field_names)])
+        
+        if checkpoint_file == None:
+            self.checkpoint = None
+        else:
+            self.checkpoint = CrawlCheckpoint(checkpoint_file)
+        
+    def set_rooms_output(self, file_name = None, dedup = True):
+        """
+        Scrape the rooms of every listing as a table (listing link, room name, level,
+        dimensions) instead of computing Storeys and Floor Area room by room while
+        crawling. Both are computed for a whole chunk of rows at once when self.data
+        is written [See crawl_output.RowStore.track_rooms], and the rooms are written
+        to file_name, so room_table.py can recompute them later without fetching.
+        Every row gets its link as 'Listing': add it to field_names to match the rooms.
+        Requires set_row_store (or set_output); call it after those.
+        
+        The rows recorded by an incremental crawl (listing index and delta file) get the
+        Storeys and Floor Area computed by the store as well.
+        
+        PARAMETERS:
+        file_name: (String or None) Rooms CSV file. None = Only use the rooms for Storeys and Floor Area.
+        dedup: (Boolean) Count a room listed twice in a listing once
+        """
+        if not isinstance(self.data, RowStore):
+            self.error("set_rooms_output", "Rooms are kept by a RowStore, call set_row_store first")
+            return 0
+        
+        from room_table import ROOM_FIELDS
+        
+        self.rooms = True
+        self.data.track_rooms(dedup)
+        self.rooms_output = None if file_name == None else StreamingCSVWriter(file_name, ROOM_FIELDS)
+        return 1
+        
+    def set_incremental(self, index_file, delta_file, field_names, refresh_fraction = 0.05):
+        """
+        Only fetch listings that are new since the last crawl, plus a refresh sample
+        of known ones, and write what changed (new / price-changed / changed / delisted)
+        to delta_file [See listing_index.IncrementalCrawl]. The output of set_output is
+        appended to rather than started over, so it keeps the rows of earlier crawls;
+        the last row of a listing is its latest scrape.
+        
+        PARAMETERS:
+        index_file: (String) Listing index kept between crawls
+        delta_file: (String) CSV file of the changes found by this crawl
+        field_names: (List[String]) Row fields written to the delta file
+        refresh_fraction: (Float) Fraction of the known listings re-scraped every crawl
+        """
+        self.incremental = IncrementalCrawl(index_file, delta_file, field_names, refresh_fraction = refresh_fraction)
+        
+    def set_frontier(self, file_name = None, policy = "new-first", refetch_after = None, stale_pages = 1):
+        """
+        Pass the hrefs of every index page through a frontier [See crawl_frontier.CrawlFrontier]:
+        a listing found on several pages is fetched once, listings fetched in an earlier run
+        are skipped until refetch_after, hrefs beyond limit_per_page wait for the next page
+        instead of being dropped, and paging stops after stale_pages pages with nothing new.
+        
+        PARAMETERS:
+        file_name: (String or None) SQLite file keeping the seen-set between runs. None = This run only.
+        policy: (String) "new-first" or "page-order"
+        refetch_after: (Float or None) Seconds after which a fetched listing is fetched again. None = Never.
+        stale_pages: (Int or None) Index pages in a row without new hrefs before paging stops. None = Never stop early.
+                     Ignored by an incremental crawl (set_incremental), which has to walk every index page
+                     to tell which listings were delisted.
+        """
+        self.frontier = CrawlFrontier(file_name, policy = policy, refetch_after = refetch_after, stale_pages = stale_pages)
+        
+    def set_metrics(self, jsonl_file = None, prometheus_file = None, interval = 10, verbose = False,
+                    profile_every = None, profile_backend = "cprofile", profile_output = None):
+        """
+        Export the crawl's metrics (fetch latency and bytes per host, parse time per
+        page and per container, errors by function, queue depths, rate and ETA)
+        while it runs [See crawl_metrics.CrawlMetrics]. The metrics are always
+        collected in self.metrics; this only sets up where they go.
+        
+        PARAMETERS:
+        jsonl_file: (String or None) Append a JSON snapshot every interval seconds
+        prometheus_file: (String or None) Rewrite in Prometheus text format every interval seconds
+        interval: (Float) Seconds between exports
+        verbose: (Boolean) Keep printing every link, response and row. Errors and progress are always printed.
+        profile_every: (Int or None) Profile one listing in profile_every, fetch and parse [See crawl_metrics.PageProfiler]
+        profile_backend: (String) "cprofile" or "pyinstrument"
+        profile_output: (String or None) File the profile is written to at the end of the crawl. None = Print it.
+        """
+        self.verbose = verbose
+        
+        if jsonl_file == None and prometheus_file == None:
+            self.exporter = None
+        else:
+            self.exporter = MetricsExporter(self.metrics, jsonl_file, prometheus_file, interval)
+            
+        if profile_every == None:
+            self.profiler = None
+        else:
+            self.profiler = PageProfiler(profile_every, profile_backend, profile_output)
+            
+    def error(self, function, message):
+        """
+        Print an error the way the crawler always has and count it by function in self.metrics.
+        """
+        self.metrics.record_error(function)
+        print("ERROR (" + function + "): " + message)
         
+    def crawl(self, headers = None, timeout = 5, resume = False):
+        """
+        PARAMETERS:
+        resume: (Boolean) Skip the pages and listings recorded in the checkpoint file
+                and append to the existing output [See set_output]. Without a checkpoint
+                file there is nothing to resume, and the crawl starts over.
+        """
+        self.compile_page_spec()
+        
+        if resume and (self.checkpoint == None or not self.checkpoint.exists()):
+            # Appending would repeat the rows of the earlier crawl in the output
+            print("(crawl) No checkpoint file to resume from, starting over.")
+            resume = False
+        
+        if self.pipeline != None:
+            if self.page_spec == None:
+                print("ERROR (crawl): The parsing pipeline requires the 'lxml' parser backend, crawling without it")
+            else:
+                self.pipeline.start(self.page_spec)
+        
+        if self.checkpoint != None:
+            self.checkpoint.open(resume)
+        # An incremental crawl only fetches part of the listings: it adds them to the rows of earlier crawls
+        append = resume or self.incremental != None
+        if self.output != None:
+            self.output.open(append = append)
+        if self.rooms_output != None:
+            self.rooms_output.open(append = append)
+        if self.incremental != None:
+            self.incremental.start(resume)
+        if self.frontier != None:
+            self.frontier.start()
+        # Other transports (e.g. record_corpus.RecordingTransport) have no concurrency control
+        concurrency = getattr(self.transport, 'concurrency', None)
+        if concurrency != None and concurrency.metrics == None:
+            concurrency.metrics = self.metrics
+        if self.exporter != None:
+            self.exporter.start()
+            
+        completed = False
+        try:
+            completed = self.page_loop(headers, timeout)
+        finally:
+            if self.pipeline != None:
+                self.pipeline.stop()
+            if self.output != None:
+                self.flush_output()
+                self.output.close()
+            elif self.rooms_output != None:
+                self.rooms_output.write_rows(self.data.room_rows())
+            if self.rooms_output != None:
+                self.rooms_output.close()
+            if self.incremental != None:
+                self.incremental.finish(completed)
+            if self.frontier != None:
+                self.frontier.finish()
+            if self.checkpoint != None:
+                self.checkpoint.close()
+            if self.exporter != None:
+                self.exporter.stop()
+            if self.profiler != None:
+                self.profiler.dump()
+                
+    def page_loop(self, headers, timeout):
+        """
+        Crawl the pages in order. Returns False if the crawl stopped before its
+        last page because a page failed or the frontier had nothing new, True otherwise.
+        """
         if self.total_pages != None:
             for page in range(self.first_page, self.total_pages + self.first_page):
                 page_crawl_result = self.page_crawl(page,headers,timeout)
                 if page_crawl_result != 0:
                     page = page + 1
                 else:
-                    break        
+                    return False
+                if self.frontier_exhausted(page):
+                    return False
         else:
             page = self.first_page
             while True:
@@ -164,24 +507,94 @@ class RealEstateCrawler:
                     page = page + 1
                 else:
                     break
+                if self.frontier_exhausted(page):
+                    return False
+                    
+        return True
                 
+    def frontier_exhausted(self, page):
+        
+        # Delistings are only computed after a complete walk of the index pages
+        if self.incremental != None:
+            return False
+        if self.frontier != None and self.frontier.exhausted():
+            print("(page_loop) No new listings on the last " + str(self.frontier.stale_pages)
+                  + " pages, stopping before page " + str(page))
+            return True
+        return False
+        
     def page_crawl(self, page, headers, timeout):
         
+        if self.checkpoint != None and self.checkpoint.page_done(page):
+            print("(page_crawl) Page " + str(page) + " already completed, skipping.")
+            return 1
+        
         page_link = self.set_page_link(self.main_http, page)
                 
-        page_soup = self.soupify_request(page_link, headers, timeout)
+        page_html = self.fetch_page(page_link, headers, timeout)
         
-        if page_soup != 0:
-            crawl_list = self.set_crawl_list(page_soup)
+        if page_html != 0:
+            crawl_list = self.set_crawl_list(page_html)
             if crawl_list != 0:
-                self.item_crawler(crawl_list)
+                if self.frontier != None:
+                    crawl_list = self.frontier_batch(crawl_list, page_link)
+                self.item_crawler(crawl_list, headers, timeout)
+                
+                if self.checkpoint != None:
+                    if self.unflushed:
+                        # Marked done once its last listings are written
+                        self.unflushed_pages.append(page)
+                    else:
+                        self.checkpoint.mark_page(page)
                 return 1
             else:
                 return 0
         else:
-            print("ERROR: Request made to page " + str(page) + " could not be completed")
+            self.error("page_crawl", "Request made to page " + str(page) + " could not be completed")
             return 0
         
+    def frontier_batch(self, crawl_list, page_link):
+        """
+        Add the listings of an index page to the frontier and take the next ones to fetch.
+        With an incremental crawl, every listing of the page is marked seen and the
+        incremental selection (new listings and refresh sample) is what the frontier queues.
+        """
+        selected = None
+        if self.incremental != None:
+            crawl_list = [normalize_href(href, page_link) for href in crawl_list]
+            self.incremental.seen(crawl_list)
+            selected = set(self.incremental.select(crawl_list))
+        
+        self.frontier.add_page(crawl_list, page_link, selected = selected)
+        return self.frontier.next_batch(self.limit_per_page)
+        
+    def fetch_page(self, link, headers = None, timeout = 5):
+        """
+        Sends request to a webpage link and returns the HTML text of the response.
+        
+        PARAMETERS:
+        link: (String) The http target link
+        headers: (Dictionary) Any headers to add
+        """
+        start_time = time.perf_counter()
+        response, reason = self.transport.get(link, headers = headers, timeout = timeout)
+        
+        if reason != None:
+            outcome = "error"
+        elif getattr(response, 'from_cache', False):
+            outcome = "cache"
+        else:
+            outcome = "ok"
+        self.metrics.record_fetch(link, time.perf_counter() - start_time, response, outcome)
+        
+        if reason != None:
+            self.error("soupify_request", "Request to " + link + " failed: " + reason)
+            return 0
+        else:
+            if self.verbose:
+                print("(soupify_request) Request to " + link + " was successful with status code: " + str(response.status_code))
+            return response.text
+            
     def soupify_request(self, link, headers = None, timeout = 5):
         """
         Sends request to a webpage link and transforms the response into a 
@@ -191,24 +604,44 @@ class RealEstateCrawler:
         link: (String) The http target link
         headers: (Dictionary) Any headers to add
         """
-        try:
-            response = requests.get(link, headers = headers, timeout = timeout)
-        except:
-            status_code = response.status_code
-            print("ERROR (soupify_request): Request to " + link + " failed with status code: " + str(status_code))
-            
+        page_html = self.fetch_page(link, headers, timeout)
+        
+        if page_html == 0:
             return 0
         else:
-            status_code = response.status_code
-            print("(soupify_request) Request to " + link + " was successful with status code: " + str(status_code))
-            if status_code == requests.codes.ok:
-                return BeautifulSoup(response.text, "html.parser")
-            else:
-                return 0
+            return BeautifulSoup(page_html, self.soup_features())
             
-    def set_crawl_list(self, soup):
+    def soup_features(self):
         
-        crawl_list = soup.find_all(self.crawler_type, self.crawler_attr)
+        if self.parser_backend == "lxml":
+            return "lxml"
+        else:
+            return self.parser_backend
+            
+    def scrape_page(self, page_html, link):
+        """
+        Parse a listing page into a row dictionary with the selected parser backend.
+        """
+        if self.page_spec != None:
+            stats = {}
+            data = self.page_spec.parse(page_html, link, stats)
+            self.metrics.record_parse(stats)
+            return data
+        else:
+            with self.metrics.timer('parse_page_seconds'):
+                return self.scraper(BeautifulSoup(page_html, self.soup_features()), link)
+            
+    def set_crawl_list(self, page_html):
+        """
+        Returns the hrefs of the crawl buttons found on an index page, or 0 if there are none.
+        Without a frontier only the first limit_per_page hrefs are kept.
+        """
+        if self.page_spec != None:
+            crawl_list = self.page_spec.crawl_links(page_html)
+        else:
+            page_soup = BeautifulSoup(page_html, self.soup_features())
+            crawl_list = [access_button['href'] for access_button in page_soup.find_all(self.crawler_type, self.crawler_attr)]
+            
         crawl_size = len(crawl_list)
         print("Crawl Size:" + str(crawl_size))
         
@@ -216,11 +649,14 @@ class RealEstateCrawler:
             #print(crawl_list)
             return crawl_list
         elif crawl_size == 0:
-            print("ERROR (set_crawl_list): crawl_list has zero size")
+            self.error("set_crawl_list", "crawl_list has zero size")
             return 0
+        elif self.frontier != None:
+            return crawl_list
         else:
             crawl_list = crawl_list[0:self.limit_per_page]
-            print(crawl_list)
+            if self.verbose:
+                print(crawl_list)
             return crawl_list
         
     def scraper(self, soup, link):
@@ -238,58 +674,103 @@ class RealEstateCrawler:
             
         for data_container in self.scrap_containers:
             
-            container_soup = self.soupify_container(soup, data_container)
+            with self.metrics.timer('parse_container_seconds', container = str(data_container.name)):
+                self.scrape_container(soup, data_container, data_dict, link)
+                    
+        return data_dict
+    
+    def scrape_container(self, soup, data_container, data_dict, link):
+        """
+        Add the fields of one DataContainer to the row data_dict.
+        """
+        container_soup = self.soupify_container(soup, data_container)
+        
+        if data_container.labels:
             
-            if data_container.labels:
+            if container_soup == 0:
                 
-                if container_soup == 0:
+                for element in data_container.elements:
+                    name = element['name'][0:-1]
                     
-                    for element in data_container.elements:
-                        name = element['name'][0:-1]
-                        
-                        data_dict[name] = nan  
-                else:
-                    container_list = container_soup.find_all(data_container.element_type)
-                    
-                    for element in data_container.elements:
-                        
-                        name = element['name'][0:-1] #Take away colon : at the end of string
-                        
-                        data_dict[name] = self.access_string_container(container_list, data_container, element)
+                    data_dict[name] = nan  
             else:
-                # This is for the Room Data Container
+                container_list = container_soup.find_all(data_container.element_type)
+                label_index = self.label_index(container_list, data_container)
                 
-                if container_soup == 0:
-                    data_dict['Storeys'] = nan
-                    data_dict['Floor Area (m^2)'] = nan
-                else:              
-                    storeys_area = self.compute_levels_and_space(container_soup, data_container, link)
-                    data_dict['Storeys'] = storeys_area['Storeys']
-                    data_dict['Floor Area (m^2)'] = storeys_area['Floor Area']
+                for element in data_container.elements:
                     
-        return data_dict
+                    name = element['name'][0:-1] #Take away colon : at the end of string
+                    
+                    data_dict[name] = self.access_string_container(label_index, data_container, element)
+                    
+                # Labels that are not configured are kept too, so new fields show up in the data
+                for label, value in label_index.items():
+                    data_dict.setdefault(data_container.field_name(label), value)
+        else:
+            # This is for the Room Data Container
+            
+            if container_soup == 0:
+                data_dict['Storeys'] = nan
+                data_dict['Floor Area (m^2)'] = nan
+            elif self.rooms:
+                data_dict['Rooms'] = self.room_rows(container_soup, data_container, link)
+            else:              
+                storeys_area = self.compute_levels_and_space(container_soup, data_container, link)
+                data_dict['Storeys'] = storeys_area['Storeys']
+                data_dict['Floor Area (m^2)'] = storeys_area['Floor Area']
     
-    def access_string_container(self, container_list, DataContainer, element):
+    def label_index(self, container_list, DataContainer):
         """
-        Perform a linear search through container_list to find the relevant piece
-        of data as provided by element and return it.
+        Parse every item of container_list once into a dictionary of
+        label -> value. Labels are normalized with DataContainer.normalize_string
+        and the first item carrying a label wins. Labels that are not among
+        DataContainer.elements are included as well.
+        
+        PARAMETERS:
+        container_list: (List[BeautifulSoup]) The element_type items of the container
+        DataContainer: (DataContainer)
         """
+        label_specs = []
+        for element in DataContainer.elements:
+            spec = (element['type'], element['index'], element['value type'], element['value index'])
+            if spec not in label_specs:
+                label_specs.append(spec)
+                
+        label_index = {}
+        
         for item in container_list:
-            #print("Type Soup: " + str(item))
-            item_name = item.find_all(element['type'])[element['index']].string.strip()
+            found = {}
             
-            if DataContainer.compare_strings(element['name'], item_name):
+            for label_type, label_idx, value_type, value_idx in label_specs:
+                
+                if label_type not in found:
+                    found[label_type] = item.find_all(label_type)
+                    
                 try:
-                    string = item.find_all(element['value type'])[element['value index']].string.strip()
+                    label = DataContainer.normalize_string(found[label_type][label_idx].string)
                 except:
-                    print("ERROR (access_string_container): Found 'NoneType' Object")
-                    return nan
-                else:
-                    return string
-            else:
-                pass
+                    continue
+                
+                if label in label_index:
+                    continue
+                
+                if value_type not in found:
+                    found[value_type] = item.find_all(value_type)
+                    
+                try:
+                    label_index[label] = found[value_type][value_idx].string.strip()
+                except:
+                    self.error("access_string_container", "Found 'NoneType' Object")
+                    label_index[label] = nan
+                    
+        return label_index
         
-        return nan
+    def access_string_container(self, label_index, DataContainer, element):
+        """
+        Look up the relevant piece of data as provided by element in the
+        container's label_index [See label_index].
+        """
+        return label_index.get(DataContainer.normalize_string(element['name']), nan)
         
     def soupify_container(self, page_soup, DataContainer):
         """
@@ -302,7 +783,7 @@ class RealEstateCrawler:
         try:
             container_soup = page_soup.find_all(DataContainer.details['type'], DataContainer.details['attr'])[DataContainer.details['index']]
         except:
-            print("ERROR (soupify_container): Index out of range for " + DataContainer.name + ".")
+            self.error("soupify_container", "Index out of range for " + DataContainer.name + ".")
         else:
             
             if DataContainer.check_name(container_soup) == 0:
@@ -314,27 +795,133 @@ class RealEstateCrawler:
                     return 0
                 
         
-    def item_crawler(self, crawl_list):
+    def item_crawler(self, crawl_list, headers = None, timeout = 5):
+        """
+        For each item displayed on the webpage, go to its http link and scrape 
+        data. With max_workers > 1 the links are fetched concurrently, but results
+        are collected in the order of crawl_list.
+        
+        PARAMETERS:
+        crawl_list: (List[String]) hrefs returned by set_crawl_list
         """
-        For each item displayed on the webpage, find the associated http link
-        and go to there to scrape data.
+        hrefs = crawl_list
+        
+        # With a frontier, the incremental selection was made on the whole page [See frontier_batch]
+        incremental = self.incremental != None and self.frontier == None
+        
+        if incremental:
+            # Every listing on the page is still listed, including those the checkpoint skips
+            self.incremental.seen(hrefs)
+        if self.checkpoint != None:
+            hrefs = [href for href in hrefs if not self.checkpoint.item_done(href)]
+            
+        if incremental:
+            hrefs = self.incremental.select(hrefs)
+            
+        self.metrics.set('queue_depth', len(hrefs), queue = "page_listings")
         
+        if self.pipeline != None and self.pipeline.parse_pool != None:
+            self.pipeline.run(hrefs, headers, timeout)
+        elif self.max_workers > 1:
+            with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+                results = executor.map(lambda href: self.item_scrape(href, headers, timeout), hrefs)
+                
+                for href, data in zip(hrefs, results):
+                    self.store_item(href, data)
+        else:
+            for href in hrefs:
+                self.store_item(href, self.item_scrape(href, headers, timeout))
+                
+    def item_scrape(self, href, headers = None, timeout = 5):
         """
-        for access_button in crawl_list:
+        Request a single listing and scrape it.
+        
+        PARAMETERS:
+        href: (String) The http link of the listing
+        """
+        if self.profiler != None:
+            return self.profiler.run(self.fetch_and_scrape, href, headers, timeout)
+        else:
+            return self.fetch_and_scrape(href, headers, timeout)
             
-            href = access_button['href']
+    def fetch_and_scrape(self, href, headers = None, timeout = 5):
+        
+        if self.verbose:
             print(href)
-            soup = self.soupify_request(href)
-            if soup != 0:
-                
-                data = self.scraper(soup, href)
+        page_html = self.fetch_page(href, headers, timeout)
         
-            print(data)
-            print("\n")
+        if page_html == 0:
+            self.error("item_scrape", "Listing '" + href + "' could not be scraped")
+            return 0
+        else:
+            return self.scrape_page(page_html, href)
+            
+    def store_item(self, href, data):
+        """
+        Keep a scraped row in self.data, which is written to the output file
+        every flush_rows rows when there is one. Rows are stored in the order of the index page.
+        """
+        self.counter = self.counter + 1
+        self.metrics.item_done(data != 0, self.total_count)
+        self.metrics.inc('queue_depth', -1, queue = "page_listings")
+        
+        if data != 0:
+            if self.verbose:
+                print(data)
+                print("\n")
             
+            if self.rooms:
+                data['Listing'] = href
             self.data.append(data)
-            self.counter = self.counter +1
-            self.time_left()
+            
+            if self.rooms and self.incremental != None and self.output == None:
+                # Storeys and Floor Area are computed by the store, from the rooms
+                data.update(self.data[len(self.data) - 1])
+            
+            if self.output != None:
+                # The listing index is updated with the checkpoint, once the row is written
+                self.unflushed.append((href, data if self.incremental != None else None))
+                if len(self.data) >= self.flush_rows:
+                    self.flush_output()
+            else:
+                self.mark_done(href, data)
+        else:
+            self.failures = self.failures + 1
+            
+        self.time_left()
+            
+    def flush_output(self):
+        """
+        Write the rows kept in self.data to the output, then checkpoint their listings.
+        """
+        self.output.write_rows(self.data)
+        if self.rooms_output != None:
+            self.rooms_output.write_rows(self.data.room_rows())
+        # The Parquet writer buffers rows: they must be on disk before they are checkpointed
+        self.output.sync()
+        if self.rooms and self.incremental != None:
+            # The listing index and the delta file get the Storeys and Floor Area computed by the store
+            for position, (href, data) in enumerate(self.unflushed):
+                data.update(self.data[position])
+        self.data.clear()
+        
+        for href, data in self.unflushed:
+            self.mark_done(href, data)
+        for page in self.unflushed_pages:
+            self.checkpoint.mark_page(page)
+        self.unflushed = []
+        self.unflushed_pages = []
+        
+    def mark_done(self, href, data):
+        """
+        Record a listing whose row is stored for good in the checkpoint, the listing index and the frontier.
+        """
+        if self.checkpoint != None:
+            self.checkpoint.mark_item(href)
+        if self.incremental != None:
+            self.incremental.record(href, data)
+        if self.frontier != None:
+            self.frontier.mark_fetched(href)
             
     def access_string_particular(self, soup, value):
          """
@@ -353,11 +940,11 @@ class RealEstateCrawler:
          prop_index = prop['index']
                  
          if soup_size == 0:
-             print("ERROR (access_string_particular): Failed Attempt at finding '" + value + "', found zero results.")
+             self.error("access_string_particular", "Failed Attempt at finding '" + value + "', found zero results.")
              return 0
          
          elif soup_size < prop_index:
-             print("ERROR (access_string_particular): Desired argument (order) out of bounds for '" + value + "'. Only found " + str(soup_size) + " results.")
+             self.error("access_string_particular", "Desired argument (order) out of bounds for '" + value + "'. Only found " + str(soup_size) + " results.")
              return 0
          
          else:
@@ -417,7 +1004,7 @@ class RealEstateCrawler:
                 level_info = info_depth.find_all(storey_type, storey_attr)[storey_idx].text.strip().split(" ")[0]
                 #print("Level Info: " + str(level_info))
             except:
-                print("ERROR (compute_levels_and_space): Attempt at extracting Room Level Info for '" + link + "' failed.")
+                self.error("compute_levels_and_space", "Attempt at extracting Room Level Info for '" + link + "' failed.")
                 element_level = -1
             else:
                 element_level = self.extract_storey_level(level_info)
@@ -430,7 +1017,7 @@ class RealEstateCrawler:
                 try:
                     area_info = info_depth.find_all(area_type, area_attr)[area_idx].string
                 except:
-                    print("ERROR (compute_levels_and_space): Attempt at extracting Room Area Info for '" + link + "' failed.")
+                    self.error("compute_levels_and_space", "Attempt at extracting Room Area Info for '" + link + "' failed.")
                     element_area = 0
                 else:
                     element_area = self.extract_area(area_info, link)
@@ -450,24 +1037,54 @@ class RealEstateCrawler:
             
         return {'Storeys': max_storey, 'Floor Area': total_area}
              
+    def room_rows(self, soup, DataContainer, link):
+        """
+        The raw text of every room of a listing, as (link, name, level, dimensions)
+        with None for what was not found. Nothing is parsed here: Storeys and Floor
+        Area are computed from these rows later [See room_table.levels_and_space].
+        
+        PARAMETERS:
+        soup: (BeautifulSoup Object) Data relevant to DataContainer
+        DataContainer: (DataContainer Object) Rooms container. The last element of its tree
+                       may have a 'name' entry, looked up in the list item itself.
+        """
+        element_list = soup.find(DataContainer.list_type).find_all(DataContainer.element_type)
+        element_tree = DataContainer.elements
+        tot_depth = len(element_tree)
+        last_depth = element_tree[tot_depth-1]
+        
+        rooms = []
+        for element_soup in element_list:
+            info_depth = self.tree_dig(element_soup, element_tree, tot_depth)
+            row = [link]
+            
+            for soup_part, spec in [(element_soup, last_depth.get('name')), (info_depth, last_depth['level']),
+                                    (info_depth, last_depth['area'])]:
+                if spec == None:
+                    row.append(None)
+                    continue
+                
+                found = soup_part.find_all(spec['value type'], spec['value attr'])
+                if len(found) <= spec['value index']:
+                    row.append(None)
+                elif spec is last_depth['area']:
+                    row.append(found[spec['value index']].string)
+                else:
+                    row.append(found[spec['value index']].text.strip())
+                    
+            rooms.append(tuple(row))
+            
+        return rooms
+        
     def extract_area(self, area_info, link):
         """
         Finds the two values for the lengths of the area dimensions and 
-        multiplies them together.
+        multiplies them together [See page_parser.extract_area].
         
         PARAMETERS:
         area_info: (String) We assume that this has the format "float_1 m x float_2 m"
         """
-        area_info_split = area_info.strip().split(" ")
-        
-        try:
-            first_num = float(area_info_split[0])
-            second_num = float(area_info_split[3])
-        except:
-            print("ERROR (extract_area): Attempted Area Float Conversion for '" + link + "' failed." )
-            return 0
-        else:
-            return round(first_num*second_num,2)
+        return page_parser.extract_area(area_info, link)
         
     def tree_dig(self, element_soup, element_tree, tot_depth):
         """
@@ -491,66 +1108,46 @@ class RealEstateCrawler:
     
     def extract_storey_level(self, storey_string):
         """
-        Modify floor according to target website format. RoyalLePage storey_strings
-        take the form 'Lower Level'/'Basement Level' 'Sub-Basement Level', 'Main Level'/'Ground Level', 
-        'Flat/Apartment Level', 'In-Between Level', '2nd Level', 'Upper Level', '3rd Level'.
+        Converts a RoyalLePage level string into a storey number [See page_parser.extract_storey_level].
         
         PARAMETERS:
         storey_string: (String) The string corresponding to html_object.string for storey_level
         """
-        
-        try: 
-            floor = storey_string[0].upper()
-        except:
-            print("ERROR (extract_storey_level): Floor Index 0 out of range")
-            return 0
-        else:
-            
-            if floor in ["L", "B", "S"]:
-                return 0
-            elif floor in ["M", "G", "I", "F"]:
-                return 1
-            elif floor in ["U"]:
-                return 2
-            else:
-                try:
-                    floor_val = int(floor)
-                except:
-                    print("ERROR (extract_storey_level): New 'Level' String Found -> assigned Basement Value 0")
-                    return 0
-                else:
-                    return floor_val
+        return page_parser.extract_storey_level(storey_string)
             
     def write(self, file_name, field_names):
-        
+        """
+        Write self.data to a CSV file. Fields not in field_names (such as
+        unconfigured container labels) are left out.
+        """
         with open(file_name, 'w') as file:
             
-            writer = csv.DictWriter(file, delimiter = ",", fieldnames = field_names)
+            writer = csv.DictWriter(file, delimiter = ",", fieldnames = field_names, extrasaction = 'ignore')
             writer.writeheader()
             writer.writerows(self.data)
         
         print("\nWrote Data to " + file_name)
         
-    def time_left(self):
-        
-        start_time = self.start_time
-        
-        time_now = time.time()
-        counter = self.counter
+    def write_parquet(self, path, field_names):
+        """
+        Write self.data as a typed Parquet dataset [See crawl_output.ParquetRowWriter].
+        """
+        writer = ParquetRowWriter(path, field_names)
+        writer.open()
         
-        if counter % 10 == 0 and counter != 0:
-            
-            time_passed = time_now - start_time
-            
-            velocity = time_passed/counter
+        for row in self.data:
+            writer.write_row(row)
             
-            total_time = velocity*self.total_count
-            
-            time_left = total_time - time_passed
-            
-            minutes, seconds = self.seconds_to_mins(time_left)
-            print("Data Collected: " + str(counter) + "/" + str(self.total_count))
-            print("\nAPPROX. TIME LEFT: " + str(minutes) + " MINS, " + str(seconds) + "s.\n")
+        writer.close()
+        
+    def time_left(self):
+        """
+        Print the crawl's progress every 10 listings. The ETA comes from the rate of
+        the most recent listings [See crawl_metrics.CrawlMetrics.item_done], so it
+        follows the crawl as it speeds up or slows down.
+        """
+        if self.counter % 10 == 0 and self.counter != 0:
+            print(self.metrics.progress(self.total_count))
     
     def seconds_to_mins(self, time_secs):
         
@@ -560,11 +1157,11 @@ class RealEstateCrawler:
         
         return minutes, seconds
     
-def main():
-    
-    total_pages = 22
-    limit_per_page = 46
-    
+def condo_crawler(city_key, homes_link, total_pages, limit_per_page):
+    """
+    Builds a RealEstateCrawler configured with the RoyalLePage condo listing
+    containers. Returns the crawler and the field_names to write with.
+    """
     # Building Features Data Container
     BF_name = "Building Features:"
     BF_html_obj = ["div", {'class': "details-row"}, 0]
@@ -616,7 +1213,8 @@ def main():
     
     room_elements = [{'value type': 'span', 'value index': 1},
                      {'level': {'value type': 'span', 'value attr': {"class": "row-1"}, 'value index': 0}, 
-                      'area': {'value type': 'span', 'value attr': {"class": "metre metre-or-feet"}, 'value index': 0}}
+                      'area': {'value type': 'span', 'value attr': {"class": "metre metre-or-feet"}, 'value index': 0},
+                      'name': {'value type': 'span', 'value attr': {"class": "room-name"}, 'value index': 0}}
                      ]
     
     rooms.set_elements(room_elements)
@@ -626,9 +1224,6 @@ def main():
                    "OwnershipType", "Property Type", "Bedrooms", "Bathrooms", "Amenities Nearby", "Lot Size", "Parking Type", "No. of Parking Spaces",
                    "Storeys", "Floor Area (m^2)", "Features", "Condo Fees", "Community Features", "Price"]
 
-    homes_link = ["https://www.royallepage.ca/en/on/", "/condos/properties/", "/"]
-    city_key = 'Toronto'
-    
     scraper_particulars = {
             'Price': {'type': 'span', 'attr': {'class':'title title--h1 price'}, 'index': 0, 'sibling': None, 'child': 'span', 'child index': 0},
             'Address': {'type': 'h2', 'attr': {'class': "title--h2 u-no-margins"}, 'index': 0, 'sibling': None, 'child': None, 'child index': None }
@@ -644,9 +1239,30 @@ def main():
     crawler.set_crawler_property(html_type = 'a', html_attr = crawl_attributes)
     crawler.set_scraper_particulars(scraper_particulars)
     crawler.set_scraper_containers(scraper_containers)
-    crawler.crawl() #Engage Crawl
+    crawler.set_row_store(field_names)
+    
+    return crawler, field_names
+    
+def main():
+    
+    total_pages = 22
+    limit_per_page = 46
+    
+    homes_link = ["https://www.royallepage.ca/en/on/", "/condos/properties/", "/"]
+    city_key = 'Toronto'
+    
+    crawler, field_names = condo_crawler(city_key, homes_link, total_pages, limit_per_page)
+    
+    crawler.set_concurrency(max_workers = 8, rate_limit = 4) # Be polite to the target site
+    
+    # Re-runs within a day are served from disk. Use offline = True to replay without the network.
+    crawler.transport.set_cache(ResponseCache("royallepage_cache.sqlite", ttl = 24*3600))
     
-    crawler.write("TorontoCondos-August2020Listings.csv", field_names)
+    # Rows are written as they are scraped. Delete the checkpoint file to start over:
+    # without one the output is rewritten instead of appended to.
+    crawler.set_output("TorontoCondos-August2020Listings.csv", field_names,
+                       checkpoint_file = "TorontoCondos-August2020Listings.checkpoint")
+    crawler.crawl(resume = True) #Engage Crawl
     
 if __name__ == '__main__':
     